@@ -0,0 +1,188 @@
+# backend/admission.py
+"""
+Admission control for the inference endpoints.
+
+Each inference endpoint gets a bounded queue in front of a fixed number of
+concurrent slots. A request is admitted, queued, or rejected at once with
+503 and a Retry-After header when:
+
+    - the queue is full (ADMISSION_<ENDPOINT>_QUEUE waiting requests), or
+    - the expected wait exceeds the client's deadline.
+
+The expected wait is the number of requests ahead divided by the slot
+count, times an EWMA of recent service times. Clients send their deadline
+as X-Request-Deadline-Ms (milliseconds left, relative to now); without it
+ADMISSION_DEFAULT_DEADLINE_MS applies, and 0 means no deadline. A queued
+request whose deadline passes before it gets a slot is rejected too, so
+nothing is computed for a client that has already given up.
+
+A flood of /fashion-predict calls from one outfit match therefore fills
+its own queue and gets shed, while /predict keeps its own slots.
+"""
+import os
+import time
+import math
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1").lower() in ("1", "true", "yes")
+ADMISSION_DEFAULT_DEADLINE_MS = float(os.environ.get("ADMISSION_DEFAULT_DEADLINE_MS", "0"))
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+# Weight of the newest service time in the EWMA
+EWMA_ALPHA = 0.2
+
+# Route path -> (endpoint name, default concurrency, default queue size)
+ADMITTED_ROUTES = {
+    "/predict": ("predict", 4, 32),
+    "/classify-and-save": ("classify_and_save", 4, 32),
+    "/fashion-predict": ("fashion_predict", 8, 64),
+    "/fashion-rank": ("fashion_rank", 2, 16),
+}
+
+QUEUE_DEPTH = Gauge(
+    "drippedup_admission_queue_depth",
+    "Requests waiting for an inference slot, by endpoint",
+    ["endpoint"]
+)
+ACTIVE = Gauge(
+    "drippedup_admission_active",
+    "Requests holding an inference slot, by endpoint",
+    ["endpoint"]
+)
+SERVICE_SECONDS_EWMA = Gauge(
+    "drippedup_admission_service_seconds_ewma",
+    "Moving average of the time requests hold a slot, by endpoint",
+    ["endpoint"]
+)
+REJECTED = Counter(
+    "drippedup_admission_rejected_total",
+    "Requests shed by admission control, by endpoint and reason (queue_full, deadline, expired)",
+    ["endpoint", "reason"]
+)
+
+
+class Overloaded(Exception):
+    """Raised when a request is not admitted. retry_after is in seconds."""
+
+    def __init__(self, endpoint: str, reason: str, retry_after: float):
+        super().__init__(f"{endpoint} overloaded ({reason})")
+        self.endpoint = endpoint
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded queue and concurrency limit for one endpoint."""
+
+    def __init__(self, endpoint: str, concurrency: int, max_queue: int, initial_service_seconds: float = 0.1):
+        self.endpoint = endpoint
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.service_seconds = initial_service_seconds
+        self.active = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(self.concurrency)
+        SERVICE_SECONDS_EWMA.set(self.service_seconds, endpoint=endpoint)
+
+    def expected_wait(self) -> float:
+        """Seconds a request arriving now is expected to wait for a slot."""
+        if self.active < self.concurrency:
+            return 0.0
+        return (self.waiting + 1) / self.concurrency * self.service_seconds
+
+    def _reject(self, reason: str, retry_after: float):
+        REJECTED.inc(endpoint=self.endpoint, reason=reason)
+        raise Overloaded(self.endpoint, reason, retry_after)
+
+    @asynccontextmanager
+    async def admit(self, deadline_seconds: Optional[float] = None):
+        """Hold a slot for the enclosed block, or raise Overloaded."""
+        wait = self.expected_wait()
+        if wait > 0 and self.waiting >= self.max_queue:
+            self._reject("queue_full", wait)
+        if deadline_seconds is not None and wait > deadline_seconds:
+            self._reject("deadline", wait)
+
+        self.waiting += 1
+        QUEUE_DEPTH.inc(endpoint=self.endpoint)
+        try:
+            if deadline_seconds is None or not self._slots.locked():
+                await self._slots.acquire()
+            else:
+                try:
+                    await asyncio.wait_for(self._slots.acquire(), timeout=max(deadline_seconds, 0))
+                except asyncio.TimeoutError:
+                    self._reject("expired", self.expected_wait())
+        finally:
+            self.waiting -= 1
+            QUEUE_DEPTH.dec(endpoint=self.endpoint)
+
+        self.active += 1
+        ACTIVE.inc(endpoint=self.endpoint)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.service_seconds += EWMA_ALPHA * (elapsed - self.service_seconds)
+            SERVICE_SECONDS_EWMA.set(self.service_seconds, endpoint=self.endpoint)
+            self.active -= 1
+            ACTIVE.dec(endpoint=self.endpoint)
+            self._slots.release()
+
+    def describe(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "service_seconds_ewma": round(self.service_seconds, 4),
+            "expected_wait_seconds": round(self.expected_wait(), 4)
+        }
+
+
+def _limit(endpoint: str, setting: str, default: int) -> int:
+    return int(os.environ.get(f"ADMISSION_{endpoint.upper()}_{setting}", str(default)))
+
+
+# Route path -> controller; controllers are created on first use so their
+# semaphores belong to the server's event loop
+_controllers: Dict[str, AdmissionController] = {}
+
+
+def controller_for(path: str) -> Optional[AdmissionController]:
+    """The controller guarding a route path, or None if the route is not admission-controlled."""
+    if not ADMISSION_ENABLED or path not in ADMITTED_ROUTES:
+        return None
+    controller = _controllers.get(path)
+    if controller is None:
+        endpoint, concurrency, max_queue = ADMITTED_ROUTES[path]
+        controller = AdmissionController(endpoint, _limit(endpoint, "CONCURRENCY", concurrency),
+                                         _limit(endpoint, "QUEUE", max_queue))
+        _controllers[path] = controller
+    return controller
+
+
+def request_deadline(headers) -> Optional[float]:
+    """Seconds the client is willing to wait, from X-Request-Deadline-Ms or the default."""
+    value = headers.get(DEADLINE_HEADER)
+    if value is not None:
+        try:
+            # A deadline that has already passed is rejected unless a slot is free
+            return max(float(value), 0.0) / 1000
+        except ValueError:
+            logger.warning(f"Ignoring invalid {DEADLINE_HEADER} header: {value!r}")
+    return ADMISSION_DEFAULT_DEADLINE_MS / 1000 if ADMISSION_DEFAULT_DEADLINE_MS > 0 else None
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+def describe() -> Dict:
+    return {controller.endpoint: controller.describe() for controller in _controllers.values()}
@@ -0,0 +1,311 @@
+# backend/api_load_bench.py
+"""
+End-to-end load test for the DrippedUp API.
+
+Starts the FastAPI app in a subprocess against the local storage backend
+(in a throwaway directory) with randomly initialized models, seeds a few
+users with the sample images in images/, then drives each endpoint at the
+requested concurrency and prints a JSON report with throughput and latency
+percentiles per endpoint.
+
+    python api_load_bench.py --concurrency 8 --requests 200 --output run.json
+    python api_load_bench.py --compare baseline.json
+
+Pass --url to benchmark an already running server instead.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional
+import httpx
+
+BACKEND_DIR = Path(__file__).parent
+SAMPLE_IMAGES_DIR = BACKEND_DIR / "images"
+ALL_ENDPOINTS = ["predict", "save-item", "items-grouped", "outfits", "fashion-predict"]
+CONTENT_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    """Summarize one endpoint run. Latencies are in seconds."""
+    ordered = sorted(latencies)
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed > 0 else None,
+        "latency_ms": {
+            "mean": to_ms(sum(ordered) / len(ordered)) if ordered else None,
+            "p50": to_ms(percentile(ordered, 50)),
+            "p95": to_ms(percentile(ordered, 95)),
+            "p99": to_ms(percentile(ordered, 99)),
+            "max": to_ms(ordered[-1]) if ordered else None
+        }
+    }
+
+
+def load_sample_images() -> List[Dict]:
+    """Return the sample images shipped in images/ as upload payloads."""
+    samples = []
+    for path in sorted(SAMPLE_IMAGES_DIR.rglob("*")):
+        content_type = CONTENT_TYPES.get(path.suffix.lower())
+        if content_type:
+            samples.append({
+                "filename": path.name,
+                "category": path.parent.name,
+                "content_type": content_type,
+                "data": path.read_bytes()
+            })
+    if not samples:
+        raise RuntimeError(f"No sample images found in {SAMPLE_IMAGES_DIR}")
+    return samples
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, storage_root: str, real_weights: bool) -> subprocess.Popen:
+    """Start the API with uvicorn in a subprocess using the local storage backend."""
+    env = dict(os.environ)
+    env.update({
+        "STORAGE_BACKEND": "local",
+        "LOCAL_STORAGE_ROOT": storage_root,
+        "LOCAL_IMAGES_BASE_URL": f"http://127.0.0.1:{port}/images",
+    })
+    if not real_weights:
+        env["MODEL_RANDOM_WEIGHTS"] = "1"
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=str(BACKEND_DIR),
+        env=env
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float, process: Optional[subprocess.Popen]):
+    """Poll /health until the models are loaded."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            response = await client.get("/health")
+            if response.status_code == 200:
+                return response.json()
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError("Server did not become healthy in time")
+
+
+async def save_item(client: httpx.AsyncClient, sample: Dict, user_id: str) -> httpx.Response:
+    return await client.post(
+        "/save-item",
+        files={"file": (sample["filename"], sample["data"], sample["content_type"])},
+        data={
+            "clothing_type": sample["category"],
+            "details": json.dumps({"name": sample["filename"], "category": sample["category"]}),
+            "user_id": user_id
+        }
+    )
+
+
+async def seed(client: httpx.AsyncClient, samples: List[Dict], users: List[str]) -> Dict[str, List[str]]:
+    """Give every user one item per sample image and one outfit. Returns item IDs per user."""
+    item_ids = {}
+    for user_id in users:
+        item_ids[user_id] = []
+        for sample in samples:
+            response = await save_item(client, sample, user_id)
+            response.raise_for_status()
+            item_ids[user_id].append(response.json()["item"]["id"])
+        response = await client.post("/outfit", data={
+            "name": "Load test outfit",
+            "item_ids": json.dumps(item_ids[user_id][:3]),
+            "user_id": user_id
+        })
+        response.raise_for_status()
+    return item_ids
+
+
+def make_request_factory(endpoint: str, samples: List[Dict], item_ids: Dict[str, List[str]]):
+    """Return a coroutine factory issuing one randomized request against an endpoint."""
+    users = list(item_ids)
+
+    async def predict(client):
+        sample = random.choice(samples)
+        return await client.post("/predict", files={
+            "file": (sample["filename"], sample["data"], sample["content_type"])
+        })
+
+    async def save(client):
+        return await save_item(client, random.choice(samples), random.choice(users))
+
+    async def grouped(client):
+        return await client.get("/items/grouped", params={"user_id": random.choice(users)})
+
+    async def outfits(client):
+        return await client.get("/outfits", params={"user_id": random.choice(users)})
+
+    async def fashion_predict(client):
+        item1, item2 = random.sample(item_ids[random.choice(users)], 2)
+        return await client.post("/fashion-predict", data={"item_id1": item1, "item_id2": item2})
+
+    return {
+        "predict": predict,
+        "save-item": save,
+        "items-grouped": grouped,
+        "outfits": outfits,
+        "fashion-predict": fashion_predict
+    }[endpoint]
+
+
+async def run_endpoint(client: httpx.AsyncClient, request_fn, total: int, concurrency: int) -> Dict:
+    """Issue `total` requests with at most `concurrency` in flight."""
+    latencies: List[float] = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await request_fn(client)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def compare(report: Dict, baseline: Dict) -> Dict:
+    """Relative change of throughput and latency percentiles against a baseline report."""
+    def change(new, old):
+        if new is None or not old:
+            return None
+        return round((new - old) / old * 100, 2)
+
+    result = {}
+    for endpoint, stats in report["endpoints"].items():
+        old = baseline.get("endpoints", {}).get(endpoint)
+        if not old:
+            continue
+        result[endpoint] = {
+            "throughput_rps_pct": change(stats["throughput_rps"], old["throughput_rps"]),
+            **{f"{key}_ms_pct": change(stats["latency_ms"][key], old["latency_ms"][key])
+               for key in ("p50", "p95", "p99")}
+        }
+    return result
+
+
+async def run(args) -> Dict:
+    samples = load_sample_images()
+    users = [f"loadtest-user-{i}" for i in range(args.users)]
+    process = None
+    storage_dir = None
+
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        storage_dir = tempfile.TemporaryDirectory(prefix="drippedup-loadtest-")
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        process = start_server(port, storage_dir.name, args.real_weights)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            health = await wait_until_ready(client, args.startup_timeout, process)
+            item_ids = await seed(client, samples, users)
+
+            endpoints = {}
+            for endpoint in args.endpoints:
+                if endpoint == "fashion-predict" and not health.get("fashion_model_ready"):
+                    print(f"Skipping {endpoint}: fashion model not available", file=sys.stderr)
+                    continue
+                request_fn = make_request_factory(endpoint, samples, item_ids)
+                # Warm the endpoint so model graph building is not measured
+                for _ in range(args.warmup):
+                    await request_fn(client)
+                endpoints[endpoint] = await run_endpoint(client, request_fn, args.requests, args.concurrency)
+                print(f"{endpoint}: {json.dumps(endpoints[endpoint])}", file=sys.stderr)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if storage_dir is not None:
+            storage_dir.cleanup()
+
+    return {
+        "config": {
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "requests_per_endpoint": args.requests,
+            "users": args.users,
+            "warmup": args.warmup,
+            "random_weights": not args.real_weights and not args.url,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        },
+        "endpoints": endpoints
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the DrippedUp API")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight per endpoint")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests per endpoint")
+    parser.add_argument("--users", type=int, default=4, help="Number of seeded users")
+    parser.add_argument("--endpoints", nargs="+", default=ALL_ENDPOINTS, choices=ALL_ENDPOINTS)
+    parser.add_argument("--url", help="Benchmark a running server instead of starting one")
+    parser.add_argument("--real-weights", action="store_true", help="Load the real model weights")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# backend/category_prior.py
+"""
+Category-pair prior learned from saved outfits.
+
+Counts how often two clothing categories appear in the same saved outfit
+(outfit_items, all users) over the classifier's 19 labels. The weight of a
+pair is the smoothed share of outfits containing the rarer of the two
+categories that also contain the other:
+
+    weight(a, b) = (together(a, b) + s) / (min(outfits(a), outfits(b)) + 2s)
+
+Pairs below CATEGORY_PRIOR_MIN_WEIGHT are pruned before any compatibility
+inference runs; the rest have their scores down-weighted by
+CATEGORY_PRIOR_STRENGTH. Until CATEGORY_PRIOR_MIN_OUTFITS outfits have been
+saved the prior is inactive and every pair gets weight 1.
+
+The table is rebuilt every CATEGORY_PRIOR_REFRESH_SECONDS and kept in
+CATEGORY_PRIOR_PATH, so server workers share one refresh and a restart does
+not start from an empty prior.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+import storage
+from metadata_store import atomic_write
+from profiling import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_PRIOR_PATH = os.environ.get("CATEGORY_PRIOR_PATH", os.path.join(storage.IMAGES_ROOT, "category_prior.json"))
+CATEGORY_PRIOR_REFRESH_SECONDS = float(os.environ.get("CATEGORY_PRIOR_REFRESH_SECONDS", "3600"))
+CATEGORY_PRIOR_MIN_OUTFITS = int(os.environ.get("CATEGORY_PRIOR_MIN_OUTFITS", "20"))
+CATEGORY_PRIOR_MIN_WEIGHT = float(os.environ.get("CATEGORY_PRIOR_MIN_WEIGHT", "0.05"))
+# 0 keeps model scores as they are, 1 multiplies them by the pair weight
+CATEGORY_PRIOR_STRENGTH = float(os.environ.get("CATEGORY_PRIOR_STRENGTH", "0.25"))
+SMOOTHING = 1.0
+
+# Same labels and order as ClothingClassifier.class_labels; unknown categories count as "Other"
+CLASS_LABELS = [
+    'Blazer', 'Blouse', 'Body', 'Dress', 'Hat', 'Hoodie', 'Longsleeve',
+    'Not sure', 'Other', 'Outwear', 'Pants', 'Polo', 'Shirt', 'Shoes',
+    'Shorts', 'Skirt', 'T-Shirt', 'Top', 'Undershirt'
+]
+# Uncertain labels say nothing about the garment, so they are never pruned
+UNCONSTRAINED_LABELS = {"Not sure", "Other"}
+
+
+class CategoryPrior:
+    """Co-occurrence counts over CLASS_LABELS and the pair weights derived from them."""
+
+    def __init__(self, labels: List[str] = CLASS_LABELS):
+        self.labels = labels
+        self.index = {label.lower(): i for i, label in enumerate(labels)}
+        self._other = self.index["other"]
+        size = len(labels)
+        self.together = np.zeros((size, size), dtype=np.int64)
+        self.outfits_with = np.zeros(size, dtype=np.int64)
+        self.outfit_count = 0
+        self.weights = np.ones((size, size), dtype=np.float32)
+        self.updated_at = 0.0
+
+    def _label_index(self, category: Optional[str]) -> int:
+        return self.index.get((category or "").strip().lower(), self._other)
+
+    @property
+    def active(self) -> bool:
+        return self.outfit_count >= CATEGORY_PRIOR_MIN_OUTFITS
+
+    def fit(self, outfits: Iterable[List[str]]):
+        """Rebuild the counts from the category lists of all saved outfits."""
+        size = len(self.labels)
+        together = np.zeros((size, size), dtype=np.int64)
+        outfits_with = np.zeros(size, dtype=np.int64)
+        outfit_count = 0
+        for categories in outfits:
+            indices = [self._label_index(category) for category in categories]
+            if len(indices) < 2:
+                continue
+            outfit_count += 1
+            present = np.bincount(indices, minlength=size)
+            outfits_with += present > 0
+            # Pairs of distinct items; a category paired with itself needs two of them
+            pairs = np.outer(present > 0, present > 0)
+            np.fill_diagonal(pairs, present > 1)
+            together += pairs
+        self.together, self.outfits_with, self.outfit_count = together, outfits_with, outfit_count
+        self.updated_at = time.time()
+        self._update_weights()
+
+    def _update_weights(self):
+        if not self.active:
+            self.weights = np.ones_like(self.together, dtype=np.float32)
+            return
+        rarer = np.minimum.outer(self.outfits_with, self.outfits_with)
+        weights = (self.together + SMOOTHING) / (rarer + 2 * SMOOTHING)
+        for label in UNCONSTRAINED_LABELS:
+            i = self.index[label.lower()]
+            weights[i, :] = weights[:, i] = 1.0
+        self.weights = weights.astype(np.float32)
+
+    def weight(self, category1: Optional[str], category2: Optional[str]) -> float:
+        return float(self.weights[self._label_index(category1), self._label_index(category2)])
+
+    def weights_for(self, category: Optional[str], categories: List[Optional[str]]) -> np.ndarray:
+        """Weights of one category against many, as one row lookup."""
+        row = self.weights[self._label_index(category)]
+        return row[[self._label_index(other) for other in categories]]
+
+    def allows(self, category1: Optional[str], category2: Optional[str]) -> bool:
+        """False when the pair is rare enough that inference is not worth running."""
+        return self.weight(category1, category2) >= CATEGORY_PRIOR_MIN_WEIGHT
+
+    def adjust(self, scores: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """Down-weight model scores by their pair weights."""
+        return scores * (1 - CATEGORY_PRIOR_STRENGTH + CATEGORY_PRIOR_STRENGTH * weights)
+
+    def describe(self) -> Dict:
+        return {
+            "active": self.active,
+            "outfits": self.outfit_count,
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.updated_at)) if self.updated_at else None,
+            "min_weight": CATEGORY_PRIOR_MIN_WEIGHT,
+            "strength": CATEGORY_PRIOR_STRENGTH,
+            "labels": self.labels,
+            "weights": np.round(self.weights, 4).tolist()
+        }
+
+    # ---------- persistence ----------
+
+    def save(self, path: str = CATEGORY_PRIOR_PATH):
+        data = {
+            "labels": self.labels,
+            "together": self.together.tolist(),
+            "outfits_with": self.outfits_with.tolist(),
+            "outfit_count": self.outfit_count,
+            "updated_at": self.updated_at
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        atomic_write(path, lambda f: f.write(json.dumps(data).encode("utf-8")))
+
+    def load(self, path: str = CATEGORY_PRIOR_PATH) -> bool:
+        """Load a saved table. Returns False if there is none or it uses other labels."""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        if data.get("labels") != self.labels:
+            logger.warning("Saved category prior uses different labels; ignoring it")
+            return False
+        self.together = np.asarray(data["together"], dtype=np.int64)
+        self.outfits_with = np.asarray(data["outfits_with"], dtype=np.int64)
+        self.outfit_count = int(data["outfit_count"])
+        self.updated_at = float(data["updated_at"])
+        self._update_weights()
+        return True
+
+
+category_prior = CategoryPrior()
+
+
+async def refresh(backend, prior: CategoryPrior = category_prior, path: str = CATEGORY_PRIOR_PATH,
+                  max_age: float = CATEGORY_PRIOR_REFRESH_SECONDS) -> bool:
+    """
+    Bring the prior up to date: reuse the saved table if another worker
+    refreshed it recently, otherwise rebuild it from the backend's outfits.
+    Returns True if it was rebuilt.
+    """
+    await run_in_threadpool(prior.load, path)
+    if time.time() - prior.updated_at < max_age:
+        return False
+    outfits = await backend.get_outfit_categories()
+    prior.fit(outfits)
+    await run_in_threadpool(prior.save, path)
+    logger.info(f"Category prior rebuilt from {prior.outfit_count} outfits (active: {prior.active})")
+    return True
+
+
+async def refresh_forever(backend, interval: float = CATEGORY_PRIOR_REFRESH_SECONDS):
+    """Background loop the server runs to keep the prior fresh."""
+    while True:
+        try:
+            await refresh(backend)
+        except Exception as e:
+            logger.warning(f"Category prior refresh failed: {e}")
+        await asyncio.sleep(min(interval, max(60.0, interval - (time.time() - category_prior.updated_at))))
@@ -1,34 +1,85 @@
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.models import Model
-from tensorflow.keras.layers import Input, Dense, Dropout, Flatten
-from tensorflow.keras.applications import Xception
+from tensorflow.keras.layers import Input, Dense, Dropout, Flatten, GlobalAveragePooling2D, Rescaling, Activation
+from tensorflow.keras.applications import Xception, MobileNetV3Small
 from tensorflow.keras.preprocessing import image
 import os
 from dotenv import load_dotenv
 from typing import Dict, List, Optional
 import logging
+from metrics import stage, BATCH_SIZE, CASCADE_PREDICTIONS
+from threading_config import configure_tensorflow
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+
+def _env_buckets(name: str, default: str) -> List[int]:
+    value = os.environ.get(name, default).strip()
+    return sorted({int(size) for size in value.split(",") if size.strip()}) if value else []
+
+
+ARCHITECTURES = ("xception", "mobilenet_v3_small")
+
+
 class ClothingClassifier:
     """
     A class to handle clothing classification using a pre-trained Xception-based model.
     """
     
-    def __init__(self, image_size: int = 224):
+    def __init__(self, image_size: int = 224, model_weights_path: Optional[str] = None,
+                 random_init: bool = False, compiled: Optional[bool] = None, xla: Optional[bool] = None,
+                 batch_buckets: Optional[List[int]] = None, warmup: Optional[bool] = None,
+                 architecture: str = "xception"):
         """
         Initialize the ClothingClassifier.
         
         Args:
             image_size (int): Size of the input images (square).
+            model_weights_path (str): Path to the weights file. Defaults to the
+                MODEL_WEIGHTS_PATH environment variable.
+            random_init (bool): Keep the randomly initialized weights instead of
+                loading a weights file. Only useful for benchmarks and tests.
+            compiled (bool): Serve predictions through a traced tf.function
+                instead of model.predict. Defaults to CLASSIFIER_COMPILED (on).
+            xla (bool): XLA-compile the serving function. Defaults to
+                CLASSIFIER_XLA (off).
+            batch_buckets (list): With XLA, batch sizes inputs are padded up
+                to, so the compiled function only ever sees these shapes.
+                Without XLA the traced function takes any batch size and the
+                largest bucket only caps the batch per call. Defaults to
+                CLASSIFIER_BATCH_BUCKETS; empty disables padding.
+            warmup (bool): Trace (and with XLA, compile every bucket) at
+                startup so the first request does not pay for it. Defaults to
+                CLASSIFIER_WARMUP (on).
+            architecture (str): "xception" for the full model or
+                "mobilenet_v3_small" for the distilled cascade student, whose
+                weights default to STUDENT_WEIGHTS_PATH.
         """
         load_dotenv()
         
+        if architecture not in ARCHITECTURES:
+            raise ValueError(f"Unknown classifier architecture: {architecture}")
+        self.architecture = architecture
+        # Label for this model's batch size and forward time metrics
+        self.metric_name = "classifier" if architecture == "xception" else "classifier_student"
         self.image_size = image_size
-        self.model_weights_path = "C:/Users/bansb/OneDrive/Desktop/DS460/AI-Outfit-Creator/drippedup/backend/small.keras"
+        if architecture == "xception":
+            self.model_weights_path = model_weights_path or os.environ.get(
+                "MODEL_WEIGHTS_PATH",
+                "C:/Users/bansb/OneDrive/Desktop/DS460/AI-Outfit-Creator/drippedup/backend/small.keras"
+            )
+        else:
+            self.model_weights_path = model_weights_path or os.environ.get(
+                "STUDENT_WEIGHTS_PATH", os.path.join(os.path.dirname(__file__), "student.weights.h5")
+            )
+        self.random_init = random_init
         self.model = None
         self.class_labels = [
             'Blazer', 'Blouse', 'Body', 'Dress', 'Hat', 'Hoodie', 'Longsleeve', 
@@ -36,8 +87,18 @@ class ClothingClassifier:
             'Shorts', 'Skirt', 'T-Shirt', 'Top', 'Undershirt'
         ]
         
+        self.compiled = _env_flag("CLASSIFIER_COMPILED", "1") if compiled is None else compiled
+        self.xla = _env_flag("CLASSIFIER_XLA", "0") if xla is None else xla
+        self.batch_buckets = (_env_buckets("CLASSIFIER_BATCH_BUCKETS", "1,2,4,8,16,32,64")
+                              if batch_buckets is None else sorted(set(batch_buckets)))
+        self._serving_fn = None
+        
         # Initialize the model
         self._initialize_model()
+        if self.compiled:
+            self._build_serving_function()
+            if _env_flag("CLASSIFIER_WARMUP", "1") if warmup is None else warmup:
+                self.warmup()
     
     def _create_architecture(self) -> Model:
         """
@@ -46,6 +107,8 @@ class ClothingClassifier:
         Returns:
             Model: The compiled Keras model.
         """
+        if self.architecture == "mobilenet_v3_small":
+            return self._create_student_architecture()
         try:
             # Build the model architecture
             base_model = Xception(
@@ -85,6 +148,42 @@ class ClothingClassifier:
             logger.error(f"Error creating model architecture: {e}")
             raise
     
+    def _create_student_architecture(self) -> Model:
+        """
+        Creates the MobileNetV3-Small student used as the cheap first stage of
+        the cascade. It takes the same [0, 1] inputs as the full model. The
+        pre-softmax "logits" layer is what distill_classifier.py trains against.
+        
+        Returns:
+            Model: The compiled Keras model.
+        """
+        try:
+            base_model = MobileNetV3Small(
+                weights=None,
+                include_top=False,
+                include_preprocessing=False,
+                input_shape=(self.image_size, self.image_size, 3)
+            )
+            
+            inputs = Input(shape=(self.image_size, self.image_size, 3))
+            # MobileNetV3 without its preprocessing layer expects [-1, 1]
+            x = Rescaling(2.0, offset=-1.0)(inputs)
+            x = base_model(x)
+            x = GlobalAveragePooling2D()(x)
+            x = Dropout(0.2)(x)
+            logits = Dense(len(self.class_labels), name="logits")(x)
+            outputs = Activation("softmax", name="probabilities")(logits)
+            
+            model = Model(inputs, outputs)
+            model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+            
+            logger.info("Student model architecture created successfully")
+            return model
+            
+        except Exception as e:
+            logger.error(f"Error creating student model architecture: {e}")
+            raise
+    
     def _load_weights(self, model: Model) -> bool:
         """
         Loads weights into the model from the specified path.
@@ -112,7 +211,11 @@ class ClothingClassifier:
         Initialize the model by creating architecture and loading weights.
         """
         try:
+            configure_tensorflow()
             self.model = self._create_architecture()
+            if self.random_init:
+                logger.warning("Using randomly initialized classifier weights")
+                return
             weights_loaded = self._load_weights(self.model)
             
             if weights_loaded:
@@ -124,6 +227,56 @@ class ClothingClassifier:
             logger.error(f"Error initializing model: {e}")
             raise
     
+    def _build_serving_function(self) -> None:
+        """
+        Trace the model into a tf.function with a fixed input signature. This
+        skips model.predict's per-call data adapter, callbacks and step logic.
+        """
+        signature = [tf.TensorSpec(shape=(None, self.image_size, self.image_size, 3), dtype=tf.float32)]
+        model = self.model
+        
+        def serve(images):
+            return model(images, training=False)
+        
+        self._serving_fn = tf.function(serve, input_signature=signature, jit_compile=self.xla)
+        logger.info(f"Compiled serving function ready (xla={self.xla}, buckets={self.batch_buckets})")
+    
+    def warmup(self) -> None:
+        """
+        Trace the serving function now. XLA compiles one program per input
+        shape, so with XLA every bucket is run; otherwise the dynamic batch
+        signature is traced once and a single row is enough.
+        """
+        sizes = (self.batch_buckets if self.xla else None) or [1]
+        for size in sizes:
+            self._forward(np.zeros((size, self.image_size, self.image_size, 3), dtype=np.float32))
+        logger.info(f"Classifier warmed up for batch sizes {sizes}")
+    
+    def _bucket_size(self, n: int) -> int:
+        for size in self.batch_buckets:
+            if size >= n:
+                return size
+        return n
+    
+    def _forward(self, img_array: np.ndarray) -> np.ndarray:
+        """Class probabilities for a batch, via the compiled function when available."""
+        if self._serving_fn is None:
+            return self.model.predict(img_array, verbose=0)
+        
+        img_array = np.asarray(img_array, dtype=np.float32)
+        n = len(img_array)
+        largest = self.batch_buckets[-1] if self.batch_buckets else n
+        if n > largest:
+            return np.concatenate([self._forward(img_array[i:i + largest]) for i in range(0, n, largest)])
+        
+        # Only XLA needs fixed shapes; padding without it is wasted compute
+        size = self._bucket_size(n) if self.xla else n
+        if size > n:
+            # Pad with zeros up to the bucket; padded rows are dropped below
+            padding = np.zeros((size - n,) + img_array.shape[1:], dtype=np.float32)
+            img_array = np.concatenate([img_array, padding])
+        return self._serving_fn(tf.constant(img_array)).numpy()[:n]
+    
     def predict(self, img_array: np.ndarray) -> Dict:
         """
         Make predictions on an image.
@@ -140,7 +293,9 @@ class ClothingClassifier:
         try:
             
             # Get prediction
-            prediction = self.model.predict(img_array, verbose=0)
+            BATCH_SIZE.observe(len(img_array), model=self.metric_name)
+            with stage("model_forward", self.metric_name):
+                prediction = self._forward(img_array)
             
             # Get the class with highest probability
             predicted_class_idx = np.argmax(prediction, axis=1)[0]
@@ -162,6 +317,45 @@ class ClothingClassifier:
             logger.error(f"Error making prediction on {img_array}: {e}")
             raise
     
+    def predict_probabilities(self, img_array: np.ndarray) -> np.ndarray:
+        """
+        Full class probability vectors for a batch, shape (N, num_classes).
+        Used to distill the cascade student from this model.
+        """
+        if self.model is None:
+            raise ValueError("Model not initialized")
+        
+        BATCH_SIZE.observe(len(img_array), model=self.metric_name)
+        with stage("model_forward", self.metric_name):
+            return self._forward(img_array)
+    
+    def predict_batch(self, img_array: np.ndarray) -> List[Dict]:
+        """
+        Make predictions on a batch of images.
+        
+        Args:
+            img_array (np.ndarray): Preprocessed images of shape (N, size, size, 3).
+            
+        Returns:
+            list: One top prediction dict per image, in input order.
+        """
+        if self.model is None:
+            raise ValueError("Model not initialized")
+        
+        BATCH_SIZE.observe(len(img_array), model=self.metric_name)
+        with stage("model_forward", self.metric_name):
+            prediction = self._forward(img_array)
+        predicted_class_idx = np.argmax(prediction, axis=1)
+        
+        return [
+            {
+                "predicted_class_index": int(idx),
+                "predicted_class_name": self.class_labels[idx],
+                "confidence": float(prediction[row][idx] * 100)
+            }
+            for row, idx in enumerate(predicted_class_idx)
+        ]
+    
     def get_model_info(self) -> Dict:
         """
         Get information about the model.
@@ -173,14 +367,88 @@ class ClothingClassifier:
             return {"error": "Model not initialized"}
         
         return {
-            "model_type": "Xception-based",
+            "model_type": "Xception-based" if self.architecture == "xception" else "MobileNetV3-Small student",
             "input_shape": (self.image_size, self.image_size, 3),
             "num_classes": len(self.class_labels),
             "class_labels": self.class_labels,
-            "weights_loaded": self.model_weights_path is not None
+            "weights_loaded": not self.random_init and self.model_weights_path is not None,
+            "compiled": self._serving_fn is not None,
+            "xla": self.xla and self._serving_fn is not None,
+            "batch_buckets": self.batch_buckets if self._serving_fn is not None else None
         }
 
 
+class CascadeClassifier:
+    """
+    Two-stage classifier: the distilled student answers every image first and
+    only predictions below the confidence threshold are re-run through the
+    full Xception model. Drop-in replacement for ClothingClassifier; every
+    prediction carries the "stage" ("student" or "full") that answered.
+    """
+    
+    def __init__(self, full: ClothingClassifier, student: ClothingClassifier, threshold: float):
+        """
+        Args:
+            full: The full Xception classifier.
+            student: The MobileNetV3 student, trained on the same labels.
+            threshold (float): Student confidence, in percent, needed to skip
+                the full model.
+        """
+        if student.class_labels != full.class_labels:
+            raise ValueError("Student and full classifier use different class labels")
+        self.full = full
+        self.student = student
+        self.threshold = threshold
+        self.image_size = full.image_size
+        self.class_labels = full.class_labels
+    
+    def predict(self, img_array: np.ndarray) -> Dict:
+        return self.predict_batch(img_array)[0]
+    
+    def predict_batch(self, img_array: np.ndarray) -> List[Dict]:
+        """Student predictions, with low-confidence rows replaced by one batched full-model call."""
+        results = self.student.predict_batch(img_array)
+        uncertain = [row for row, result in enumerate(results) if result["confidence"] < self.threshold]
+        for result in results:
+            result["stage"] = "student"
+        if uncertain:
+            for row, result in zip(uncertain, self.full.predict_batch(np.asarray(img_array)[uncertain])):
+                result["stage"] = "full"
+                results[row] = result
+        CASCADE_PREDICTIONS.inc(len(results) - len(uncertain), stage="student")
+        if uncertain:
+            CASCADE_PREDICTIONS.inc(len(uncertain), stage="full")
+        return results
+    
+    def get_model_info(self) -> Dict:
+        info = self.full.get_model_info()
+        answered = {stage_name: CASCADE_PREDICTIONS.get(stage=stage_name) for stage_name in ("student", "full")}
+        total = sum(answered.values())
+        info["cascade"] = {
+            "threshold": self.threshold,
+            "student": self.student.get_model_info(),
+            "answered": answered,
+            "student_hit_rate": answered["student"] / total if total else None
+        }
+        return info
+
+
+def build_classifier(image_size: int = 224, model_weights_path: Optional[str] = None,
+                     random_init: bool = False):
+    """
+    The classifier the server should use: a CascadeClassifier when
+    CLASSIFIER_CASCADE is set (threshold CLASSIFIER_CASCADE_THRESHOLD,
+    percent), otherwise the full ClothingClassifier.
+    """
+    full = ClothingClassifier(image_size, model_weights_path, random_init)
+    if not _env_flag("CLASSIFIER_CASCADE", "0"):
+        return full
+    student = ClothingClassifier(image_size, random_init=random_init, architecture="mobilenet_v3_small")
+    threshold = float(os.environ.get("CLASSIFIER_CASCADE_THRESHOLD", "90"))
+    logger.info(f"Cascade classification enabled (threshold {threshold}%)")
+    return CascadeClassifier(full, student, threshold)
+
+
 
 # Example usage and testing
 #if __name__ == "__main__":
@@ -0,0 +1,179 @@
+# backend/color_palette.py
+"""
+Dominant-color palettes and a color-harmony prefilter.
+
+Each item's palette is a fixed-size vector of PALETTE_SIZE colors, every
+color stored as (r, g, b, weight) with channels in [0, 1] and weights
+summing to 1, largest weight first; unused slots are zero. It is computed
+once on save with a small NumPy k-means over a downsampled image and kept
+in the item's details, so it is returned with every item read.
+
+Harmony between two palettes is the weighted agreement of their color
+pairs: neutrals go with everything, and hues that are analogous,
+complementary or triadic score higher than hues that clash. Ranking uses it
+to cut a user's wardrobe down to COLOR_PREFILTER_LIMIT candidates before
+any compatibility model runs.
+"""
+import os
+import logging
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+PALETTE_SIZE = int(os.environ.get("PALETTE_SIZE", "5"))
+COLOR_PREFILTER_LIMIT = int(os.environ.get("COLOR_PREFILTER_LIMIT", "32"))
+PALETTE_DETAILS_KEY = "palette"
+
+# Side of the downsampled image the palette is computed from
+SAMPLE_SIZE = 64
+KMEANS_ITERATIONS = 10
+# Pixels this close (RGB distance, 0-1 scale) to the border color count as background
+BACKGROUND_DISTANCE = 0.12
+# Below this saturation or value a color is treated as neutral
+NEUTRAL_SATURATION = 0.2
+NEUTRAL_VALUE = 0.2
+# Score given to a candidate that has no palette yet
+UNKNOWN_HARMONY = 0.5
+
+
+# ========== EXTRACTION ==========
+
+def _sample_pixels(image: Image.Image) -> np.ndarray:
+    """Downsample and return (n, 3) float32 RGB pixels with the background removed."""
+    small = image.convert("RGB")
+    small.thumbnail((SAMPLE_SIZE, SAMPLE_SIZE), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.float32) / 255.0
+
+    # Product photos are mostly shot on a plain background; estimate it from the border
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+    background = np.median(border, axis=0)
+    flat = pixels.reshape(-1, 3)
+    foreground = flat[np.linalg.norm(flat - background, axis=1) > BACKGROUND_DISTANCE]
+    # Keep everything if the "background" covers nearly the whole image
+    return foreground if len(foreground) >= 0.1 * len(flat) else flat
+
+
+def _kmeans(pixels: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS):
+    """Deterministic k-means with farthest-point initialization. Returns (centers, counts)."""
+    k = min(k, len(pixels))
+    centers = np.empty((k, 3), dtype=np.float32)
+    centers[0] = pixels.mean(axis=0)
+    distances = np.linalg.norm(pixels - centers[0], axis=1)
+    for c in range(1, k):
+        centers[c] = pixels[np.argmax(distances)]
+        distances = np.minimum(distances, np.linalg.norm(pixels - centers[c], axis=1))
+
+    for _ in range(iterations):
+        # (n, k) squared distances in one shot
+        labels = ((pixels[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, pixels)
+        counts = np.bincount(labels, minlength=k).astype(np.float32)
+        occupied = counts > 0
+        new_centers = centers.copy()
+        new_centers[occupied] = sums[occupied] / counts[occupied, None]
+        if np.allclose(new_centers, centers, atol=1e-4):
+            centers = new_centers
+            break
+        centers = new_centers
+
+    labels = ((pixels[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+    return centers, np.bincount(labels, minlength=k).astype(np.float32)
+
+
+def extract_palette(image: Image.Image, size: int = PALETTE_SIZE) -> np.ndarray:
+    """Return the image's palette as a flat float32 vector of length size * 4."""
+    pixels = _sample_pixels(image)
+    centers, counts = _kmeans(pixels, size)
+    order = np.argsort(-counts)
+    palette = np.zeros((size, 4), dtype=np.float32)
+    palette[:len(order), :3] = centers[order]
+    palette[:len(order), 3] = counts[order] / counts.sum()
+    return palette.reshape(-1)
+
+
+def palette_from_details(details: Optional[Dict], size: int = PALETTE_SIZE) -> Optional[np.ndarray]:
+    """Read an item's stored palette back as a (size, 4) array, or None if it has none."""
+    values = (details or {}).get(PALETTE_DETAILS_KEY)
+    if not values or len(values) != size * 4:
+        return None
+    return np.asarray(values, dtype=np.float32).reshape(size, 4)
+
+
+# ========== HARMONY ==========
+
+def _hsv(rgb: np.ndarray) -> np.ndarray:
+    """Vectorized RGB -> HSV for (..., 3) arrays; hue in degrees."""
+    maximum = rgb.max(axis=-1)
+    minimum = rgb.min(axis=-1)
+    delta = maximum - minimum
+    safe_delta = np.where(delta == 0, 1, delta)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    hue = np.select(
+        [maximum == r, maximum == g],
+        [((g - b) / safe_delta) % 6, (b - r) / safe_delta + 2],
+        (r - g) / safe_delta + 4
+    ) * 60.0
+    hue = np.where(delta == 0, 0, hue)
+    saturation = np.where(maximum == 0, 0, delta / np.where(maximum == 0, 1, maximum))
+    return np.stack([hue, saturation, maximum], axis=-1)
+
+
+def _pair_harmony(hsv1: np.ndarray, hsv2: np.ndarray) -> np.ndarray:
+    """Harmony of color pairs, broadcast over leading dimensions."""
+    neutral = ((hsv1[..., 1] < NEUTRAL_SATURATION) | (hsv1[..., 2] < NEUTRAL_VALUE) |
+               (hsv2[..., 1] < NEUTRAL_SATURATION) | (hsv2[..., 2] < NEUTRAL_VALUE))
+    difference = np.abs(hsv1[..., 0] - hsv2[..., 0]) % 360
+    difference = np.minimum(difference, 360 - difference)
+    score = np.select(
+        [difference <= 30, np.abs(difference - 180) <= 30, np.abs(difference - 120) <= 20],
+        [1.0, 0.9, 0.8],
+        0.3
+    )
+    return np.where(neutral, 1.0, score)
+
+
+def harmony_scores(query: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """
+    Harmony of one palette against many.
+
+    Args:
+        query: (size, 4) palette
+        candidates: (m, size, 4) palettes
+
+    Returns:
+        np.ndarray: (m,) scores in [0, 1]
+    """
+    query_hsv = _hsv(query[:, :3])[None, :, None, :]          # (1, size, 1, 3)
+    candidate_hsv = _hsv(candidates[..., :3])[:, None, :, :]  # (m, 1, size, 3)
+    pair_weights = query[None, :, None, 3] * candidates[:, None, :, 3]
+    pair_scores = _pair_harmony(query_hsv, candidate_hsv)
+    total = pair_weights.sum(axis=(1, 2))
+    return np.where(total > 0, (pair_scores * pair_weights).sum(axis=(1, 2)) / np.where(total > 0, total, 1),
+                    UNKNOWN_HARMONY)
+
+
+def prefilter(query_details: Optional[Dict], candidates: Sequence[Dict],
+              limit: int = COLOR_PREFILTER_LIMIT) -> List[Dict]:
+    """
+    Keep the limit candidate items whose palettes go best with the query
+    item's, best first. Candidates without a palette get a neutral score;
+    if the query item has none, the first limit candidates are kept as is.
+    """
+    if len(candidates) <= limit:
+        return list(candidates)
+    query = palette_from_details(query_details)
+    if query is None:
+        return list(candidates[:limit])
+
+    palettes = [palette_from_details(item.get("details")) for item in candidates]
+    known = [i for i, palette in enumerate(palettes) if palette is not None]
+    scores = np.full(len(candidates), UNKNOWN_HARMONY, dtype=np.float32)
+    if known:
+        scores[known] = harmony_scores(query, np.stack([palettes[i] for i in known]))
+
+    best = np.argpartition(-scores, limit - 1)[:limit]
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return [candidates[i] for i in best]
@@ -0,0 +1,252 @@
+# backend/compatibility_graph.py
+"""
+Materialized per-user compatibility graph.
+
+For every user we keep the compatibility score of every ordered pair of
+their items in a float16 matrix, stored as ``<COMPAT_GRAPH_ROOT>/<user>.npz``
+next to the item IDs it is indexed by. Entry [i, j] is the head's score for
+(item i, item j); the head is order-sensitive, so both directions are kept.
+
+Adding an item scores only its new row and column, as one batch of 2n pairs
+through the compatibility head on stored embeddings. Deleting an item drops
+its row and column. Matching queries are then array lookups plus
+argpartition, with no model call.
+
+The API process and the task workers both update graphs, so every update
+holds a per-user file lock and readers reload when the file changed.
+"""
+import os
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from filelock import FileLock
+import storage
+from metadata_store import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Scores depend on the fashion backbone, so each distilled backbone gets its own graphs
+_BACKBONE = os.environ.get("FASHION_BACKBONE", "resnet50").strip().lower()
+COMPAT_GRAPH_ROOT = os.environ.get("COMPAT_GRAPH_ROOT", os.path.join(
+    storage.IMAGES_ROOT, "compatibility_graph" if _BACKBONE == "resnet50" else f"compatibility_graph_{_BACKBONE}"
+))
+# Pairs per head call when a whole graph is rebuilt
+REBUILD_CHUNK_PAIRS = 65536
+
+# Scores pairs of stored embeddings row by row: (left (n, d), right (n, d)) -> (n,)
+PairScorer = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+
+def score_both_directions(embedding: np.ndarray, others: np.ndarray,
+                          score_pairs: PairScorer) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score (embedding, other) and (other, embedding) for every row of others
+    in one batch of 2n pairs. Embeddings are passed to score_pairs in their
+    stored dtype (float vectors or PQ codes). Returns the two (n,) float32
+    score arrays.
+    """
+    embedding = np.asarray(embedding).reshape(1, -1)
+    n = len(others)
+    repeated = np.repeat(embedding, n, axis=0)
+    scores = np.asarray(score_pairs(np.concatenate([repeated, others]),
+                                    np.concatenate([others, repeated])), dtype=np.float32)
+    return scores[:n], scores[n:]
+
+
+class UserGraph:
+    """One user's item IDs and their pairwise score matrix."""
+
+    def __init__(self, item_ids: List[str], scores: np.ndarray, version: Tuple[int, int] = (0, 0)):
+        self.item_ids = item_ids
+        self.scores = scores
+        self.index = {item_id: i for i, item_id in enumerate(item_ids)}
+        # (inode, mtime) of the file it was read from; every save replaces the inode
+        self.version = version
+
+    @classmethod
+    def empty(cls) -> "UserGraph":
+        return cls([], np.zeros((0, 0), dtype=np.float16))
+
+    def __len__(self) -> int:
+        return len(self.item_ids)
+
+
+class CompatibilityGraph:
+    """Loads, updates and queries per-user graphs stored under root."""
+
+    def __init__(self, root: str = COMPAT_GRAPH_ROOT):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+        self._graphs: Dict[str, UserGraph] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, user_id: str) -> str:
+        if not user_id or os.path.basename(user_id) != user_id or user_id.startswith("."):
+            raise ValueError(f"Invalid user ID: {user_id}")
+        return os.path.join(self.root, f"{user_id}.npz")
+
+    def _file_lock(self, user_id: str) -> FileLock:
+        return FileLock(self._path(user_id) + ".lock")
+
+    # ---------- persistence ----------
+
+    def _load(self, user_id: str) -> UserGraph:
+        """Return the user's graph, re-reading the file only if it changed on disk."""
+        path = self._path(user_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._graphs.pop(user_id, None)
+            return UserGraph.empty()
+        version = (stat.st_ino, stat.st_mtime_ns)
+
+        with self._lock:
+            cached = self._graphs.get(user_id)
+        if cached is not None and cached.version == version:
+            return cached
+
+        with np.load(path, allow_pickle=False) as data:
+            graph = UserGraph([str(item_id) for item_id in data["item_ids"]], data["scores"], version)
+        with self._lock:
+            self._graphs[user_id] = graph
+        return graph
+
+    def _save(self, user_id: str, graph: UserGraph):
+        path = self._path(user_id)
+        atomic_write(path, lambda f: np.savez(f, item_ids=np.array(graph.item_ids, dtype=str), scores=graph.scores))
+        stat = os.stat(path)
+        graph.version = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            self._graphs[user_id] = graph
+
+    def user_ids(self) -> List[str]:
+        """Users that have a stored graph."""
+        return sorted(name[:-len(".npz")] for name in os.listdir(self.root) if name.endswith(".npz"))
+
+    def drop(self, user_id: str) -> bool:
+        """Delete a user's graph. Returns True if one existed."""
+        with self._file_lock(user_id):
+            try:
+                os.remove(self._path(user_id))
+            except FileNotFoundError:
+                return False
+            with self._lock:
+                self._graphs.pop(user_id, None)
+            return True
+
+    # ---------- updates ----------
+
+    def add_item(self, user_id: str, item_id: str, embedding: np.ndarray,
+                 get_embedding: Callable[[str], Optional[np.ndarray]], score_pairs: PairScorer) -> int:
+        """
+        Add an item, scoring only its new row and column.
+
+        Args:
+            embedding: The new item's embedding.
+            get_embedding: Returns the stored embedding of an existing item.
+            score_pairs: Batched compatibility head.
+
+        Returns:
+            int: Number of pairs scored.
+        """
+        embedding = np.asarray(embedding).reshape(1, -1)
+        with self._file_lock(user_id):
+            graph = self._load(user_id)
+            if item_id in graph.index:
+                return 0
+
+            existing = [get_embedding(other) for other in graph.item_ids]
+            missing = [j for j, e in enumerate(existing) if e is None]
+            if missing:
+                # Items whose embedding is gone are being deleted; drop them now
+                keep = np.array([j for j, e in enumerate(existing) if e is not None], dtype=np.intp)
+                graph = UserGraph([graph.item_ids[j] for j in keep], graph.scores[np.ix_(keep, keep)])
+                existing = [existing[j] for j in keep]
+            n = len(existing)
+            row = np.zeros(n, dtype=np.float16)
+            column = np.zeros(n, dtype=np.float16)
+            if n:
+                others = np.stack([np.asarray(e).reshape(-1) for e in existing])
+                row, column = score_both_directions(embedding, others, score_pairs)
+
+            matrix = np.zeros((n + 1, n + 1), dtype=np.float16)
+            matrix[:n, :n] = graph.scores
+            matrix[n, :n] = row.astype(np.float16)
+            matrix[:n, n] = column.astype(np.float16)
+            self._save(user_id, UserGraph(graph.item_ids + [item_id], matrix))
+            return 2 * n
+
+    def remove_item(self, user_id: str, item_id: str) -> bool:
+        """Drop an item's row and column. Returns True if the item was in the graph."""
+        with self._file_lock(user_id):
+            graph = self._load(user_id)
+            i = graph.index.get(item_id)
+            if i is None:
+                return False
+            keep = np.array([j for j in range(len(graph)) if j != i], dtype=np.intp)
+            matrix = graph.scores[np.ix_(keep, keep)]
+            self._save(user_id, UserGraph([graph.item_ids[j] for j in keep], matrix))
+            return True
+
+    def rebuild(self, user_id: str, embeddings: Dict[str, np.ndarray], score_pairs: PairScorer) -> int:
+        """Score every ordered pair of the given items from scratch. Returns the item count."""
+        item_ids = list(embeddings)
+        n = len(item_ids)
+        matrix = np.zeros((n, n), dtype=np.float16)
+        if n > 1:
+            stacked = np.stack([np.asarray(embeddings[i]).reshape(-1) for i in item_ids])
+            left, right = np.nonzero(~np.eye(n, dtype=bool))
+            for start in range(0, len(left), REBUILD_CHUNK_PAIRS):
+                li = left[start:start + REBUILD_CHUNK_PAIRS]
+                ri = right[start:start + REBUILD_CHUNK_PAIRS]
+                matrix[li, ri] = np.asarray(score_pairs(stacked[li], stacked[ri]), dtype=np.float16)
+        with self._file_lock(user_id):
+            self._save(user_id, UserGraph(item_ids, matrix))
+        return n
+
+    # ---------- queries ----------
+
+    def item_ids(self, user_id: str) -> List[str]:
+        return list(self._load(user_id).item_ids)
+
+    def contains(self, user_id: str, item_id: str) -> bool:
+        return item_id in self._load(user_id).index
+
+    def score(self, user_id: str, item1_id: str, item2_id: str) -> Optional[float]:
+        """Stored score of (item1, item2), or None if either item is not in the graph."""
+        graph = self._load(user_id)
+        i, j = graph.index.get(item1_id), graph.index.get(item2_id)
+        if i is None or j is None:
+            return None
+        return float(graph.scores[i, j])
+
+    def top_k(self, user_id: str, item_id: str, k: int = 10,
+              candidates: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """
+        The k items that go best with item_id, by the mean of both pair
+        directions, best first. Optionally restricted to candidate item IDs.
+        """
+        graph = self._load(user_id)
+        i = graph.index.get(item_id)
+        if i is None:
+            return []
+        scores = (graph.scores[i, :].astype(np.float32) + graph.scores[:, i].astype(np.float32)) / 2
+
+        if candidates is not None:
+            positions = np.array([graph.index[c] for c in candidates if c in graph.index and c != item_id],
+                                 dtype=np.intp)
+        else:
+            positions = np.array([j for j in range(len(graph)) if j != i], dtype=np.intp)
+        if positions.size == 0:
+            return []
+
+        candidate_scores = scores[positions]
+        k = min(k, positions.size)
+        best = np.argpartition(-candidate_scores, k - 1)[:k]
+        best = best[np.argsort(-candidate_scores[best])]
+        return [(graph.item_ids[positions[b]], float(candidate_scores[b])) for b in best]
+
+
+compatibility_graph = CompatibilityGraph()
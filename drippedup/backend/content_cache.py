@@ -0,0 +1,69 @@
+# backend/content_cache.py
+"""
+Content hashing and content-addressed caches.
+
+Uploads are identified by a BLAKE2b hash of their bytes. The hash names the
+stored object (so re-uploading the same photo reuses it) and keys an
+in-memory LRU of model predictions (so a repeated /predict is a lookup).
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+from metrics import record_cache
+
+# 16-byte digests: collisions are not a practical concern and paths stay short
+DIGEST_SIZE = 16
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", "1024"))
+
+
+def content_hash(data: bytes) -> str:
+    """Hex BLAKE2b digest of the given bytes."""
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).hexdigest()
+
+
+def file_extension(filename: Optional[str], default: str = "jpg") -> str:
+    """Lower-case extension of an uploaded filename, without the dot."""
+    if filename and "." in filename:
+        return filename.rsplit(".", 1)[-1].lower()
+    return default
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache that reports hits and misses."""
+
+    def __init__(self, name: str, max_entries: int):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        record_cache(self.name, value is not None)
+        return value
+
+    def put(self, key: str, value: Any):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+# Classifier predictions keyed by content hash of the uploaded bytes
+prediction_cache = LRUCache("prediction", PREDICTION_CACHE_SIZE)
@@ -0,0 +1,233 @@
+# backend/distill_classifier.py
+"""
+Distill the cascade student (MobileNetV3-Small) from the full Xception
+classifier.
+
+The teacher labels every image under --data once; the student is then
+trained on the teacher's temperature-softened probabilities plus a hard
+label (the folder name when it is one of the class labels, as in the local
+storage layout <user>/<category>/<file>, otherwise the teacher's top class).
+Held-out images are used to report teacher agreement and, for a range of
+thresholds, how many images the student would answer on its own in the
+cascade and how often the cascade still agrees with the teacher.
+
+    python distill_classifier.py --data images --epochs 10 --output student.weights.h5
+    CLASSIFIER_CASCADE=1 STUDENT_WEIGHTS_PATH=student.weights.h5 python server.py
+"""
+import os
+import json
+import random
+import logging
+import argparse
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+REPORT_THRESHOLDS = [50, 60, 70, 80, 90, 95, 98]
+
+
+def find_images(roots: List[str]) -> List[str]:
+    paths = []
+    for root in roots:
+        for directory, _, files in os.walk(root):
+            paths.extend(os.path.join(directory, name) for name in files
+                         if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+    return sorted(paths)
+
+
+def load_images(paths: List[str], image_size: int) -> Tuple[np.ndarray, List[str]]:
+    """Decode and resize every image, kept as uint8 to bound memory. Returns images and the paths that loaded."""
+    images, loaded = [], []
+    for path in paths:
+        try:
+            with Image.open(path) as img:
+                images.append(np.asarray(img.convert("RGB").resize((image_size, image_size)), dtype=np.uint8))
+            loaded.append(path)
+        except Exception as e:
+            logger.warning(f"Skipping {path}: {e}")
+    return np.stack(images), loaded
+
+
+def folder_labels(paths: List[str], class_labels: List[str]) -> np.ndarray:
+    """Class index from each image's folder name, or -1 when it is not a class label."""
+    index = {label.lower(): i for i, label in enumerate(class_labels)}
+    return np.array([index.get(os.path.basename(os.path.dirname(path)).lower(), -1) for path in paths])
+
+
+def teacher_probabilities(teacher, images: np.ndarray, batch_size: int) -> np.ndarray:
+    return np.concatenate([
+        teacher.predict_probabilities(images[start:start + batch_size].astype(np.float32) / 255.0)
+        for start in range(0, len(images), batch_size)
+    ])
+
+
+def init_backbone_from_imagenet(student):
+    """Start the student's MobileNetV3 backbone from ImageNet weights instead of random ones."""
+    import keras
+    from tensorflow.keras.applications import MobileNetV3Small
+    backbone = next(layer for layer in student.model.layers if isinstance(layer, keras.Model))
+    pretrained = MobileNetV3Small(
+        weights="imagenet",
+        include_top=False,
+        include_preprocessing=False,
+        input_shape=(student.image_size, student.image_size, 3)
+    )
+    backbone.set_weights(pretrained.get_weights())
+    logger.info("Student backbone initialized from ImageNet weights")
+
+
+def distillation_loss(num_classes: int, temperature: float, alpha: float):
+    """Loss on the student's logits; y_true is [softened teacher probabilities | one-hot hard label]."""
+    import tensorflow as tf
+
+    def loss(y_true, logits):
+        soft, hard = y_true[:, :num_classes], y_true[:, num_classes:]
+        student_soft = tf.nn.softmax(logits / temperature)
+        kd = tf.reduce_sum(soft * (tf.math.log(soft + 1e-8) - tf.math.log(student_soft + 1e-8)), axis=1)
+        ce = tf.nn.softmax_cross_entropy_with_logits(labels=hard, logits=logits)
+        return (1 - alpha) * kd * temperature ** 2 + alpha * ce
+    return loss
+
+
+def soften(probabilities: np.ndarray, temperature: float) -> np.ndarray:
+    logits = np.log(np.clip(probabilities, 1e-8, 1.0)) / temperature
+    logits -= logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def cascade_report(teacher_probs: np.ndarray, student_probs: np.ndarray,
+                   labels: np.ndarray) -> Dict:
+    """Agreement with the teacher, alone and in the cascade at each threshold."""
+    teacher_top = teacher_probs.argmax(axis=1)
+    student_top = student_probs.argmax(axis=1)
+    confidence = student_probs.max(axis=1) * 100
+    labeled = labels >= 0
+
+    report = {
+        "images": int(len(teacher_top)),
+        "student_agreement": round(float((student_top == teacher_top).mean()), 4),
+        "cascade": []
+    }
+    if labeled.any():
+        report["teacher_accuracy"] = round(float((teacher_top[labeled] == labels[labeled]).mean()), 4)
+        report["student_accuracy"] = round(float((student_top[labeled] == labels[labeled]).mean()), 4)
+
+    for threshold in REPORT_THRESHOLDS:
+        answered = confidence >= threshold
+        cascade_top = np.where(answered, student_top, teacher_top)
+        row = {
+            "threshold": threshold,
+            "student_share": round(float(answered.mean()), 4),
+            "agreement": round(float((cascade_top == teacher_top).mean()), 4)
+        }
+        if labeled.any():
+            row["accuracy"] = round(float((cascade_top[labeled] == labels[labeled]).mean()), 4)
+        report["cascade"].append(row)
+    return report
+
+
+def distill(data: List[str], output: str, epochs: int, batch_size: int, temperature: float, alpha: float,
+            validation_split: float, learning_rate: float, imagenet_init: bool,
+            teacher_weights: Optional[str], seed: int) -> Dict:
+    import tensorflow as tf
+    from classification import ClothingClassifier
+
+    random.seed(seed)
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+
+    paths = find_images(data)
+    if len(paths) < 10:
+        raise SystemExit(f"Need at least 10 images to distill, found {len(paths)} under {data}")
+    random.shuffle(paths)
+
+    teacher = ClothingClassifier(model_weights_path=teacher_weights, warmup=False)
+    student = ClothingClassifier(random_init=True, compiled=False, warmup=False, architecture="mobilenet_v3_small")
+    if imagenet_init:
+        init_backbone_from_imagenet(student)
+
+    images, paths = load_images(paths, teacher.image_size)
+    labels = folder_labels(paths, teacher.class_labels)
+    logger.info(f"Loaded {len(images)} images ({int((labels >= 0).sum())} with folder labels)")
+
+    probabilities = teacher_probabilities(teacher, images, batch_size)
+    num_classes = len(teacher.class_labels)
+    hard = np.where(labels >= 0, labels, probabilities.argmax(axis=1))
+    targets = np.concatenate([soften(probabilities, temperature), np.eye(num_classes)[hard]], axis=1)
+    targets = targets.astype(np.float32)
+
+    split = max(1, int(len(images) * validation_split))
+    train_images, val_images = images[split:], images[:split]
+    train_targets = targets[split:]
+
+    def prepare(image, target):
+        image = tf.image.random_flip_left_right(tf.cast(image, tf.float32) / 255.0)
+        return image, target
+
+    dataset = (tf.data.Dataset.from_tensor_slices((train_images, train_targets))
+               .shuffle(len(train_images), seed=seed)
+               .map(prepare, num_parallel_calls=tf.data.AUTOTUNE)
+               .batch(batch_size)
+               .prefetch(tf.data.AUTOTUNE))
+
+    # Train on the pre-softmax layer; the serving model shares its weights
+    logits_model = tf.keras.Model(student.model.input, student.model.get_layer("logits").output)
+    logits_model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate),
+                         loss=distillation_loss(num_classes, temperature, alpha))
+    logits_model.fit(dataset, epochs=epochs, verbose=2)
+
+    student.model.save_weights(output)
+    logger.info(f"Student weights saved to {output}")
+
+    val_float = val_images.astype(np.float32) / 255.0
+    student_probs = np.concatenate([
+        student.model.predict(val_float[start:start + batch_size], verbose=0)
+        for start in range(0, len(val_float), batch_size)
+    ])
+    report = cascade_report(probabilities[:split], student_probs, labels[:split])
+    report["train_images"] = int(len(train_images))
+    report["output"] = output
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill the cascade student from the full classifier")
+    parser.add_argument("--data", nargs="+", default=[os.path.join(os.path.dirname(__file__), "images")],
+                        help="Directories searched recursively for images")
+    parser.add_argument("--output", default=os.environ.get("STUDENT_WEIGHTS_PATH", "student.weights.h5"),
+                        help="Student weights file (must end in .weights.h5)")
+    parser.add_argument("--teacher-weights", help="Full model weights (defaults to MODEL_WEIGHTS_PATH)")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.3, help="Weight of the hard-label loss")
+    parser.add_argument("--learning-rate", type=float, default=1e-3)
+    parser.add_argument("--validation-split", type=float, default=0.1)
+    parser.add_argument("--no-imagenet-init", action="store_true", help="Train the student backbone from scratch")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    if not args.output.endswith(".weights.h5"):
+        parser.error("--output must end in .weights.h5")
+
+    report = distill(args.data, args.output, args.epochs, args.batch_size, args.temperature, args.alpha,
+                     args.validation_split, args.learning_rate, not args.no_imagenet_init,
+                     args.teacher_weights, args.seed)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
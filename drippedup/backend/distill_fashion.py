@@ -0,0 +1,226 @@
+# backend/distill_fashion.py
+"""
+Distill a lightweight Siamese backbone from the ResNet-50 fashion model.
+
+The current model (FASHION_WEIGHTS_PATH) is the teacher. The student is a
+SiameseNetwork on a small ImageNet-pretrained backbone (resnet18 or
+mobilenet_v3_small) whose embedding layers are trained to reproduce the
+teacher's normalized embeddings, and whose compatibility head starts from
+the teacher's head and is trained to reproduce the teacher's scores on
+pairs formed within each batch (both orders).
+
+Held-out images are used for the agreement report: embedding cosine
+similarity, score error and correlation, how often both models land on the
+same side of 0.5, overlap of each image's top-5 partners, and embedding
+latency of both models on the same batch.
+
+    python distill_fashion.py --backbone mobilenet_v3_small --data images --epochs 10
+    FASHION_BACKBONE=mobilenet_v3_small python server.py
+"""
+import os
+import json
+import time
+import random
+import logging
+import argparse
+from typing import Dict, List
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import torch
+import torch.nn.functional as F
+from fashion import BACKBONES, DEFAULT_BACKBONE, FashionCompatibility, SiameseNetwork
+from distill_classifier import find_images
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TOP_K = 5
+
+
+class ImageFolderDataset(torch.utils.data.Dataset):
+    def __init__(self, paths: List[str], transform):
+        self.paths = paths
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        with Image.open(self.paths[index]) as img:
+            return self.transform(img.convert("RGB"))
+
+
+def pair_scores(model, embeddings: torch.Tensor, shift: int = 1) -> torch.Tensor:
+    """Head scores for (i, i+shift) and (i+shift, i) pairs within a batch."""
+    partners = torch.roll(embeddings, shifts=shift, dims=0)
+    left = torch.cat([embeddings, partners])
+    right = torch.cat([partners, embeddings])
+    return model.classifier(torch.cat([left, right], dim=1)).flatten()
+
+
+def embedding_latency_ms(model, batch: torch.Tensor, iterations: int = 10) -> float:
+    with torch.inference_mode():
+        model.forward_once(batch)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            model.forward_once(batch)
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def agreement_report(teacher, student, loader, device) -> Dict:
+    """Compare student and teacher on held-out images."""
+    teacher.eval()
+    student.eval()
+    teacher_embeddings, student_embeddings = [], []
+    with torch.inference_mode():
+        for images in loader:
+            images = images.to(device)
+            teacher_embeddings.append(teacher.forward_once(images))
+            student_embeddings.append(student.forward_once(images))
+    teacher_embeddings = torch.cat(teacher_embeddings)
+    student_embeddings = torch.cat(student_embeddings)
+    n = len(teacher_embeddings)
+
+    # Every ordered pair of held-out images
+    left, right = torch.nonzero(~torch.eye(n, dtype=torch.bool), as_tuple=True)
+    with torch.inference_mode():
+        teacher_scores = teacher.classifier(torch.cat([teacher_embeddings[left], teacher_embeddings[right]], 1)).flatten()
+        student_scores = student.classifier(torch.cat([student_embeddings[left], student_embeddings[right]], 1)).flatten()
+    teacher_scores = teacher_scores.cpu().numpy()
+    student_scores = student_scores.cpu().numpy()
+
+    # Top-k partners of each image under both models
+    k = min(TOP_K, n - 1)
+    teacher_matrix = np.full((n, n), -np.inf, dtype=np.float32)
+    student_matrix = np.full((n, n), -np.inf, dtype=np.float32)
+    teacher_matrix[left.numpy(), right.numpy()] = teacher_scores
+    student_matrix[left.numpy(), right.numpy()] = student_scores
+    teacher_top = np.argsort(-teacher_matrix, axis=1)[:, :k]
+    student_top = np.argsort(-student_matrix, axis=1)[:, :k]
+    overlap = np.mean([len(set(t) & set(s)) / k for t, s in zip(teacher_top, student_top)])
+
+    batch = next(iter(loader)).to(device)
+    teacher_ms = embedding_latency_ms(teacher, batch)
+    student_ms = embedding_latency_ms(student, batch)
+
+    return {
+        "images": n,
+        "pairs": int(len(teacher_scores)),
+        "embedding_cosine_mean": round(float(F.cosine_similarity(teacher_embeddings, student_embeddings).mean()), 4),
+        "score_mae": round(float(np.abs(teacher_scores - student_scores).mean()), 4),
+        "score_pearson": round(float(np.corrcoef(teacher_scores, student_scores)[0, 1]), 4) if n > 2 else None,
+        "same_side_of_0_5": round(float(((teacher_scores >= 0.5) == (student_scores >= 0.5)).mean()), 4),
+        f"top{k}_overlap": round(float(overlap), 4),
+        "embedding_latency": {
+            "batch_size": int(len(batch)),
+            "teacher_ms": round(teacher_ms, 2),
+            "student_ms": round(student_ms, 2),
+            "speedup": round(teacher_ms / student_ms, 2) if student_ms > 0 else None
+        }
+    }
+
+
+def distill(backbone: str, data: List[str], output: str, epochs: int, batch_size: int, learning_rate: float,
+            score_weight: float, validation_split: float, teacher_weights: str, seed: int) -> Dict:
+    random.seed(seed)
+    torch.manual_seed(seed)
+
+    paths = find_images(data)
+    if len(paths) < 10:
+        raise SystemExit(f"Need at least 10 images to distill, found {len(paths)} under {data}")
+    random.shuffle(paths)
+    split = max(2, int(len(paths) * validation_split))
+
+    teacher_wrapper = FashionCompatibility(model_path=teacher_weights, inference_mode="eager", backbone=DEFAULT_BACKBONE)
+    device = teacher_wrapper.device
+    teacher = teacher_wrapper.model.eval()
+    for param in teacher.parameters():
+        param.requires_grad = False
+
+    student = SiameseNetwork(embedding_dim=128, pretrained=True, backbone=backbone).to(device)
+    # Start from the teacher's head so scores live on the same scale from the first step
+    student.classifier.load_state_dict(teacher.classifier.state_dict())
+
+    from torchvision import transforms
+    eval_transform = teacher_wrapper.transform
+    train_transform = transforms.Compose([
+        transforms.RandomResizedCrop(224, scale=(0.7, 1.0)),
+        transforms.RandomHorizontalFlip(),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    ])
+    train_loader = torch.utils.data.DataLoader(ImageFolderDataset(paths[split:], train_transform),
+                                               batch_size=batch_size, shuffle=True, drop_last=True)
+    val_loader = torch.utils.data.DataLoader(ImageFolderDataset(paths[:split], eval_transform),
+                                             batch_size=batch_size)
+    if len(train_loader) == 0:
+        raise SystemExit(f"Not enough training images for batch size {batch_size}")
+
+    optimizer = torch.optim.AdamW([p for p in student.parameters() if p.requires_grad], lr=learning_rate)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs * len(train_loader))
+
+    for epoch in range(epochs):
+        student.train()
+        totals = {"embedding": 0.0, "score": 0.0}
+        for images in train_loader:
+            images = images.to(device)
+            with torch.no_grad():
+                teacher_embeddings = teacher.forward_once(images)
+                teacher_scores = pair_scores(teacher, teacher_embeddings)
+            student_embeddings = student.forward_once(images)
+            student_scores = pair_scores(student, student_embeddings)
+
+            embedding_loss = (1 - F.cosine_similarity(student_embeddings, teacher_embeddings)).mean()
+            score_loss = F.mse_loss(student_scores, teacher_scores)
+            loss = embedding_loss + score_weight * score_loss
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            totals["embedding"] += embedding_loss.item()
+            totals["score"] += score_loss.item()
+        logger.info(f"Epoch {epoch + 1}/{epochs}: embedding loss {totals['embedding'] / len(train_loader):.4f}, "
+                    f"score loss {totals['score'] / len(train_loader):.5f}")
+
+    torch.save(student.state_dict(), output)
+    logger.info(f"Student weights saved to {output}")
+
+    report = agreement_report(teacher, student, val_loader, device)
+    report.update({"backbone": backbone, "train_images": len(paths) - split, "output": output})
+    return report
+
+
+def main():
+    students = [name for name in BACKBONES if name != DEFAULT_BACKBONE]
+    parser = argparse.ArgumentParser(description="Distill a lightweight Siamese backbone from the ResNet-50 model")
+    parser.add_argument("--backbone", choices=students, default="mobilenet_v3_small")
+    parser.add_argument("--data", nargs="+", default=[os.path.join(os.path.dirname(__file__), "images")],
+                        help="Directories searched recursively for images")
+    parser.add_argument("--output", help="Student weights file (default siamese_<backbone>.pth)")
+    parser.add_argument("--teacher-weights", help="Teacher weights (defaults to FASHION_WEIGHTS_PATH)")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--learning-rate", type=float, default=3e-4)
+    parser.add_argument("--score-weight", type=float, default=10.0, help="Weight of the pair score loss")
+    parser.add_argument("--validation-split", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), f"siamese_{args.backbone}.pth")
+    report = distill(args.backbone, args.data, output, args.epochs, args.batch_size, args.learning_rate,
+                     args.score_weight, args.validation_split, args.teacher_weights, args.seed)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+# backend/embedding_store.py
+"""
+Per-item compatibility embeddings.
+
+Each clothing item's FashionCompatibility embedding is saved once, when the
+item is created, as ``<EMBEDDINGS_ROOT>/<item_id>.npy``. Pair scoring can
+then load embeddings instead of downloading and re-encoding both images.
+
+EMBEDDING_FORMAT picks how vectors are kept on disk and handed to scoring:
+
+    "float16"  half-precision vectors, 2x smaller than float32 (default)
+    "pq"       product-quantized codes: the 128 dimensions are split into
+               PQ_SUBSPACES groups, each replaced by the uint8 index of its
+               nearest centroid (16 bytes per item with 16 subspaces)
+    "float32"  full precision
+
+PQ needs codebooks trained on stored embeddings (``python embedding_store.py
+train-pq``); until they exist new embeddings are kept as float16. Scoring
+never decodes codes: the compatibility head takes them directly (see
+FashionCompatibility.score_codes).
+
+Codes are only meaningful with the codebooks they were encoded with, so they
+are stored as ``<item_id>.pq-<codebook version>.npy`` and codes of any other
+version are never returned. Retraining writes the new codes before it
+publishes the new codebooks, then removes the old codes and rebuilds the
+compatibility graphs scored with them.
+"""
+import os
+import glob
+import hashlib
+import logging
+import argparse
+from typing import Callable, Optional, Tuple
+import numpy as np
+import storage
+from metadata_store import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Embeddings from different fashion backbones are not comparable, so each
+# distilled backbone gets its own directory
+_BACKBONE = os.environ.get("FASHION_BACKBONE", "resnet50").strip().lower()
+EMBEDDINGS_ROOT = os.environ.get("EMBEDDINGS_ROOT", os.path.join(
+    storage.IMAGES_ROOT, "embeddings" if _BACKBONE == "resnet50" else f"embeddings_{_BACKBONE}"
+))
+EMBEDDING_FORMAT = os.environ.get("EMBEDDING_FORMAT", "float16").strip().lower()
+EMBEDDING_FORMATS = ("float16", "pq", "float32")
+PQ_SUBSPACES = int(os.environ.get("PQ_SUBSPACES", "16"))
+PQ_CENTROIDS = int(os.environ.get("PQ_CENTROIDS", "256"))
+PQ_CODEBOOKS_FILE = "pq_codebooks.npy"
+PQ_KMEANS_ITERATIONS = 25
+
+
+# ========== PRODUCT QUANTIZATION ==========
+
+class PQCodec:
+    """Encodes vectors as one uint8 centroid index per subspace."""
+
+    def __init__(self, codebooks: np.ndarray):
+        # (subspaces, centroids, dimensions per subspace)
+        self.codebooks = np.ascontiguousarray(codebooks, dtype=np.float32)
+        self.subspaces, self.centroids, self.sub_dim = self.codebooks.shape
+
+    @property
+    def dimensions(self) -> int:
+        return self.subspaces * self.sub_dim
+
+    @property
+    def version(self) -> str:
+        """Short content hash identifying these codebooks."""
+        return hashlib.blake2b(self.codebooks.tobytes(), digest_size=8).hexdigest()
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, subspaces: int = PQ_SUBSPACES, centroids: int = PQ_CENTROIDS,
+              iterations: int = PQ_KMEANS_ITERATIONS, seed: int = 0) -> "PQCodec":
+        """Run k-means in every subspace of the (n, d) training vectors."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n, d = vectors.shape
+        if d % subspaces:
+            raise ValueError(f"{d} dimensions do not split into {subspaces} subspaces")
+        if not 1 < centroids <= 256:
+            raise ValueError("PQ centroids must be between 2 and 256 to fit uint8 codes")
+        if n < centroids:
+            raise ValueError(f"Need at least {centroids} embeddings to train {centroids} centroids, have {n}")
+
+        rng = np.random.default_rng(seed)
+        sub_dim = d // subspaces
+        codebooks = np.empty((subspaces, centroids, sub_dim), dtype=np.float32)
+        for m in range(subspaces):
+            data = vectors[:, m * sub_dim:(m + 1) * sub_dim]
+            centers = data[rng.choice(n, centroids, replace=False)].copy()
+            for _ in range(iterations):
+                labels = _nearest(data, centers)
+                sums = np.zeros_like(centers)
+                np.add.at(sums, labels, data)
+                counts = np.bincount(labels, minlength=centroids)
+                empty = counts == 0
+                centers[~empty] = sums[~empty] / counts[~empty, None]
+                # Reseed empty clusters from random training points
+                centers[empty] = data[rng.choice(n, int(empty.sum()), replace=False)]
+            codebooks[m] = centers
+        return cls(codebooks)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """(n, d) or (d,) float vectors -> (n, subspaces) or (subspaces,) uint8 codes."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        flat = vectors.reshape(-1, self.dimensions)
+        codes = np.empty((len(flat), self.subspaces), dtype=np.uint8)
+        for m in range(self.subspaces):
+            codes[:, m] = _nearest(flat[:, m * self.sub_dim:(m + 1) * self.sub_dim], self.codebooks[m])
+        return codes.reshape(-1) if vectors.ndim == 1 else codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """Approximate float32 vectors back from codes."""
+        codes = np.asarray(codes)
+        flat = codes.reshape(-1, self.subspaces).astype(np.intp)
+        vectors = self.codebooks[np.arange(self.subspaces), flat].reshape(len(flat), self.dimensions)
+        return vectors.reshape(-1) if codes.ndim == 1 else vectors
+
+    def save(self, path: str):
+        atomic_write(path, lambda f: np.save(f, self.codebooks))
+
+
+def _nearest(data: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """Index of the nearest center for every row of data."""
+    distances = (data ** 2).sum(axis=1, keepdims=True) - 2 * data @ centers.T + (centers ** 2).sum(axis=1)
+    return distances.argmin(axis=1)
+
+
+# ========== STORE ==========
+
+class EmbeddingStore:
+    """Stores one compact vector (or PQ code) per item ID on disk."""
+
+    def __init__(self, root: str = EMBEDDINGS_ROOT, embedding_format: str = EMBEDDING_FORMAT):
+        if embedding_format not in EMBEDDING_FORMATS:
+            raise ValueError(f"Unknown EMBEDDING_FORMAT: {embedding_format}")
+        self.root = root
+        self.format = embedding_format
+        os.makedirs(self.root, exist_ok=True)
+        self.codebooks_path = os.path.join(self.root, PQ_CODEBOOKS_FILE)
+        self._codec: Optional[PQCodec] = None
+        self._codec_version = None
+
+    def _path(self, item_id: str) -> str:
+        """File of an item's float vector."""
+        # Item IDs are UUIDs; anything else could escape the directory or clash with code files
+        if not item_id or os.path.basename(item_id) != item_id or "." in item_id:
+            raise ValueError(f"Invalid item ID: {item_id}")
+        return os.path.join(self.root, f"{item_id}.npy")
+
+    def _codes_path(self, item_id: str, version: str) -> str:
+        """File of an item's PQ codes for one codebook version."""
+        return self._path(item_id)[:-len(".npy")] + f".pq-{version}.npy"
+
+    def _all_codes_paths(self, item_id: str):
+        return glob.glob(glob.escape(self._path(item_id)[:-len(".npy")]) + ".pq-*.npy")
+
+    @staticmethod
+    def _remove(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @property
+    def codec(self) -> Optional[PQCodec]:
+        """The trained PQ codebooks, reloaded when another process retrains them."""
+        try:
+            stat = os.stat(self.codebooks_path)
+        except FileNotFoundError:
+            self._codec, self._codec_version = None, None
+            return None
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if version != self._codec_version:
+            self._codec = PQCodec(np.load(self.codebooks_path))
+            self._codec_version = version
+        return self._codec
+
+    def _working_form(self, stored: np.ndarray, codec: Optional[PQCodec]) -> Optional[np.ndarray]:
+        """
+        Convert a stored array to the representation scoring uses for this
+        format. Codes must come from codec (see _load).
+        """
+        if stored.dtype == np.uint8:
+            if codec is None:
+                return None
+            if self.format == "pq":
+                return stored
+            stored = codec.decode(stored)
+        if self.format == "pq" and codec is not None:
+            return codec.encode(stored)
+        return stored.astype(np.float32 if self.format == "float32" else np.float16)
+
+    def _store(self, item_id: str, embedding, codec: Optional[PQCodec]) -> Tuple[str, np.ndarray]:
+        """
+        Write an item's embedding in its working form for codec, leaving its
+        other files in place. Returns the file written and what it holds.
+        """
+        vector = self._working_form(np.asarray(embedding, dtype=np.float32).reshape(-1), codec)
+        path = self._codes_path(item_id, codec.version) if vector.dtype == np.uint8 else self._path(item_id)
+        atomic_write(path, lambda f: np.save(f, vector))
+        return path, vector
+
+    def put(self, item_id: str, embedding) -> np.ndarray:
+        """Save an item's embedding, replacing any previous one atomically. Returns what was stored."""
+        path, vector = self._store(item_id, embedding, self.codec)
+        # Drop the item's other representations only once the new one is in place
+        self._prune(item_id, path)
+        return vector
+
+    def _prune(self, item_id: str, kept: str):
+        """Remove every file of an item other than kept."""
+        self._remove([path for path in self._all_codes_paths(item_id) + [self._path(item_id)] if path != kept])
+
+    def _load(self, item_id: str, codec: Optional[PQCodec]):
+        """
+        An item's stored array: its codes for codec, or else its float
+        vector. Codes for any other codebooks are ignored.
+        """
+        paths = [self._path(item_id)]
+        if codec is not None:
+            paths.insert(0, self._codes_path(item_id, codec.version))
+        for path in paths:
+            try:
+                return np.load(path)
+            except FileNotFoundError:
+                continue
+        return None
+
+    def get_encoded(self, item_id: str) -> Optional[np.ndarray]:
+        """
+        Return an item's embedding in the store's compact form (float16 or
+        float32 vector, or uint8 PQ codes), or None if it has not been
+        computed. Pass these to scorer(); they are never decoded.
+        """
+        codec = self.codec
+        stored = self._load(item_id, codec)
+        return None if stored is None else self._working_form(stored, codec)
+
+    def get(self, item_id: str) -> Optional[np.ndarray]:
+        """Return an item's embedding as a float32 vector (decoded from PQ codes if needed)."""
+        codec = self.codec
+        stored = self._load(item_id, codec)
+        if stored is None:
+            return None
+        if stored.dtype == np.uint8:
+            return codec.decode(stored)
+        return stored.astype(np.float32)
+
+    def scorer(self, fashion) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+        """Pair scorer for arrays from get_encoded/put: PQ codes go straight to the head's code path."""
+        def score_pairs(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+            if left.dtype == np.uint8:
+                return fashion.score_codes(left, right, self.codec.codebooks)
+            return fashion.score_embedding_arrays(left, right)
+        return score_pairs
+
+    def delete(self, item_id: str) -> bool:
+        """Remove an item's embedding. Returns True if one existed."""
+        paths = [path for path in [self._path(item_id)] + self._all_codes_paths(item_id) if os.path.exists(path)]
+        self._remove(paths)
+        return bool(paths)
+
+    def item_ids(self):
+        return sorted({name.split(".", 1)[0] for name in os.listdir(self.root)
+                       if name.endswith(".npy") and name != PQ_CODEBOOKS_FILE})
+
+    def __contains__(self, item_id: str) -> bool:
+        codec = self.codec
+        return (os.path.exists(self._path(item_id))
+                or (codec is not None and os.path.exists(self._codes_path(item_id, codec.version))))
+
+
+embedding_store = EmbeddingStore()
+
+
+# ========== CLI ==========
+
+def train_pq(store: EmbeddingStore, subspaces: int, centroids: int) -> dict:
+    """
+    Train PQ codebooks on every stored embedding and re-encode the store in
+    its format. Other processes keep reading the old codes until the new
+    codebooks are published, and the new codes from then on.
+    """
+    old_codec = store.codec
+    item_ids = store.item_ids()
+    vectors = [store.get(item_id) for item_id in item_ids]
+    item_ids = [item_id for item_id, vector in zip(item_ids, vectors) if vector is not None]
+    training = np.stack([vector for vector in vectors if vector is not None])
+    codec = PQCodec.train(training, subspaces, centroids)
+    error = float(np.linalg.norm(codec.decode(codec.encode(training)) - training, axis=1).mean())
+
+    # New codes go next to the old ones under the new version, then the codebooks switch
+    for item_id, vector in zip(item_ids, training):
+        store._store(item_id, vector, codec)
+    codec.save(store.codebooks_path)
+
+    for item_id in store.item_ids():
+        stored = store._load(item_id, codec)
+        if stored is None:
+            # Written with the old codebooks after the pass above; re-encode it now
+            vector = store._load(item_id, old_codec)
+            if vector is None:
+                continue
+            if vector.dtype == np.uint8:
+                vector = old_codec.decode(vector)
+            store.put(item_id, vector)
+        else:
+            kept = store._codes_path(item_id, codec.version) if stored.dtype == np.uint8 else store._path(item_id)
+            store._prune(item_id, kept)
+    logger.info(f"Trained {subspaces}x{centroids} PQ codebooks on {len(training)} embeddings")
+    return {"embeddings": len(training), "subspaces": subspaces, "centroids": centroids,
+            "codebook_version": codec.version, "format": store.format,
+            "mean_reconstruction_error": round(error, 4)}
+
+
+def stats(store: EmbeddingStore) -> dict:
+    sizes = {}
+    for item_id in store.item_ids():
+        stored = store._load(item_id, store.codec)
+        if stored is not None:
+            sizes.setdefault(str(stored.dtype), []).append(stored.nbytes)
+    return {
+        "format": store.format,
+        "pq_codebooks": store.codec is not None,
+        "items": {dtype: len(values) for dtype, values in sizes.items()},
+        "vector_bytes": {dtype: int(sum(values)) for dtype, values in sizes.items()}
+    }
+
+
+def refresh_graphs(store: EmbeddingStore, rebuild: bool = True) -> dict:
+    """
+    Bring the per-user compatibility graphs in line with the current
+    codebooks after retraining: rebuild them from the new codes, or, when
+    the fashion model cannot be loaded here (or rebuild is False), delete
+    them so they are rebuilt through /compatibility/rebuild.
+    """
+    from compatibility_graph import compatibility_graph
+    fashion = None
+    if rebuild:
+        try:
+            from fashion import FashionCompatibility
+            random_init = os.environ.get("MODEL_RANDOM_WEIGHTS", "").lower() in ("1", "true", "yes")
+            fashion = FashionCompatibility(random_init=random_init)
+        except Exception as e:
+            logger.warning(f"Cannot load FashionCompatibility to rebuild graphs, invalidating them instead: {e}")
+
+    rebuilt, invalidated = [], []
+    for user_id in compatibility_graph.user_ids():
+        if fashion is None:
+            compatibility_graph.drop(user_id)
+            invalidated.append(user_id)
+            continue
+        embeddings = {}
+        for item_id in compatibility_graph.item_ids(user_id):
+            embedding = store.get_encoded(item_id)
+            if embedding is not None:
+                embeddings[item_id] = embedding
+        compatibility_graph.rebuild(user_id, embeddings, store.scorer(fashion))
+        rebuilt.append(user_id)
+    if invalidated:
+        logger.info(f"Invalidated {len(invalidated)} compatibility graphs; rebuild them with /compatibility/rebuild")
+    return {"rebuilt": len(rebuilt), "invalidated": invalidated}
+
+
+def main():
+    import json
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Manage stored compatibility embeddings")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train = subparsers.add_parser("train-pq", help="Train PQ codebooks on the stored embeddings")
+    train.add_argument("--subspaces", type=int, default=PQ_SUBSPACES)
+    train.add_argument("--centroids", type=int, default=PQ_CENTROIDS)
+    train.add_argument("--invalidate-graphs", action="store_true",
+                       help="Delete the compatibility graphs instead of rebuilding them with the fashion model")
+    subparsers.add_parser("stats", help="Count stored embeddings by representation")
+    args = parser.parse_args()
+
+    if args.command == "train-pq":
+        result = train_pq(embedding_store, args.subspaces, args.centroids)
+        # Graph scores came from the old codes
+        if embedding_store.format == "pq":
+            result["compatibility_graphs"] = refresh_graphs(embedding_store, rebuild=not args.invalidate_graphs)
+    else:
+        result = stats(embedding_store)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
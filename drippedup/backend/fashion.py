@@ -1,31 +1,51 @@
 import os
+import copy
+import hashlib
 import logging
 from dotenv import load_dotenv
 from typing import Dict, Optional, Union
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval
 from torchvision import models, transforms
 from PIL import Image
 import numpy as np
 import cv2
+from metrics import stage, BATCH_SIZE
+from threading_config import configure_torch
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Backbones SiameseNetwork can be built on: constructor and pooled feature size.
+# resnet50 is the original model; the others are distilled from it (distill_fashion.py).
+BACKBONES = {
+    "resnet50": (models.resnet50, 2048),
+    "resnet18": (models.resnet18, 512),
+    "mobilenet_v3_small": (models.mobilenet_v3_small, 576),
+}
+DEFAULT_BACKBONE = "resnet50"
+
+
 class SiameseNetwork(nn.Module):
     """
     Improved Siamese Network with better architecture
     """
-    def __init__(self, embedding_dim=128, dropout=0.3):
+    def __init__(self, embedding_dim=128, dropout=0.3, pretrained=True, backbone=DEFAULT_BACKBONE):
         super(SiameseNetwork, self).__init__()
 
-
-        self.backbone = models.resnet50(pretrained=True)
-        backbone_output_dim = 2048
+        if backbone not in BACKBONES:
+            raise ValueError(f"Unknown fashion backbone: {backbone}")
+        self.backbone_name = backbone
+        constructor, backbone_output_dim = BACKBONES[backbone]
+        if backbone == DEFAULT_BACKBONE:
+            self.backbone = constructor(pretrained=pretrained)
+        else:
+            self.backbone = constructor(weights="DEFAULT" if pretrained else None)
         
-        # Remove the final classification layer
+        # Remove the final classification layer (ResNet fc, MobileNet classifier)
         self.feature_extractor = nn.Sequential(*list(self.backbone.children())[:-1])
 
         # Freeze early layers
@@ -69,24 +89,178 @@ class SiameseNetwork(nn.Module):
         compatibility = self.classifier(combined)
         return compatibility, embedding1, embedding2
 
+
+# ========== OPTIMIZED INFERENCE ==========
+
+def _fuse_children(module: nn.Module) -> None:
+    """
+    Fold every BatchNorm that directly follows a Conv2d or Linear sibling into
+    it, in place, and drop Dropout. Relies on children being registered in the
+    order forward() applies them, which holds for torchvision ResNets and
+    MobileNetV3 and the Sequential heads of SiameseNetwork.
+    """
+    names = list(module._modules.keys())
+    for current, following in zip(names, names[1:]):
+        layer, norm = module._modules[current], module._modules[following]
+        if isinstance(layer, nn.Conv2d) and isinstance(norm, nn.BatchNorm2d):
+            module._modules[current] = fuse_conv_bn_eval(layer, norm)
+            module._modules[following] = nn.Identity()
+        elif isinstance(layer, nn.Linear) and isinstance(norm, nn.BatchNorm1d):
+            module._modules[current] = fuse_linear_bn_eval(layer, norm)
+            module._modules[following] = nn.Identity()
+    for name, child in module._modules.items():
+        if isinstance(child, nn.Dropout):
+            module._modules[name] = nn.Identity()
+        elif child is not None:
+            _fuse_children(child)
+
+
+class _Encoder(nn.Module):
+    """forward_once as a standalone module, so it can be traced or compiled"""
+    def __init__(self, feature_extractor: nn.Module, embedding: nn.Module, channels_last: bool):
+        super().__init__()
+        self.feature_extractor = feature_extractor
+        self.embedding = embedding
+        self.channels_last = channels_last
+
+    def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        features = self.feature_extractor(x)
+        embedding = self.embedding(features)
+        return F.normalize(embedding, p=2, dim=1)
+
+
+class OptimizedSiamese(nn.Module):
+    """
+    Inference-only SiameseNetwork with the same forward_once / classifier /
+    forward interface, built by optimize_for_inference.
+    """
+    def __init__(self, encoder: nn.Module, classifier: nn.Module):
+        super().__init__()
+        self.encoder = encoder
+        self.classifier = classifier
+
+    def forward_once(self, x):
+        return self.encoder(x)
+
+    def forward(self, image1, image2):
+        embedding1 = self.forward_once(image1)
+        embedding2 = self.forward_once(image2)
+        combined = torch.cat([embedding1, embedding2], dim=1)
+        compatibility = self.classifier(combined)
+        return compatibility, embedding1, embedding2
+
+
+def optimize_for_inference(model: SiameseNetwork, compile_mode: str = "trace",
+                           channels_last: bool = True) -> OptimizedSiamese:
+    """
+    Build an optimized inference copy of an eval-mode SiameseNetwork.
+
+    BatchNorm layers are fused into the preceding convolution or linear
+    layer, dropout is removed and, with channels_last, the backbone runs in
+    NHWC layout. The encoder (forward_once) and the compatibility head are
+    then compiled separately:
+
+        "trace"    torch.jit.trace + freeze (default)
+        "script"   torch.jit.script + freeze
+        "compile"  torch.compile (PyTorch 2)
+        "none"     fused eager modules
+
+    The source model is not modified.
+    """
+    model = copy.deepcopy(model).eval()
+    device = next(model.parameters()).device
+    _fuse_children(model.feature_extractor)
+    _fuse_children(model.embedding)
+    _fuse_children(model.classifier)
+    if channels_last:
+        model.feature_extractor = model.feature_extractor.to(memory_format=torch.channels_last)
+
+    encoder = _Encoder(model.feature_extractor, model.embedding, channels_last).eval()
+    classifier = model.classifier.eval()
+    embedding_dim = classifier[0].in_features // 2
+
+    if compile_mode in ("trace", "script"):
+        with torch.no_grad():
+            if compile_mode == "trace":
+                encoder = torch.jit.trace(encoder, torch.randn(2, 3, 224, 224, device=device))
+                classifier = torch.jit.trace(classifier, torch.randn(2, embedding_dim * 2, device=device))
+            else:
+                encoder = torch.jit.script(encoder)
+                classifier = torch.jit.script(classifier)
+            encoder = torch.jit.freeze(encoder)
+            classifier = torch.jit.freeze(classifier)
+    elif compile_mode == "compile":
+        encoder = torch.compile(encoder)
+        classifier = torch.compile(classifier)
+    elif compile_mode != "none":
+        raise ValueError(f"Unknown compile mode: {compile_mode}")
+
+    return OptimizedSiamese(encoder, classifier)
+
 class FashionCompatibility:
-    def __init__(self, model_path: Optional[str] = None):
+    def __init__(self, model_path: Optional[str] = None, random_init: bool = False,
+                 inference_mode: Optional[str] = None, backbone: Optional[str] = None):
         """
         Initialize the compatibility tester
         Args:
-            model_path: Path to the saved model weights
+            model_path: Path to the saved model weights. Defaults to the
+                FASHION_WEIGHTS_PATH environment variable for resnet50 and to
+                FASHION_STUDENT_WEIGHTS_PATH (siamese_<backbone>.pth) for the
+                distilled backbones.
+            random_init: Keep randomly initialized weights instead of loading
+                them (no download, no weights file). Only useful for benchmarks and tests.
+            inference_mode: "eager" runs SiameseNetwork as is; "optimized" runs
+                a BatchNorm-fused, channels-last, compiled copy under
+                torch.inference_mode (see optimize_for_inference). Defaults to
+                the FASHION_INFERENCE_MODE environment variable, then "eager".
+            backbone: One of BACKBONES. Defaults to the FASHION_BACKBONE
+                environment variable, then resnet50.
         """
         load_dotenv()
+        configure_torch()
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model_weights_path = "C:/Users/bansb/OneDrive/Desktop/DS460/AI-Outfit-Creator/drippedup/backend/siamese_model_real.pth"
-        if not self.model_weights_path:
+        self.backbone = (backbone or os.environ.get("FASHION_BACKBONE", DEFAULT_BACKBONE)).strip().lower()
+        if self.backbone == DEFAULT_BACKBONE:
+            self.model_weights_path = model_path or os.environ.get(
+                "FASHION_WEIGHTS_PATH",
+                "C:/Users/bansb/OneDrive/Desktop/DS460/AI-Outfit-Creator/drippedup/backend/siamese_model_real.pth"
+            )
+        else:
+            self.model_weights_path = model_path or os.environ.get(
+                "FASHION_STUDENT_WEIGHTS_PATH",
+                os.path.join(os.path.dirname(__file__), f"siamese_{self.backbone}.pth")
+            )
+        self.random_init = random_init
+        if not self.model_weights_path and not random_init:
             logger.error("No model weights path specified in environment variables or constructor.")
             raise ValueError("Model weights path must be specified.")
 
-        self.model = SiameseNetwork(embedding_dim=128)
-        self._load_weights()
+        self.model = SiameseNetwork(embedding_dim=128, pretrained=not random_init, backbone=self.backbone)
+        if random_init:
+            logger.warning("Using randomly initialized fashion model weights")
+        else:
+            self._load_weights()
         self.model.to(self.device)
         self.model.eval()
+        # Eager head kept for score_codes, which needs its first layer on its own
+        self._head = self.model.classifier
+        self._code_tables = None
+
+        self.inference_mode = (inference_mode or os.environ.get("FASHION_INFERENCE_MODE", "eager")).strip().lower()
+        if self.inference_mode == "optimized":
+            self.compile_mode = os.environ.get("FASHION_COMPILE", "trace").strip().lower()
+            channels_last = os.environ.get("FASHION_CHANNELS_LAST", "1").lower() in ("1", "true", "yes")
+            self.model = optimize_for_inference(self.model, self.compile_mode, channels_last)
+            self._grad_context = torch.inference_mode
+            logger.info(f"Optimized fashion inference enabled (compile={self.compile_mode}, "
+                        f"channels_last={channels_last})")
+        elif self.inference_mode == "eager":
+            self.compile_mode = None
+            self._grad_context = torch.no_grad
+        else:
+            raise ValueError(f"Unknown FASHION_INFERENCE_MODE: {self.inference_mode}")
 
         self.transform = transforms.Compose([
             transforms.Resize((224, 224)),
@@ -109,8 +283,9 @@ class FashionCompatibility:
         Load image from file path
         """
         try:
-            image = Image.open(image_path).convert('RGB')
-            image_tensor = self.transform(image).unsqueeze(0)
+            with stage("decode_resize", "fashion"):
+                image = Image.open(image_path).convert('RGB')
+                image_tensor = self.transform(image).unsqueeze(0)
             return image_tensor.to(self.device)
         except Exception as e:
             logger.error(f"Error loading image {image_path}: {e}")
@@ -157,7 +332,8 @@ class FashionCompatibility:
             if tensor1 is None or tensor2 is None:
                 raise ValueError("Failed to load one or both images")
             
-            with torch.no_grad():
+            BATCH_SIZE.observe(2, model="fashion")
+            with self._grad_context(), stage("model_forward", "fashion"):
                 compatibility, embedding1, embedding2 = self.model(tensor1, tensor2)
                 score = float(compatibility.item())
                 emb1 = embedding1.cpu().numpy().flatten().tolist()
@@ -172,14 +348,100 @@ class FashionCompatibility:
             logger.error(f"Error making prediction: {e}")
             raise
 
+    def embed(self, images: torch.Tensor) -> torch.Tensor:
+        """
+        Compute L2-normalized embeddings for a batch of preprocessed images.
+        Embeddings can be cached and reused for every pair an item takes part in.
+        """
+        BATCH_SIZE.observe(len(images), model="fashion")
+        with self._grad_context(), stage("model_forward", "fashion"):
+            return self.model.forward_once(images.to(self.device))
+
+    def embed_image(self, img: Union[Image.Image, np.ndarray, str]) -> np.ndarray:
+        """
+        Compute the embedding of a single image (PIL image, array or path)
+        as a flat float32 array, ready to be stored for the item.
+        """
+        with stage("decode_resize", "fashion"):
+            tensor = self.preprocess_image(img)
+        if tensor is None:
+            raise ValueError("Failed to load image")
+        return self.embed(tensor).cpu().numpy().astype(np.float32).flatten()
+
+    def embed_images(self, images) -> np.ndarray:
+        """
+        Embed several images (PIL images, arrays or paths) in one forward
+        pass. Returns an (n, 128) float32 array, one row per image.
+        """
+        with stage("decode_resize", "fashion"):
+            tensors = [self.preprocess_image(img) for img in images]
+        if any(tensor is None for tensor in tensors):
+            raise ValueError("Failed to load image")
+        return self.embed(torch.cat(tensors)).cpu().numpy().astype(np.float32)
+
+    def score_embeddings(self, embeddings1: torch.Tensor, embeddings2: torch.Tensor) -> torch.Tensor:
+        """
+        Score pairs of precomputed embeddings with the compatibility head.
+        Row i of both inputs forms one pair. Returns a 1-D tensor of scores.
+        """
+        with self._grad_context(), stage("model_forward", "fashion_head"):
+            combined = torch.cat([embeddings1.to(self.device), embeddings2.to(self.device)], dim=1)
+            return self.model.classifier(combined).flatten()
+
+    def score_embedding_arrays(self, embeddings1: np.ndarray, embeddings2: np.ndarray) -> np.ndarray:
+        """score_embeddings for float32 arrays of stored embeddings, returning a float32 array."""
+        scores = self.score_embeddings(torch.from_numpy(np.ascontiguousarray(embeddings1, dtype=np.float32)),
+                                       torch.from_numpy(np.ascontiguousarray(embeddings2, dtype=np.float32)))
+        return scores.cpu().numpy().astype(np.float32)
+
+    def _tables_for(self, codebooks: np.ndarray):
+        """
+        Lookup tables of the head's first linear layer for PQ codebooks:
+        entry [side, m, k] is that layer's output for centroid k of subspace
+        m placed in the left or right embedding. Cached per codebook.
+        """
+        key = hashlib.blake2b(np.ascontiguousarray(codebooks).tobytes(), digest_size=8).hexdigest()
+        if self._code_tables is not None and self._code_tables[0] == key:
+            return self._code_tables[1]
+        first = self._head[0]
+        subspaces, _, sub_dim = codebooks.shape
+        with torch.no_grad():
+            centroids = torch.from_numpy(np.ascontiguousarray(codebooks, dtype=np.float32)).to(self.device)
+            # (hidden, 2 * dim) -> (2, subspaces, hidden, sub_dim)
+            weight = first.weight.view(first.out_features, 2, subspaces, sub_dim).permute(1, 2, 0, 3)
+            tables = torch.einsum("mks,tmhs->tmkh", centroids, weight).contiguous()
+        self._code_tables = (key, tables)
+        return tables
+
+    def score_codes(self, codes1: np.ndarray, codes2: np.ndarray, codebooks: np.ndarray) -> np.ndarray:
+        """
+        Score pairs of PQ-coded embeddings (see embedding_store) without
+        decoding them. The head's first linear layer becomes a sum of table
+        lookups, one per subspace and side; the rest of the head runs as
+        usual. Row i of both code arrays forms one pair.
+        """
+        tables = self._tables_for(codebooks)
+        with self._grad_context(), stage("model_forward", "fashion_head"):
+            subspaces = torch.arange(tables.shape[1], device=self.device)
+            left = torch.from_numpy(np.asarray(codes1, dtype=np.int64)).to(self.device)
+            right = torch.from_numpy(np.asarray(codes2, dtype=np.int64)).to(self.device)
+            hidden = (self._head[0].bias
+                      + tables[0][subspaces, left].sum(dim=1)
+                      + tables[1][subspaces, right].sum(dim=1))
+            scores = self._head[1:](hidden).flatten()
+        return scores.cpu().numpy().astype(np.float32)
+
     def get_model_info(self) -> Dict:
         if self.model is None:
             return {"error": "Model not initialized"}
         return {
-            "model_type": "Siamese ResNet-based",
+            "model_type": "Siamese ResNet-based" if self.backbone == DEFAULT_BACKBONE else "Siamese distilled",
+            "backbone": self.backbone,
             "input_shape": (224, 224, 3),
             "embedding_dim": 128,
-            "weights_loaded": self.model_weights_path is not None
+            "inference_mode": self.inference_mode,
+            "compile_mode": self.compile_mode,
+            "weights_loaded": not self.random_init and self.model_weights_path is not None
         }
     
 
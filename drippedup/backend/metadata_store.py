@@ -0,0 +1,401 @@
+# backend/metadata_store.py
+import os
+import json
+import shutil
+import tempfile
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional
+from filelock import FileLock
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Fields that are indexed as soon as a store is loaded. Any other field gets
+# an index the first time it is queried.
+DEFAULT_INDEXED_FIELDS = ("category", "tags", "user_id")
+
+# Compact once the log holds at least this many records and more records than
+# there are live entries, which keeps the amortized cost of a write O(1).
+DEFAULT_COMPACT_THRESHOLD = 1000
+
+
+class MetadataStore:
+    """
+    Indexed, append-only store for one metadata JSON file.
+
+    The JSON file keeps its original format (a list of entries) and acts as a
+    snapshot. Every change is appended as one JSON line to ``<file>.log`` and
+    folded back into the snapshot during compaction. Entries are held in an
+    insertion-ordered dict keyed by ID, with a value -> IDs index per field,
+    so lookups never touch the disk and a save writes a single line.
+
+    Several processes may share the same files. Writers hold ``<file>.lock``
+    while appending or compacting, snapshots are replaced atomically, and
+    concurrent saves within a process are group-committed: whichever thread
+    finds no write in progress appends everything queued so far with one
+    write and one fsync while the others wait for it.
+
+    Lock order is always file lock, then the in-process lock.
+    """
+
+    def __init__(self, metadata_file: str, compact_threshold: int = DEFAULT_COMPACT_THRESHOLD):
+        """
+        Initialize the store and load the snapshot and log.
+
+        Args:
+            metadata_file: Path to the JSON snapshot file.
+            compact_threshold: Minimum number of log records before compaction.
+        """
+        self.metadata_file = metadata_file
+        self.log_file = metadata_file + ".log"
+        self.compact_threshold = compact_threshold
+
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(metadata_file + ".lock")
+        self._commit_cond = threading.Condition()
+        self._commit_queue: List["_PendingWrite"] = []
+        self._committing = False
+
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._indexes: Dict[str, Dict[Any, Dict[str, None]]] = {}
+        self._snapshot_signature = None
+        self._log_offset = 0
+        self._log_records = 0
+
+        with self._file_lock:
+            with self._lock:
+                self._reload()
+
+    # ========== READS ==========
+
+    def all(self) -> List[Dict]:
+        """Return every entry in insertion order."""
+        self._refresh()
+        with self._lock:
+            return [dict(entry) for entry in self._entries.values()]
+
+    def get(self, id: str) -> Optional[Dict]:
+        """Return the entry with the given ID, or None if not found."""
+        self._refresh()
+        with self._lock:
+            entry = self._entries.get(id)
+            return dict(entry) if entry is not None else None
+
+    def recent(self, n: int) -> List[Dict]:
+        """Return the n most recently written entries, oldest first."""
+        if n <= 0:
+            return []
+        self._refresh()
+        with self._lock:
+            result = []
+            for key in reversed(self._entries):
+                if len(result) >= n:
+                    break
+                result.append(dict(self._entries[key]))
+            result.reverse()
+            return result
+
+    def find(self, field: str, value: Any) -> List[Dict]:
+        """Return all entries whose field equals value or, for list fields, contains it."""
+        self._refresh()
+        with self._lock:
+            ids = self._index(field).get(value, {})
+            return [dict(self._entries[key]) for key in ids]
+
+    def unique_values(self, field: str) -> List[Any]:
+        """Return the sorted distinct values of a field, flattening list fields."""
+        self._refresh()
+        with self._lock:
+            return sorted(self._index(field).keys())
+
+    def group_by(self, field: str) -> Dict[Any, List[Dict]]:
+        """Return entries grouped by a scalar field, skipping entries without it."""
+        self._refresh()
+        with self._lock:
+            grouped: Dict[Any, List[Dict]] = {}
+            for entry in self._entries.values():
+                value = entry.get(field)
+                if value:
+                    grouped.setdefault(value, []).append(dict(entry))
+            return grouped
+
+    # ========== WRITES ==========
+
+    def put(self, entry: Dict):
+        """Insert or replace an entry. A replaced entry moves to the end."""
+        self._append([{"op": "put", "entry": entry}])
+
+    def delete(self, id: str) -> bool:
+        """Delete an entry by ID. Returns True if it existed."""
+        self._refresh()
+        with self._lock:
+            if id not in self._entries:
+                return False
+        self._append([{"op": "delete", "id": id}])
+        return True
+
+    def replace_all(self, entries: List[Dict]):
+        """Replace the whole contents of the store with the given entries."""
+        with self._file_lock:
+            self._write_snapshot(entries)
+            with self._lock:
+                self._reload()
+
+    def compact(self):
+        """Fold the log into the JSON snapshot and start a fresh log."""
+        with self._file_lock:
+            with self._lock:
+                self._sync()
+                entries = list(self._entries.values())
+            self._write_snapshot(entries)
+            with self._lock:
+                self._reload()
+
+    def copy_to(self, directory: str) -> List[str]:
+        """
+        Copy the snapshot and the log into a directory as one consistent pair
+        (no write or compaction can happen in between). Returns the copied paths.
+        """
+        copied = []
+        with self._file_lock:
+            for path in (self.metadata_file, self.log_file):
+                if os.path.exists(path):
+                    copied.append(shutil.copy2(path, os.path.join(directory, os.path.basename(path))))
+        return copied
+
+    def _append(self, records: List[Dict]):
+        """Queue change records for the next group commit and wait until they are durable."""
+        pending = _PendingWrite(records)
+        with self._commit_cond:
+            self._commit_queue.append(pending)
+            while self._committing and not pending.done:
+                self._commit_cond.wait()
+            if pending.done:
+                # Another thread committed our records as part of its batch
+                if pending.error is not None:
+                    raise pending.error
+                return
+            self._committing = True
+            batch = self._commit_queue
+            self._commit_queue = []
+
+        error = None
+        try:
+            self._commit(batch)
+        except Exception as e:
+            logger.error(f"Failed to commit {len(batch)} writes to {self.log_file}: {e}")
+            error = e
+
+        with self._commit_cond:
+            for item in batch:
+                item.done = True
+                item.error = error
+            self._committing = False
+            self._commit_cond.notify_all()
+        if error is not None:
+            raise error
+
+    def _commit(self, batch: List["_PendingWrite"]):
+        """Append a batch of records with one write and one fsync, then apply them."""
+        payload = "".join(
+            json.dumps(record, ensure_ascii=False) + "\n"
+            for item in batch
+            for record in item.records
+        ).encode("utf-8")
+        with self._file_lock:
+            with open(self.log_file, "ab") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            with self._lock:
+                # Memory only ever follows the log, so read our own records back
+                self._sync()
+                needs_compaction = (self._log_records >= self.compact_threshold
+                                    and self._log_records > len(self._entries))
+            if needs_compaction:
+                self.compact()
+
+    def _write_snapshot(self, entries: List[Dict]):
+        """Atomically replace the JSON snapshot and truncate the log. Caller holds the file lock."""
+        payload = json.dumps(entries, ensure_ascii=False, indent=2).encode("utf-8")
+        atomic_write(self.metadata_file, lambda f: f.write(payload), durable=True)
+        with open(self.log_file, "w", encoding="utf-8"):
+            pass
+
+    # ========== LOADING ==========
+
+    def _signature(self, path: str):
+        """Return a cheap change signature for a file, or None if it is missing."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _log_size(self) -> int:
+        try:
+            return os.path.getsize(self.log_file)
+        except FileNotFoundError:
+            return 0
+
+    def _refresh(self):
+        """
+        Pick up changes written by other writers. Costs one or two stat calls
+        when nothing changed; otherwise the new state is read under the file
+        lock so a half-finished compaction is never observed.
+        """
+        if (self._signature(self.metadata_file) == self._snapshot_signature
+                and self._log_size() == self._log_offset):
+            return
+        with self._file_lock:
+            with self._lock:
+                self._sync()
+
+    def _sync(self):
+        """Bring memory up to date with the files. Caller holds both locks."""
+        if self._signature(self.metadata_file) != self._snapshot_signature:
+            self._reload()
+            return
+        log_size = self._log_size()
+        if log_size < self._log_offset:
+            self._reload()
+        elif log_size > self._log_offset:
+            self._read_log()
+
+    def _reload(self):
+        """Rebuild the in-memory state from the snapshot and the full log."""
+        self._entries = OrderedDict()
+        self._indexes = {}
+        self._log_offset = 0
+        self._log_records = 0
+        self._snapshot_signature = self._signature(self.metadata_file)
+
+        if self._snapshot_signature is not None:
+            with open(self.metadata_file, "r", encoding="utf-8") as f:
+                try:
+                    snapshot = json.load(f)
+                except Exception as e:
+                    logger.error(f"Failed to parse {self.metadata_file}: {e}")
+                    snapshot = []
+            for entry in snapshot:
+                self._apply_put(entry)
+
+        for field in DEFAULT_INDEXED_FIELDS:
+            self._index(field)
+        self._read_log()
+
+    def _read_log(self):
+        """Apply complete log records after the current offset."""
+        if not os.path.exists(self.log_file):
+            return
+        with open(self.log_file, "rb") as f:
+            f.seek(self._log_offset)
+            data = f.read()
+        # A record is only visible once its trailing newline has been written
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except Exception as e:
+                logger.error(f"Skipping corrupt record in {self.log_file}: {e}")
+                continue
+            if record.get("op") == "put":
+                self._apply_put(record["entry"])
+            elif record.get("op") == "delete":
+                self._apply_delete(record["id"])
+            self._log_records += 1
+        self._log_offset += end
+
+    def _apply_put(self, entry: Dict):
+        key = entry.get("id")
+        if key is None:
+            # Legacy entries without an ID are kept but cannot be addressed
+            key = f"__no_id_{len(self._entries)}"
+        self._apply_delete(key)
+        self._entries[key] = entry
+        for field, index in self._indexes.items():
+            for value in _index_values(entry.get(field)):
+                index.setdefault(value, {})[key] = None
+
+    def _apply_delete(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for field, index in self._indexes.items():
+            for value in _index_values(entry.get(field)):
+                ids = index.get(value)
+                if ids is not None:
+                    ids.pop(key, None)
+                    if not ids:
+                        del index[value]
+
+    def _index(self, field: str) -> Dict[Any, Dict[str, None]]:
+        """Return the index for a field, building it on first use."""
+        index = self._indexes.get(field)
+        if index is None:
+            index = {}
+            for key, entry in self._entries.items():
+                for value in _index_values(entry.get(field)):
+                    index.setdefault(value, {})[key] = None
+            self._indexes[field] = index
+        return index
+
+
+class _PendingWrite:
+    """Records waiting for a group commit, and the outcome of that commit."""
+    __slots__ = ("records", "done", "error")
+
+    def __init__(self, records: List[Dict]):
+        self.records = records
+        self.done = False
+        self.error: Optional[Exception] = None
+
+
+def _index_values(value: Any) -> Iterable[Any]:
+    """Return the hashable index keys for a field value."""
+    if not value:
+        return ()
+    values = value if isinstance(value, list) else [value]
+    return [v for v in values if v and isinstance(v, (str, int, float, bool))]
+
+
+def atomic_write(path: str, writer: Callable[[BinaryIO], Any], durable: bool = False):
+    """
+    Replace a file atomically: writer fills a temp file (opened in binary
+    mode) in the same directory, which is then renamed over path. Readers
+    see the old file or the new one, never a partial write. The temp file is
+    removed if writing fails. With durable, the data is fsynced before the
+    rename.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            writer(f)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+_stores: Dict[str, MetadataStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(metadata_file: str) -> MetadataStore:
+    """Return the shared store for a metadata file, loading it on first use."""
+    path = os.path.abspath(metadata_file)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = MetadataStore(path)
+            _stores[path] = store
+        return store
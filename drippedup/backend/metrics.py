@@ -0,0 +1,249 @@
+# backend/metrics.py
+"""
+Minimal Prometheus-style metrics for the API.
+
+Counters, gauges and histograms with labels, rendered in the Prometheus
+text exposition format by the /metrics endpoint. Request stages are timed
+with the `stage` context manager or the `timed_stage` decorator:
+
+    with stage("decode_resize"):
+        ...
+
+    @timed_stage("supabase_query", component="supabase")
+    async def query(...):
+        ...
+"""
+import time
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Seconds. Covers sub-millisecond decode steps up to multi-second model calls.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(key, self._snapshot(value)) for key, value in self._values.items()]
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _snapshot(self, value):
+        return value
+
+    def _render_sample(self, key, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """Increment while the block runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """Cumulative histogram with fixed buckets."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _snapshot(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+    def _render_sample(self, key, value) -> List[str]:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, ("le", repr(float(bound))))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+        lines.append(f"{self.name}_bucket{labels} {count}")
+        base = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{base} {total}")
+        lines.append(f"{self.name}_count{base} {count}")
+        return lines
+
+
+class Registry:
+    """Holds every metric and renders them for /metrics."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ========== APPLICATION METRICS ==========
+
+STAGE_SECONDS = Histogram(
+    "drippedup_stage_seconds",
+    "Time spent in each stage of request handling",
+    ["stage", "component"]
+)
+REQUEST_SECONDS = Histogram(
+    "drippedup_request_seconds",
+    "End-to-end request latency by route",
+    ["method", "route", "status"]
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "drippedup_requests_in_flight",
+    "Requests currently being handled"
+)
+CACHE_REQUESTS = Counter(
+    "drippedup_cache_requests_total",
+    "Cache lookups by cache and result (hit or miss)",
+    ["cache", "result"]
+)
+BATCH_SIZE = Histogram(
+    "drippedup_model_batch_size",
+    "Number of images per model forward",
+    ["model"],
+    buckets=BATCH_SIZE_BUCKETS
+)
+CASCADE_PREDICTIONS = Counter(
+    "drippedup_cascade_predictions_total",
+    "Cascade classifications by the stage that answered (student or full)",
+    ["stage"]
+)
+SINGLEFLIGHT_CALLS = Counter(
+    "drippedup_singleflight_calls_total",
+    "Coalesced calls by group and role (leader ran the call, shared joined one in flight)",
+    ["group", "role"]
+)
+
+
+def observe_stage(name: str, seconds: float, component: str = "server"):
+    """Record a stage duration measured elsewhere."""
+    STAGE_SECONDS.observe(seconds, stage=name, component=component)
+
+
+@contextmanager
+def stage(name: str, component: str = "server"):
+    """Time the enclosed block as a request stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name, component=component)
+
+
+def timed_stage(name: str, component: str = "server"):
+    """Decorator timing a sync or async function as a request stage."""
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name, component):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name, component):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup."""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
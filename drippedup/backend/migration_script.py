@@ -3,10 +3,16 @@ import os
 import json
 import asyncio
 import shutil
+import hashlib
 from pathlib import Path
 from supabase_service import supabase_service
+from metadata_store import atomic_write, get_store
 from fastapi import UploadFile
 import tempfile
+from datetime import datetime
+
+# Files safe to hardlink into the backup because they are never modified in place
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.webp', '.gif'}
 
 class LocalToSupabaseMigration:
     """Migration script to move data from local JSON files to Supabase"""
@@ -32,17 +38,22 @@ class LocalToSupabaseMigration:
         print(f"[MIGRATION] {message}")
         self.migration_log.append(message)
     
+    @staticmethod
+    def _has_metadata(metadata_file: Path) -> bool:
+        """A store's entries may live in its snapshot, its log or both"""
+        return metadata_file.exists() or Path(f"{metadata_file}.log").exists()
+    
     async def migrate_clothing_items(self):
         """Migrate clothing items from local storage to Supabase"""
-        if not self.metadata_file.exists():
+        if not self._has_metadata(self.metadata_file):
             self.log("No metadata.json file found, skipping clothing items migration")
             return
         
         self.log("Starting clothing items migration...")
         
         try:
-            with open(self.metadata_file, 'r', encoding='utf-8') as f:
-                items = json.load(f)
+            # Through the store: recent saves and deletes may still be in metadata.json.log
+            items = get_store(str(self.metadata_file)).all()
         except Exception as e:
             self.log(f"Error reading metadata.json: {e}")
             return
@@ -142,15 +153,14 @@ class LocalToSupabaseMigration:
     
     async def migrate_outfits(self):
         """Migrate outfits from local storage to Supabase"""
-        if not self.outfit_metadata_file.exists():
+        if not self._has_metadata(self.outfit_metadata_file):
             self.log("No outfit_metadata.json file found, skipping outfits migration")
             return
         
         self.log("Starting outfits migration...")
         
         try:
-            with open(self.outfit_metadata_file, 'r', encoding='utf-8') as f:
-                outfits = json.load(f)
+            outfits = get_store(str(self.outfit_metadata_file)).all()
         except Exception as e:
             self.log(f"Error reading outfit_metadata.json: {e}")
             return
@@ -207,28 +217,35 @@ class LocalToSupabaseMigration:
         
         self.log(f"Successfully migrated outfit: {old_id} -> {new_outfit['id']} ({name})")
     
-    async def create_backup(self):
-        """Create a backup of the original data before migration"""
+    async def create_backup(self, incremental: bool = True):
+        """
+        Create a backup of the original data before migration
+        
+        Args:
+            incremental: Only copy images that changed since the last snapshot.
+                When False, the backup images directory is rebuilt from scratch.
+        """
         backup_dir = self.backend_dir / "migration_backup"
         backup_dir.mkdir(exist_ok=True)
         
         try:
-            # Backup metadata files
-            if self.metadata_file.exists():
-                shutil.copy2(self.metadata_file, backup_dir / "metadata.json")
-                self.log("Backed up metadata.json")
-            
-            if self.outfit_metadata_file.exists():
-                shutil.copy2(self.outfit_metadata_file, backup_dir / "outfit_metadata.json")
-                self.log("Backed up outfit_metadata.json")
+            # Backup metadata files with their logs of writes not yet compacted
+            for metadata_file in (self.metadata_file, self.outfit_metadata_file):
+                if self._has_metadata(metadata_file):
+                    get_store(str(metadata_file)).copy_to(str(backup_dir))
+                    self.log(f"Backed up {metadata_file.name} and its log")
             
             # Backup images directory
             if self.images_dir.exists():
                 backup_images_dir = backup_dir / "images"
-                if backup_images_dir.exists():
-                    shutil.rmtree(backup_images_dir)
-                shutil.copytree(self.images_dir, backup_images_dir)
-                self.log("Backed up images directory")
+                if incremental:
+                    self._incremental_image_backup(backup_images_dir, backup_dir / "manifest.json")
+                else:
+                    if backup_images_dir.exists():
+                        shutil.rmtree(backup_images_dir)
+                    shutil.copytree(self.images_dir, backup_images_dir)
+                    self._write_manifest(backup_dir / "manifest.json", self._scan_images(backup_images_dir, {}))
+                    self.log("Backed up images directory")
             
             self.log(f"Backup completed in: {backup_dir}")
             
@@ -236,6 +253,105 @@ class LocalToSupabaseMigration:
             self.log(f"Error creating backup: {e}")
             raise
     
+    def _incremental_image_backup(self, backup_images_dir: Path, manifest_path: Path):
+        """
+        Bring the backup images directory up to date with the live one.
+        
+        Files whose size and mtime match the previous manifest are skipped
+        without being read. Files whose stat changed are hashed and only
+        replaced when the content differs. Image files are hardlinked when the
+        filesystem allows it (uploads are written once and never edited in
+        place); everything else, such as the metadata JSON, is copied.
+        """
+        previous = self._read_manifest(manifest_path)
+        current = self._scan_images(self.images_dir, previous)
+        
+        copied = linked = skipped = 0
+        for rel_path, entry in current.items():
+            target = backup_images_dir / rel_path
+            old_entry = previous.get(rel_path)
+            if old_entry and old_entry["blake2b"] == entry["blake2b"] and target.exists():
+                skipped += 1
+                continue
+            
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if target.exists():
+                # Never write through an existing hardlink, it would modify the source too
+                target.unlink()
+            source = self.images_dir / rel_path
+            if source.suffix.lower() in IMAGE_SUFFIXES:
+                try:
+                    os.link(source, target)
+                    linked += 1
+                    continue
+                except OSError:
+                    pass
+            shutil.copy2(source, target)
+            copied += 1
+        
+        # Drop files that no longer exist in the live directory
+        removed = 0
+        for rel_path in set(previous) - set(current):
+            stale = backup_images_dir / rel_path
+            if stale.exists():
+                stale.unlink()
+                removed += 1
+        
+        self._write_manifest(manifest_path, current)
+        self.log(f"Backed up images directory (incremental): {linked} linked, {copied} copied, "
+                 f"{skipped} unchanged, {removed} removed")
+    
+    def _scan_images(self, root: Path, previous: dict) -> dict:
+        """
+        Build a manifest of every file under root.
+        
+        The hash from the previous manifest is reused when size and mtime are
+        unchanged, so an unchanged tree costs one stat per file.
+        """
+        manifest = {}
+        for path in root.rglob("*"):
+            if not path.is_file():
+                continue
+            rel_path = path.relative_to(root).as_posix()
+            stat = path.stat()
+            old_entry = previous.get(rel_path)
+            if old_entry and old_entry["size"] == stat.st_size and old_entry["mtime_ns"] == stat.st_mtime_ns:
+                digest = old_entry["blake2b"]
+            else:
+                digest = self._hash_file(path)
+            manifest[rel_path] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "blake2b": digest
+            }
+        return manifest
+    
+    @staticmethod
+    def _hash_file(path: Path) -> str:
+        """Return the BLAKE2b hex digest of a file"""
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    @staticmethod
+    def _read_manifest(manifest_path: Path) -> dict:
+        """Load the previous snapshot manifest, or an empty one"""
+        if not manifest_path.exists():
+            return {}
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("files", {})
+        except Exception:
+            return {}
+    
+    @staticmethod
+    def _write_manifest(manifest_path: Path, files: dict):
+        """Atomically write the snapshot manifest"""
+        manifest = {"created_at": datetime.utcnow().isoformat() + "Z", "files": files}
+        atomic_write(str(manifest_path), lambda f: f.write(json.dumps(manifest).encode("utf-8")))
+    
     async def generate_migration_report(self):
         """Generate a migration report"""
         report_path = self.backend_dir / "migration_report.txt"
@@ -257,13 +373,13 @@ class LocalToSupabaseMigration:
         
         self.log(f"Migration report saved to: {report_path}")
     
-    async def run_full_migration(self, create_backup: bool = True):
+    async def run_full_migration(self, create_backup: bool = True, incremental_backup: bool = True):
         """Run the complete migration process"""
         self.log(f"Starting full migration for user: {self.user_id}")
         
         try:
             if create_backup:
-                await self.create_backup()
+                await self.create_backup(incremental=incremental_backup)
             
             # Migrate clothing items first (outfits depend on them)
             await self.migrate_clothing_items()
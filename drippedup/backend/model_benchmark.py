@@ -0,0 +1,371 @@
+# backend/model_benchmark.py
+"""
+Microbenchmarks for ClothingClassifier and FashionCompatibility.
+
+Every measurement runs in a fresh subprocess so cold load time and peak RSS
+belong to a single model and a single thread configuration. Models use
+randomly initialized weights by default, so no weight files or downloads
+are needed.
+
+    python model_benchmark.py --output models.json
+    python model_benchmark.py --models fashion --threads 1 2 4 8
+    python model_benchmark.py --models classifier classifier_student
+    FASHION_BACKBONE=mobilenet_v3_small python model_benchmark.py --models fashion
+
+Reported per model:
+  * cold load time (import + construction) and first-call warm-up
+  * steady-state latency per batch size (1..64) and images/second
+  * thread-count scaling at a few batch sizes
+  * peak RSS of the worker process
+  * FashionCompatibility only: all-pairs scoring with the pairwise forward
+    versus computing each embedding once and reusing it
+
+With --mixed, both models are loaded in one process and driven concurrently
+(single-image classifications alongside pair scorings, the /predict plus
+/fashion-predict mix) under three thread configurations: framework defaults,
+the threading_config.py budgets, and budgets plus CPU affinity partitioning.
+
+    python model_benchmark.py --mixed --duration 30
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+from typing import Dict, List, Optional
+
+DEFAULT_BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64]
+DEFAULT_SCALING_BATCH_SIZES = [1, 16]
+
+# Environment for each --mixed configuration; 0 leaves a framework's default pool size
+MIXED_CONFIGS = {
+    "framework_defaults": {"TF_INTRA_OP_THREADS": "0", "TF_INTER_OP_THREADS": "0",
+                           "TORCH_THREADS": "0", "TORCH_INTEROP_THREADS": "0", "CPU_AFFINITY": "off"},
+    "thread_budgets": {"CPU_AFFINITY": "off"},
+    "cpu_partition": {"CPU_AFFINITY": "partition"},
+}
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB, or None where unsupported."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def latency_stats(samples: List[float], batch_size: int) -> Dict:
+    """Summarize per-call latencies (seconds) for one batch size."""
+    ordered = sorted(samples)
+    p50 = ordered[len(ordered) // 2]
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        "batch_size": batch_size,
+        "iterations": len(ordered),
+        "p50_ms": round(p50 * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "images_per_s": round(batch_size / p50, 2)
+    }
+
+
+def time_calls(fn, iterations: int) -> List[float]:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_classifier(batch_sizes: List[int], iterations: int, threads: Optional[int], real_weights: bool,
+                     architecture: str = "xception") -> Dict:
+    """Benchmark ClothingClassifier (or its cascade student) in this process."""
+    start = time.perf_counter()
+    import numpy as np
+    if threads:
+        # Read by threading_config when classification is imported
+        os.environ["TF_INTRA_OP_THREADS"] = str(threads)
+        os.environ["TF_INTER_OP_THREADS"] = str(threads)
+    from classification import ClothingClassifier
+    classifier = ClothingClassifier(random_init=not real_weights, architecture=architecture)
+    cold_load = time.perf_counter() - start
+
+    size = classifier.image_size
+    rng = np.random.default_rng(0)
+    single = rng.random((1, size, size, 3), dtype=np.float32)
+
+    start = time.perf_counter()
+    classifier.predict(single)
+    warmup = time.perf_counter() - start
+
+    steady = []
+    for batch_size in batch_sizes:
+        batch = rng.random((batch_size, size, size, 3), dtype=np.float32)
+        classifier.predict_batch(batch)  # first call per shape pays for retracing
+        steady.append(latency_stats(time_calls(lambda: classifier.predict_batch(batch), iterations), batch_size))
+
+    # Single-image latency of Keras's predict loop versus the compiled serving function
+    classifier.model.predict(single, verbose=0)
+    single_image = {
+        "model_predict": latency_stats(time_calls(lambda: classifier.model.predict(single, verbose=0), iterations), 1),
+        "serving": "compiled" if classifier.get_model_info()["compiled"] else "model_predict",
+        "predict": latency_stats(time_calls(lambda: classifier.predict(single), iterations), 1)
+    }
+
+    return {
+        "cold_load_s": round(cold_load, 3),
+        "first_call_s": round(warmup, 3),
+        "steady_state": steady,
+        "single_image": single_image
+    }
+
+
+def bench_fashion(batch_sizes: List[int], iterations: int, threads: Optional[int], real_weights: bool,
+                  pair_items: int) -> Dict:
+    """Benchmark FashionCompatibility in this process."""
+    start = time.perf_counter()
+    import torch
+    if threads:
+        os.environ["TORCH_THREADS"] = str(threads)
+    from fashion import FashionCompatibility
+    fashion = FashionCompatibility(random_init=not real_weights)
+    cold_load = time.perf_counter() - start
+
+    generator = torch.Generator().manual_seed(0)
+    single = torch.randn(1, 3, 224, 224, generator=generator)
+
+    start = time.perf_counter()
+    with torch.no_grad():
+        fashion.model(single, single)
+    warmup = time.perf_counter() - start
+
+    steady = []
+    for batch_size in batch_sizes:
+        batch = torch.randn(batch_size, 3, 224, 224, generator=generator)
+        fashion.embed(batch)
+        steady.append(latency_stats(time_calls(lambda: fashion.embed(batch), iterations), batch_size))
+
+    # Score every ordered pair of `pair_items` items, the way /fashion-predict
+    # is called today versus embedding every item once
+    items = torch.randn(pair_items, 3, 224, 224, generator=generator)
+    pairs = [(i, j) for i in range(pair_items) for j in range(pair_items) if i != j]
+
+    def pairwise():
+        with torch.no_grad():
+            for i, j in pairs:
+                fashion.model(items[i:i + 1], items[j:j + 1])
+
+    def embedding_reuse():
+        embeddings = fashion.embed(items)
+        left = torch.tensor([i for i, _ in pairs])
+        right = torch.tensor([j for _, j in pairs])
+        fashion.score_embeddings(embeddings[left], embeddings[right])
+
+    pairwise_time = min(time_calls(pairwise, 1 if pair_items > 8 else 2))
+    reuse_time = min(time_calls(embedding_reuse, 3))
+
+    return {
+        "cold_load_s": round(cold_load, 3),
+        "first_call_s": round(warmup, 3),
+        "steady_state": steady,
+        "all_pairs": {
+            "items": pair_items,
+            "pairs": len(pairs),
+            "pairwise_s": round(pairwise_time, 3),
+            "embedding_reuse_s": round(reuse_time, 3),
+            "speedup": round(pairwise_time / reuse_time, 2) if reuse_time > 0 else None
+        }
+    }
+
+
+def bench_mixed(duration: float, classifier_clients: int, fashion_clients: int, real_weights: bool) -> Dict:
+    """
+    Drive both models concurrently in this process for `duration` seconds.
+    Thread budgets and affinity come from the environment (threading_config).
+    """
+    import numpy as np
+    import torch
+    import threading_config
+    from classification import ClothingClassifier
+    from fashion import FashionCompatibility
+
+    def on_model_executor(component, fn, *fn_args):
+        executor = threading_config.model_executor(component)
+        return executor.submit(fn, *fn_args).result() if executor else fn(*fn_args)
+
+    # Build each model on its own executor so pinned pools are created on the right cores
+    classifier = on_model_executor("classifier", ClothingClassifier, 224, None, not real_weights)
+    fashion = on_model_executor("fashion", FashionCompatibility, None, not real_weights)
+
+    rng = np.random.default_rng(0)
+    image = rng.random((1, classifier.image_size, classifier.image_size, 3), dtype=np.float32)
+    pair = torch.randn(1, 3, 224, 224, generator=torch.Generator().manual_seed(0))
+
+    def score_pair():
+        with torch.no_grad():
+            return fashion.model(pair, pair)
+
+    calls = {
+        "classifier": lambda: classifier.predict(image),
+        "fashion": score_pair,
+    }
+    # Warm both models (graph tracing, allocator) before measuring
+    for component, call in calls.items():
+        on_model_executor(component, call)
+
+    samples: Dict[str, List[float]] = {"classifier": [], "fashion": []}
+    deadline = time.perf_counter() + duration
+
+    def client(component):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            on_model_executor(component, calls[component])
+            samples[component].append(time.perf_counter() - start)
+
+    threads = ([threading.Thread(target=client, args=("classifier",)) for _ in range(classifier_clients)]
+               + [threading.Thread(target=client, args=("fashion",)) for _ in range(fashion_clients)])
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    result = {"threading": threading_config.describe(), "elapsed_s": round(elapsed, 3)}
+    for component, latencies in samples.items():
+        if latencies:
+            stats = latency_stats(latencies, 1)
+            stats["requests_per_s"] = round(len(latencies) / elapsed, 2)
+            del stats["images_per_s"]
+            result[component] = stats
+    return result
+
+
+def run_worker(args) -> Dict:
+    """Run one model/thread configuration in this process and return its results."""
+    if args.mixed:
+        result = bench_mixed(args.duration, args.classifier_clients, args.fashion_clients, args.real_weights)
+        result["peak_rss_mb"] = peak_rss_mb()
+        return result
+    if args.models[0] in ("classifier", "classifier_student"):
+        architecture = "xception" if args.models[0] == "classifier" else "mobilenet_v3_small"
+        result = bench_classifier(args.batch_sizes, args.iterations, args.worker_threads, args.real_weights,
+                                  architecture)
+    else:
+        result = bench_fashion(args.batch_sizes, args.iterations, args.worker_threads, args.real_weights,
+                               args.pair_items)
+    result["threads"] = args.worker_threads
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def spawn_worker(model: str, threads: Optional[int], batch_sizes: List[int], args) -> Dict:
+    """Run a worker subprocess and parse the JSON it prints on its last line."""
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker",
+        "--models", model,
+        "--batch-sizes", *map(str, batch_sizes),
+        "--iterations", str(args.iterations),
+        "--pair-items", str(args.pair_items)
+    ]
+    if threads:
+        command += ["--worker-threads", str(threads)]
+    if args.real_weights:
+        command.append("--real-weights")
+    completed = subprocess.run(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               capture_output=True, text=True)
+    return _parse_worker_output(completed)
+
+
+def spawn_mixed_worker(env_overrides: Dict[str, str], args) -> Dict:
+    """Run the mixed-load benchmark in a subprocess with the given thread environment."""
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker", "--mixed",
+        "--duration", str(args.duration),
+        "--classifier-clients", str(args.classifier_clients),
+        "--fashion-clients", str(args.fashion_clients)
+    ]
+    if args.real_weights:
+        command.append("--real-weights")
+    env = dict(os.environ)
+    env.update(env_overrides)
+    completed = subprocess.run(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               capture_output=True, text=True, env=env)
+    return _parse_worker_output(completed)
+
+
+def _parse_worker_output(completed: subprocess.CompletedProcess) -> Dict:
+    """Return the JSON a worker printed on its last line, or its error."""
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1:] or "worker failed"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the DrippedUp models")
+    parser.add_argument("--models", nargs="+", default=["classifier", "fashion"], choices=["classifier", "classifier_student", "fashion"])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=DEFAULT_BATCH_SIZES)
+    parser.add_argument("--scaling-batch-sizes", nargs="+", type=int, default=DEFAULT_SCALING_BATCH_SIZES)
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 2, 4],
+                        help="Thread counts for the scaling runs")
+    parser.add_argument("--iterations", type=int, default=10, help="Timed calls per batch size")
+    parser.add_argument("--pair-items", type=int, default=8, help="Items for the all-pairs comparison")
+    parser.add_argument("--real-weights", action="store_true", help="Load the real weight files")
+    parser.add_argument("--mixed", action="store_true",
+                        help="Benchmark both models under concurrent load with each thread configuration")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per --mixed configuration")
+    parser.add_argument("--classifier-clients", type=int, default=4, help="Concurrent classifier callers (--mixed)")
+    parser.add_argument("--fashion-clients", type=int, default=4, help="Concurrent fashion callers (--mixed)")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-threads", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return
+
+    report = {
+        "config": {
+            "batch_sizes": args.batch_sizes,
+            "iterations": args.iterations,
+            "random_weights": not args.real_weights,
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        },
+        "models": {}
+    }
+    if args.mixed:
+        report["config"].update({
+            "duration_s": args.duration,
+            "classifier_clients": args.classifier_clients,
+            "fashion_clients": args.fashion_clients
+        })
+        report["mixed"] = {}
+        for name, env_overrides in MIXED_CONFIGS.items():
+            print(f"Mixed load with {name}...", file=sys.stderr)
+            report["mixed"][name] = spawn_mixed_worker(env_overrides, args)
+    for model in ([] if args.mixed else args.models):
+        print(f"Benchmarking {model}...", file=sys.stderr)
+        result = spawn_worker(model, None, args.batch_sizes, args)
+        result["thread_scaling"] = [
+            spawn_worker(model, threads, args.scaling_batch_sizes, args)
+            for threads in args.threads
+        ]
+        report["models"][model] = result
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+# backend/model_host.py
+"""
+Model host process for multi-worker serving.
+
+With MODEL_SERVING=host, the Xception classifier and the Siamese ResNet-50
+are loaded once, in a separate model-host process, instead of once per
+uvicorn worker. API workers talk to it over a local socket (a named pipe on
+Windows) through RemoteClassifier and RemoteFashion, which expose the same
+methods the server calls on ClothingClassifier and FashionCompatibility.
+Arrays, tensors and PIL images are pickled across the connection.
+
+Run the host yourself:
+
+    python model_host.py
+    MODEL_SERVING=host uvicorn server:app --workers 4
+
+or let the first API worker start it (MODEL_HOST_AUTOSTART=1, the default).
+The host keeps running when the worker that started it exits, and later
+workers connect to the running host.
+
+Connections are authenticated with MODEL_HOST_AUTHKEY. Without it, a random
+key is generated once and kept next to the socket in a file only the
+owning user can read (MODEL_HOST_AUTHKEY_FILE, default <socket>.key), so
+other local users cannot talk to the host: every message it receives is
+unpickled.
+"""
+import os
+import sys
+import time
+import queue
+import secrets
+import tempfile
+import threading
+import subprocess
+import logging
+import argparse
+from multiprocessing.connection import Listener, Client
+from typing import Any, Dict, Optional, Tuple
+from dotenv import load_dotenv
+from filelock import FileLock
+import scheduler
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+if sys.platform == "win32":
+    DEFAULT_ADDRESS = r"\\.\pipe\drippedup-model-host"
+else:
+    DEFAULT_ADDRESS = os.path.join(tempfile.gettempdir(), "drippedup-model-host.sock")
+
+MODEL_HOST_ADDRESS = os.environ.get("MODEL_HOST_ADDRESS", DEFAULT_ADDRESS)
+MODEL_HOST_AUTHKEY = os.environ.get("MODEL_HOST_AUTHKEY", "")
+MODEL_HOST_AUTHKEY_FILE = os.environ.get("MODEL_HOST_AUTHKEY_FILE", "")
+MODEL_HOST_AUTOSTART = os.environ.get("MODEL_HOST_AUTOSTART", "1").lower() in ("1", "true", "yes")
+# Loading both models from scratch can take minutes on a cold machine
+MODEL_HOST_START_TIMEOUT = float(os.environ.get("MODEL_HOST_START_TIMEOUT", "600"))
+
+# Methods API workers may call on each model
+EXPOSED_METHODS = {
+    "classifier": {"predict", "predict_batch", "get_model_info"},
+    "fashion": {"predict_from_paths", "embed", "embed_image", "embed_images", "score_embeddings",
+                "score_embedding_arrays", "score_codes", "get_model_info"},
+}
+# Batch methods whose concurrent calls the host merges into one forward pass
+BATCHED_METHODS = {
+    "classifier": {"predict_batch"},
+    "fashion": {"embed_images"},
+}
+
+
+class ModelHostError(Exception):
+    """Raised in the API worker when the host reports a failed call."""
+
+
+def authkey_path(address: str) -> str:
+    """File holding the generated authkey for a host address."""
+    if MODEL_HOST_AUTHKEY_FILE:
+        return MODEL_HOST_AUTHKEY_FILE
+    if address.startswith("\\\\"):
+        return os.path.join(tempfile.gettempdir(), "drippedup-model-host.key")
+    return address + ".key"
+
+
+def load_authkey(address: str = MODEL_HOST_ADDRESS) -> bytes:
+    """
+    The configured MODEL_HOST_AUTHKEY, or the generated key for the address.
+    The host and every API worker call this; whoever comes first creates the
+    key file (mode 0600), the others read it.
+    """
+    if MODEL_HOST_AUTHKEY:
+        return MODEL_HOST_AUTHKEY.encode()
+    path = authkey_path(address)
+    if not os.path.exists(path):
+        # Written under a temporary name and linked into place, so nobody reads a partial key
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+            os.link(temp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+    if sys.platform != "win32":
+        info = os.stat(path)
+        if info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise PermissionError(f"Refusing model host key {path}: it must be owned by this user "
+                                  f"and not accessible to others (chmod 600)")
+    with open(path) as f:
+        key = f.read().strip()
+    if not key:
+        raise PermissionError(f"Model host key file {path} is empty")
+    return key.encode()
+
+
+# ========== HOST ==========
+
+class ModelHost:
+    """Owns the model weights and serves calls from API workers."""
+
+    def __init__(self, random_init: bool = False):
+        from classification import build_classifier
+        from fashion import FashionCompatibility
+
+        self.models: Dict[str, Any] = {"classifier": build_classifier(random_init=random_init)}
+        try:
+            self.models["fashion"] = FashionCompatibility(random_init=random_init)
+        except Exception as e:
+            logger.warning(f"FashionCompatibility not available in model host: {e}")
+
+    def describe(self) -> Dict:
+        """Attributes the proxies mirror locally."""
+        classifier = self.models["classifier"]
+        return {
+            "classifier": {
+                "image_size": classifier.image_size,
+                "class_labels": classifier.class_labels,
+            },
+            "fashion": {} if "fashion" in self.models else None,
+        }
+
+    def handle(self, request: Tuple) -> Tuple[str, Any]:
+        target, method, args, kwargs = request[:4]
+        # Scheduling context (user and lane) of the API request or task making the call
+        context = request[4] if len(request) > 4 else {}
+        if target == "host" and method == "describe":
+            return "ok", self.describe()
+        model = self.models.get(target)
+        if model is None or method not in EXPOSED_METHODS.get(target, ()):
+            return "error", f"Unknown model method: {target}.{method}"
+        fn = getattr(model, method)
+        model_scheduler = scheduler.scheduler_for(target)
+        user, lane = context.get("user"), context.get("lane")
+        try:
+            if model_scheduler is None:
+                return "ok", fn(*args, **kwargs)
+            if method in BATCHED_METHODS.get(target, ()) and len(args) == 1 and not kwargs:
+                return "ok", model_scheduler.call_batched(method, args[0], scheduler.merged(fn), user, lane)
+            return "ok", model_scheduler.call(lambda: fn(*args, **kwargs), user=user, lane_name=lane)
+        except Exception as e:
+            return "error", f"{type(e).__name__}: {e}"
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                conn.send(self.handle(request))
+
+    def serve(self, address: str = MODEL_HOST_ADDRESS, authkey: Optional[bytes] = None):
+        """Accept API worker connections forever, one thread per connection."""
+        authkey = authkey or load_authkey(address)
+        is_socket = not address.startswith("\\\\")
+        if is_socket and os.path.exists(address):
+            # Left behind by a host that did not shut down cleanly
+            os.remove(address)
+        # The socket is created owner-only from the start, not chmod-ed afterwards
+        previous_umask = os.umask(0o077)
+        try:
+            listener = Listener(address, authkey=authkey)
+        finally:
+            os.umask(previous_umask)
+        if is_socket:
+            os.chmod(address, 0o600)
+        with listener:
+            logger.info(f"Model host listening on {address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.warning(f"Rejected model host connection: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+
+# ========== CLIENT ==========
+
+class ModelHostClient:
+    """Pool of connections to the model host, safe to use from many threads."""
+
+    def __init__(self, address: str = MODEL_HOST_ADDRESS, authkey: Optional[bytes] = None):
+        self.address = address
+        self.authkey = authkey or load_authkey(address)
+        self._idle: "queue.SimpleQueue" = queue.SimpleQueue()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return Client(self.address, authkey=self.authkey)
+
+    def call(self, target: str, method: str, *args, **kwargs):
+        """Call a model method in the host and return its result."""
+        for attempt in range(2):
+            conn = self._acquire()
+            pooled = False
+            try:
+                conn.send((target, method, args, kwargs, scheduler.current_context()))
+                status, value = conn.recv()
+                self._idle.put(conn)
+                pooled = True
+            except (EOFError, OSError):
+                # Stale pooled connection (e.g. host restarted); retry once on a fresh one
+                if attempt:
+                    raise
+                continue
+            finally:
+                # Any other failure (e.g. an argument that cannot be pickled) leaves the
+                # connection in an unknown state, so it is closed rather than reused
+                if not pooled:
+                    conn.close()
+            if status != "ok":
+                raise ModelHostError(value)
+            return value
+
+    def ping(self) -> bool:
+        try:
+            self.call("host", "describe")
+            return True
+        except (OSError, EOFError):
+            return False
+
+
+class RemoteClassifier:
+    """ClothingClassifier stand-in that runs predictions in the model host."""
+
+    def __init__(self, client: ModelHostClient, description: Dict):
+        self._client = client
+        self.image_size = description["image_size"]
+        self.class_labels = description["class_labels"]
+
+    def predict(self, img_array):
+        return self._client.call("classifier", "predict", img_array)
+
+    def predict_batch(self, img_array):
+        return self._client.call("classifier", "predict_batch", img_array)
+
+    def get_model_info(self) -> Dict:
+        info = self._client.call("classifier", "get_model_info")
+        info["serving"] = "host"
+        return info
+
+
+class RemoteFashion:
+    """FashionCompatibility stand-in that runs inference in the model host."""
+
+    def __init__(self, client: ModelHostClient):
+        self._client = client
+
+    def predict_from_paths(self, img1_path: str, img2_path: str) -> Dict:
+        # The host runs on the same machine, so temp file paths are valid there
+        return self._client.call("fashion", "predict_from_paths", img1_path, img2_path)
+
+    def embed(self, images):
+        return self._client.call("fashion", "embed", images)
+
+    def embed_image(self, img):
+        return self._client.call("fashion", "embed_image", img)
+
+    def embed_images(self, images):
+        return self._client.call("fashion", "embed_images", images)
+
+    def score_embeddings(self, embeddings1, embeddings2):
+        return self._client.call("fashion", "score_embeddings", embeddings1, embeddings2)
+
+    def score_embedding_arrays(self, embeddings1, embeddings2):
+        return self._client.call("fashion", "score_embedding_arrays", embeddings1, embeddings2)
+
+    def score_codes(self, codes1, codes2, codebooks):
+        return self._client.call("fashion", "score_codes", codes1, codes2, codebooks)
+
+    def get_model_info(self) -> Dict:
+        info = self._client.call("fashion", "get_model_info")
+        info["serving"] = "host"
+        return info
+
+
+def start_host_process(random_init: bool = False) -> subprocess.Popen:
+    """Start the model host detached from the calling worker."""
+    command = [sys.executable, os.path.abspath(__file__)]
+    if random_init:
+        command.append("--random-weights")
+    kwargs = {"cwd": os.path.dirname(os.path.abspath(__file__))}
+    if sys.platform == "win32":
+        kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    return subprocess.Popen(command, **kwargs)
+
+
+def connect_models(random_init: bool = False, autostart: bool = MODEL_HOST_AUTOSTART,
+                   timeout: float = MODEL_HOST_START_TIMEOUT) -> Tuple[RemoteClassifier, Optional[RemoteFashion]]:
+    """
+    Connect to the model host, starting it first if needed and allowed.
+
+    Returns:
+        (RemoteClassifier, RemoteFashion or None if the host has no fashion model)
+    """
+    client = ModelHostClient()
+    if not client.ping():
+        if not autostart:
+            raise ConnectionError(f"Model host is not running at {client.address}")
+        # Only one worker starts the host; the others wait for it below
+        lock_path = os.path.join(tempfile.gettempdir(), "drippedup-model-host.lock")
+        with FileLock(lock_path):
+            if not client.ping():
+                logger.info("Starting model host process")
+                process = start_host_process(random_init)
+                deadline = time.monotonic() + timeout
+                while not client.ping():
+                    if process.poll() is not None:
+                        raise RuntimeError(f"Model host exited with code {process.returncode}")
+                    if time.monotonic() > deadline:
+                        raise TimeoutError("Model host did not start in time")
+                    time.sleep(0.5)
+
+    description = client.call("host", "describe")
+    fashion = RemoteFashion(client) if description["fashion"] is not None else None
+    logger.info(f"Connected to model host at {client.address}")
+    return RemoteClassifier(client, description["classifier"]), fashion
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the DrippedUp models to API workers")
+    parser.add_argument("--address", default=MODEL_HOST_ADDRESS)
+    parser.add_argument("--random-weights", action="store_true",
+                        help="Use randomly initialized models (benchmarks only)")
+    args = parser.parse_args()
+
+    random_init = args.random_weights or os.environ.get("MODEL_RANDOM_WEIGHTS", "").lower() in ("1", "true", "yes")
+    ModelHost(random_init=random_init).serve(args.address)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# backend/profiling.py
+"""
+Opt-in per-request profiling.
+
+When PROFILING_ENABLED is set, a fraction of requests (PROFILE_SAMPLE_RATE)
+and every request sent with an `X-Profile: 1` header are run under cProfile.
+Work the handler pushes to the threadpool (model calls, Supabase queries,
+storage transfers) goes through `run_in_threadpool` below, which profiles it
+on the worker thread and merges the result into the request's profile.
+
+The last PROFILE_MAX_STORED profiles are kept in memory and served by the
+/debug/profiles endpoints. Only one request is profiled at a time; others
+run normally. The event loop profile covers everything the loop ran while
+the request was in flight, so concurrent requests can show up in it.
+
+With profiling disabled the only cost is one context variable lookup per
+threadpool call.
+"""
+import io
+import os
+import time
+import uuid
+import random
+import asyncio
+import functools
+import pstats
+import marshal
+import cProfile
+import threading
+import logging
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from fastapi.concurrency import run_in_threadpool as _run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MAX_STORED = int(os.environ.get("PROFILE_MAX_STORED", "20"))
+PROFILE_HEADER = "x-profile"
+
+# Never profile the diagnostic endpoints themselves
+EXCLUDED_PREFIXES = ("/debug/profiles", "/metrics")
+
+_active_session: ContextVar[Optional["ProfileSession"]] = ContextVar("profile_session", default=None)
+_session_lock = threading.Lock()
+
+
+class ProfileSession:
+    """cProfile data for one request, collected across the threads it used."""
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._profiler = cProfile.Profile()
+        self._thread_profiles: List[cProfile.Profile] = []
+        self._skipped_threads = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._profiler.enable()
+
+    def stop(self) -> float:
+        self._profiler.disable()
+        return time.perf_counter() - self._start
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn on the current (worker) thread under its own profiler."""
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows only one active profiler per process
+            with self._lock:
+                self._skipped_threads += 1
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._thread_profiles.append(profiler)
+
+    def stats(self) -> pstats.Stats:
+        """Merge the event loop and worker thread profiles."""
+        stats = pstats.Stats(self._profiler)
+        with self._lock:
+            profiles = list(self._thread_profiles)
+        for profiler in profiles:
+            stats.add(profiler)
+        return stats
+
+    def summary(self, status: int, duration: float) -> Dict:
+        with self._lock:
+            threads = len(self._thread_profiles)
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "duration_ms": round(duration * 1000, 3),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started_at)),
+            "threadpool_calls": threads,
+            "unprofiled_threadpool_calls": self._skipped_threads
+        }
+
+
+class ProfileStore:
+    """Keeps the most recent profiles in memory."""
+
+    def __init__(self, max_stored: int = PROFILE_MAX_STORED):
+        self.max_stored = max_stored
+        self._profiles: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, summary: Dict, stats: pstats.Stats):
+        with self._lock:
+            self._profiles[summary["id"]] = {"summary": summary, "stats": stats}
+            while len(self._profiles) > self.max_stored:
+                self._profiles.popitem(last=False)
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            return [entry["summary"] for entry in reversed(self._profiles.values())]
+
+    def get(self, profile_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+
+store = ProfileStore()
+
+
+def should_profile(method: str, path: str, headers) -> bool:
+    """Decide whether to profile a request. Always False when profiling is disabled."""
+    if not PROFILING_ENABLED or path.startswith(EXCLUDED_PREFIXES):
+        return False
+    if headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes"):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def begin(method: str, path: str) -> Optional[ProfileSession]:
+    """Start profiling a request, or return None if another request is being profiled."""
+    if not _session_lock.acquire(blocking=False):
+        return None
+    session = ProfileSession(method, path)
+    _active_session.set(session)
+    session.start()
+    return session
+
+
+def finish(session: ProfileSession, status: int):
+    """Stop profiling and store the result."""
+    try:
+        duration = session.stop()
+        _active_session.set(None)
+        summary = session.summary(status, duration)
+        store.add(summary, session.stats())
+        logger.info(f"Stored profile {session.id} for {session.method} {session.path} ({summary['duration_ms']} ms)")
+    finally:
+        _session_lock.release()
+
+
+async def run_in_threadpool(fn, *args, **kwargs):
+    """fastapi's run_in_threadpool, profiling the call when its request is profiled."""
+    session = _active_session.get()
+    if session is None:
+        return await _run_in_threadpool(fn, *args, **kwargs)
+    return await _run_in_threadpool(session.call, fn, *args, **kwargs)
+
+
+async def run_in_executor(executor, fn, *args):
+    """Run fn on a specific executor, profiling the call when its request is profiled."""
+    session = _active_session.get()
+    loop = asyncio.get_running_loop()
+    if session is None:
+        return await loop.run_in_executor(executor, fn, *args)
+    return await loop.run_in_executor(executor, functools.partial(session.call, fn, *args))
+
+
+def render_text(stats: pstats.Stats, sort: str = "cumulative", limit: int = 50) -> str:
+    """Human-readable pstats report."""
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+def render_pstats(stats: pstats.Stats) -> bytes:
+    """Binary pstats dump, loadable with pstats.Stats(path) or snakeviz."""
+    return marshal.dumps(stats.stats)
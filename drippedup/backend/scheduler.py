@@ -0,0 +1,332 @@
+# backend/scheduler.py
+"""
+Fair scheduling of model work.
+
+Every model component ("classifier", "fashion") has a FairScheduler with a
+fixed number of slots (SCHEDULER_<COMPONENT>_SLOTS, default
+SCHEDULER_SLOTS). Work waiting for a slot is queued in one of two lanes:
+
+    interactive  requests a user is waiting on (/predict, uploads, matching)
+    bulk         background and large jobs (embedding backfills, graph
+                 rebuilds, task workers)
+
+Interactive work goes first, but while bulk work is waiting it still gets
+one slot after every SCHEDULER_BULK_EVERY interactive grants, and at once
+when its oldest job has waited SCHEDULER_BULK_MAX_WAIT_SECONDS. Within a
+lane, users are served round-robin, so one user's 300 uploads queue behind
+each other and not in front of everyone else.
+
+Batchable calls (a model's batch method on a few rows) waiting for the same
+method are merged into one forward pass when a slot frees, taking one call
+per user per round in round-robin order, up to SCHEDULER_MAX_BATCH calls.
+
+The user and lane of a call come from context variables: the server sets
+them per request, task workers per task. In MODEL_SERVING=host mode the
+API workers forward them with every call and the model host schedules.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import numpy as np
+from metrics import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+ANONYMOUS = "anonymous"
+
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "1").lower() in ("1", "true", "yes")
+SCHEDULER_SLOTS = int(os.environ.get("SCHEDULER_SLOTS", "2"))
+SCHEDULER_MAX_BATCH = int(os.environ.get("SCHEDULER_MAX_BATCH", "16"))
+SCHEDULER_BULK_EVERY = int(os.environ.get("SCHEDULER_BULK_EVERY", "4"))
+SCHEDULER_BULK_MAX_WAIT_SECONDS = float(os.environ.get("SCHEDULER_BULK_MAX_WAIT_SECONDS", "2.0"))
+SCHEDULED_COMPONENTS = ("classifier", "fashion")
+
+current_user: contextvars.ContextVar = contextvars.ContextVar("scheduler_user", default=ANONYMOUS)
+current_lane: contextvars.ContextVar = contextvars.ContextVar("scheduler_lane", default=INTERACTIVE)
+
+QUEUE_DEPTH = Gauge(
+    "drippedup_scheduler_queue_depth",
+    "Model calls waiting for a slot, by component and lane",
+    ["component", "lane"]
+)
+WAIT_SECONDS = Histogram(
+    "drippedup_scheduler_wait_seconds",
+    "Time model calls waited for a slot, by component and lane",
+    ["component", "lane"]
+)
+MERGED_CALLS = Histogram(
+    "drippedup_scheduler_merged_calls",
+    "Batchable calls merged into one model call",
+    ["component"],
+    buckets=(1, 2, 4, 8, 16, 32)
+)
+
+
+@contextmanager
+def lane(name: str, user: Optional[str] = None):
+    """Run the enclosed block's model calls in a lane (and optionally as a user)."""
+    if name not in LANES:
+        raise ValueError(f"Unknown scheduling lane: {name}")
+    lane_token = current_lane.set(name)
+    user_token = current_user.set(user) if user else None
+    try:
+        yield
+    finally:
+        current_lane.reset(lane_token)
+        if user_token is not None:
+            current_user.reset(user_token)
+
+
+def current_context() -> Dict[str, str]:
+    """User and lane of the running request or task, to forward to the model host."""
+    return {"user": current_user.get(), "lane": current_lane.get()}
+
+
+def merged(batch_fn: Callable[[Any], Sequence]) -> Callable[[List[Any]], List[Any]]:
+    """
+    Adapt a batch method (rows in, one result per row out) to run several
+    calls' inputs as one batch and split the results back per call.
+    """
+    def run(inputs: List[Any]) -> List[Any]:
+        sizes = [len(rows) for rows in inputs]
+        if isinstance(inputs[0], np.ndarray):
+            rows = np.concatenate(inputs)
+        else:
+            rows = [row for part in inputs for row in part]
+        results = batch_fn(rows)
+        offsets = np.cumsum([0] + sizes)
+        return [results[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+    return run
+
+
+class _Job:
+    __slots__ = ("user", "lane", "enqueued", "batch_key", "item", "turn", "result")
+
+    def __init__(self, user: str, lane_name: str, batch_key=None, item=None):
+        self.user = user
+        self.lane = lane_name
+        self.enqueued = time.monotonic()
+        self.batch_key = batch_key
+        self.item = item
+        # The batch to run for the job that gets the slot, None for jobs merged into it
+        self.turn: Future = Future()
+        # Result of a merged job, set by the job that ran the batch
+        self.result: Future = Future()
+
+
+class FairScheduler:
+    """Per-user round-robin queues in two lanes in front of a fixed number of slots."""
+
+    def __init__(self, component: str, slots: int = SCHEDULER_SLOTS, max_batch: int = SCHEDULER_MAX_BATCH,
+                 bulk_every: int = SCHEDULER_BULK_EVERY,
+                 bulk_max_wait: float = SCHEDULER_BULK_MAX_WAIT_SECONDS):
+        self.component = component
+        self.slots = max(1, slots)
+        self.max_batch = max(1, max_batch)
+        self.bulk_every = max(1, bulk_every)
+        self.bulk_max_wait = bulk_max_wait
+        self._free = self.slots
+        self._queues: Dict[str, "OrderedDict[str, deque]"] = {name: OrderedDict() for name in LANES}
+        # Interactive grants in a row while bulk work was waiting
+        self._streak = 0
+        self._lock = threading.Lock()
+
+    # ---------- queueing ----------
+
+    def _submit(self, batch_key=None, item=None, user: Optional[str] = None,
+                lane_name: Optional[str] = None) -> _Job:
+        job = _Job(user or current_user.get(), lane_name or current_lane.get(), batch_key, item)
+        if job.lane not in LANES:
+            job.lane = INTERACTIVE
+        with self._lock:
+            self._queues[job.lane].setdefault(job.user, deque()).append(job)
+            QUEUE_DEPTH.inc(component=self.component, lane=job.lane)
+            self._dispatch()
+        return job
+
+    def _release(self):
+        with self._lock:
+            self._free += 1
+            self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to the next jobs. Called with the lock held."""
+        while self._free > 0:
+            batch = self._pick()
+            if batch is None:
+                return
+            self._free -= 1
+            now = time.monotonic()
+            for job in batch:
+                QUEUE_DEPTH.dec(component=self.component, lane=job.lane)
+                WAIT_SECONDS.observe(now - job.enqueued, component=self.component, lane=job.lane)
+            if batch[0].batch_key is not None:
+                MERGED_CALLS.observe(len(batch), component=self.component)
+            batch[0].turn.set_result(batch)
+            for job in batch[1:]:
+                job.turn.set_result(None)
+
+    def _choose_lane(self) -> Optional[str]:
+        interactive, bulk = self._queues[INTERACTIVE], self._queues[BULK]
+        if not bulk:
+            return INTERACTIVE if interactive else None
+        if not interactive:
+            return BULK
+        oldest_bulk = min(jobs[0].enqueued for jobs in bulk.values())
+        if self._streak >= self.bulk_every or time.monotonic() - oldest_bulk >= self.bulk_max_wait:
+            return BULK
+        return INTERACTIVE
+
+    def _pick(self) -> Optional[List[_Job]]:
+        """Next job by lane and user rotation, plus the calls merged into it."""
+        lane_name = self._choose_lane()
+        if lane_name is None:
+            return None
+        if lane_name == INTERACTIVE and self._queues[BULK]:
+            self._streak += 1
+        elif lane_name == BULK:
+            self._streak = 0
+
+        users = self._queues[lane_name]
+        user, jobs = next(iter(users.items()))
+        leader = jobs.popleft()
+        batch, served = [leader], [user]
+
+        if leader.batch_key is not None:
+            # One call per user per round, users in rotation order
+            while len(batch) < self.max_batch:
+                added = False
+                for other in list(users):
+                    if len(batch) >= self.max_batch:
+                        break
+                    match = next((job for job in users[other] if job.batch_key == leader.batch_key), None)
+                    if match is not None:
+                        users[other].remove(match)
+                        batch.append(match)
+                        served.append(other)
+                        added = True
+                if not added:
+                    break
+
+        # Users just served go to the back of the rotation
+        for other in served:
+            if other not in users:
+                continue
+            if users[other]:
+                users.move_to_end(other)
+            else:
+                del users[other]
+        return batch
+
+    # ---------- running ----------
+
+    def _deliver(self, batch: List[_Job], results: List[Any]) -> Any:
+        """Hand merged calls their results and return the leader's."""
+        for job, result in zip(batch[1:], results[1:]):
+            job.result.set_result(result)
+        return results[0]
+
+    def _fail_batch(self, batch: List[_Job], error: BaseException):
+        for job in batch[1:]:
+            job.result.set_exception(error)
+
+    def call(self, fn: Callable, *args, user: Optional[str] = None, lane_name: Optional[str] = None) -> Any:
+        """Wait for a slot in the calling thread, then run fn(*args) in it."""
+        job = self._submit(user=user, lane_name=lane_name)
+        job.turn.result()
+        try:
+            return fn(*args)
+        finally:
+            self._release()
+
+    def call_batched(self, batch_key, inputs: Any, batch_fn: Callable[[List[Any]], List[Any]],
+                     user: Optional[str] = None, lane_name: Optional[str] = None) -> Any:
+        """
+        Blocking batchable call: batch_fn takes a list of inputs (one per
+        merged call) and returns their results in order, e.g. merged(fn).
+        """
+        job = self._submit(batch_key, inputs, user, lane_name)
+        batch = job.turn.result()
+        if batch is None:
+            return job.result.result()
+        try:
+            results = batch_fn([job.item for job in batch])
+        except BaseException as e:
+            self._fail_batch(batch, e)
+            raise
+        finally:
+            self._release()
+        return self._deliver(batch, results)
+
+    async def run(self, execute: Callable, fn: Callable, *args) -> Any:
+        """
+        Wait for a slot without blocking the event loop, then run
+        execute(fn, *args) (e.g. on an executor). The work is shielded: a
+        cancelled caller does not leave a granted slot or merged calls behind.
+        """
+        async def scheduled():
+            job = self._submit()
+            await asyncio.wrap_future(job.turn)
+            try:
+                return await execute(fn, *args)
+            finally:
+                self._release()
+        return await asyncio.shield(asyncio.ensure_future(scheduled()))
+
+    async def run_batched(self, execute: Callable, batch_key, inputs: Any,
+                          batch_fn: Callable[[List[Any]], List[Any]]) -> Any:
+        """Async call_batched; the merged batch runs through execute(batch_fn, items)."""
+        async def scheduled():
+            job = self._submit(batch_key, inputs)
+            batch = await asyncio.wrap_future(job.turn)
+            if batch is None:
+                return await asyncio.wrap_future(job.result)
+            try:
+                results = await execute(batch_fn, [job.item for job in batch])
+            except BaseException as e:
+                self._fail_batch(batch, e)
+                raise
+            finally:
+                self._release()
+            return self._deliver(batch, results)
+        return await asyncio.shield(asyncio.ensure_future(scheduled()))
+
+    def describe(self) -> Dict:
+        with self._lock:
+            return {
+                "slots": self.slots,
+                "free": self._free,
+                "waiting": {name: sum(len(jobs) for jobs in queues.values()) for name, queues in self._queues.items()},
+                "waiting_users": {name: len(queues) for name, queues in self._queues.items()}
+            }
+
+
+_schedulers: Dict[str, FairScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def scheduler_for(component: str) -> Optional[FairScheduler]:
+    """The component's scheduler, or None for work that is not scheduled (e.g. decoding)."""
+    if not SCHEDULER_ENABLED or component not in SCHEDULED_COMPONENTS:
+        return None
+    with _schedulers_lock:
+        scheduler = _schedulers.get(component)
+        if scheduler is None:
+            slots = int(os.environ.get(f"SCHEDULER_{component.upper()}_SLOTS", str(SCHEDULER_SLOTS)))
+            scheduler = FairScheduler(component, slots)
+            _schedulers[component] = scheduler
+        return scheduler
+
+
+def describe() -> Dict:
+    return {component: scheduler.describe() for component, scheduler in _schedulers.items()}
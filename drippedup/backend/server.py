@@ -1,74 +1,253 @@
-# backend/server.py - Clean Supabase-only version
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+# backend/server.py
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response
 import uvicorn
 import os
 import io
+import time
+import asyncio
+import functools
 import tempfile
+import contextvars
+from contextlib import asynccontextmanager
 from typing import Dict, List
 import logging
-from classification import ClothingClassifier
 from PIL import Image
 import numpy as np
 import json
-from fashion import FashionCompatibility
 from dotenv import load_dotenv
+import metrics
 
 # Load environment variables
 load_dotenv()
 
-# Import Supabase service
-from supabase_service import supabase_service
+# Select the storage backend (STORAGE_BACKEND=supabase|local)
+import storage
+from storage_backend import get_storage_backend
+import profiling
+from profiling import run_in_threadpool
+import threading_config
+from content_cache import content_hash, prediction_cache
+from embedding_store import embedding_store
+from compatibility_graph import compatibility_graph, score_both_directions
+import color_palette
+import category_prior
+import task_queue
+import admission
+import scheduler
+from singleflight import CoalescingBackend, SingleFlight
+# Identical concurrent reads from UI fan-out share one backend call
+backend = CoalescingBackend(get_storage_backend())
+# Concurrent /fashion-predict calls for the same pair share one model call
+pair_flights = SingleFlight("fashion_pair")
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that records its serialization time as a request stage."""
+    def render(self, content) -> bytes:
+        with metrics.stage("json_serialization"):
+            return super().render(content)
+
 # Initialize FastAPI app
 app = FastAPI(
-    title="DrippedUp API"
+    title="DrippedUp API",
+    default_response_class=TimedJSONResponse
 )
 
-# Add CORS middleware to allow frontend requests
+@app.middleware("http")
+async def scheduling_middleware(request: Request, call_next):
+    """
+    Identify the user model work is scheduled for (see scheduler.py). The
+    client address is not used: behind a proxy every user would share it.
+    Endpoints that learn the user later (form fields, item owners) set it
+    themselves.
+    """
+    user = request.query_params.get("user_id") or request.headers.get("X-User-Id") or scheduler.ANONYMOUS
+    scheduler.current_user.set(user)
+    return await call_next(request)
+
+@app.middleware("http")
+async def admission_middleware(request: Request, call_next):
+    """Queue or shed requests to the inference endpoints (see admission.py)."""
+    controller = admission.controller_for(request.url.path)
+    if controller is None:
+        return await call_next(request)
+    try:
+        async with controller.admit(admission.request_deadline(request.headers)):
+            return await call_next(request)
+    except admission.Overloaded as e:
+        return JSONResponse(
+            status_code=503,
+            content={"error": f"{e}, retry later"},
+            headers={"Retry-After": admission.retry_after_header(e.retry_after)}
+        )
+
+# Registered after admission_middleware so it wraps it and records shed requests
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """Track in-flight requests and end-to-end latency per route."""
+    start = time.perf_counter()
+    status = 500
+    with metrics.REQUESTS_IN_FLIGHT.track():
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # The router stores the matched route in the shared scope
+            route = request.scope.get("route")
+            metrics.REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=request.method,
+                route=getattr(route, "path", "unmatched"),
+                status=str(status)
+            )
+
+# Profiling is opt-in; without PROFILING_ENABLED the middleware is not installed
+if profiling.PROFILING_ENABLED:
+    @app.middleware("http")
+    async def profiling_middleware(request: Request, call_next):
+        """Profile sampled requests and requests sent with an X-Profile header."""
+        if not profiling.should_profile(request.method, request.url.path, request.headers):
+            return await call_next(request)
+        session = profiling.begin(request.method, request.url.path)
+        if session is None:
+            return await call_next(request)
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            response.headers["X-Profile-Id"] = session.id
+            return response
+        finally:
+            profiling.finish(session, status)
+
+    @app.get("/debug/profiles")
+    async def list_profiles():
+        """List the stored request profiles, newest first."""
+        return {"profiles": profiling.store.list()}
+
+    @app.get("/debug/profiles/{profile_id}")
+    async def get_profile(profile_id: str, format: str = "text", sort: str = "cumulative", limit: int = 50):
+        """Download a stored profile as a text report or a binary pstats file."""
+        entry = profiling.store.get(profile_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Profile not found")
+        if format == "pstats":
+            return Response(
+                profiling.render_pstats(entry["stats"]),
+                media_type="application/octet-stream",
+                headers={"Content-Disposition": f'attachment; filename="{profile_id}.pstats"'}
+            )
+        if format != "text":
+            raise HTTPException(status_code=400, detail="format must be 'text' or 'pstats'")
+        try:
+            report = profiling.render_text(entry["stats"], sort, limit)
+        except KeyError:
+            raise HTTPException(status_code=400, detail=f"Unknown sort key: {sort}")
+        return PlainTextResponse(report)
+
+# Add CORS middleware to allow frontend requests. Registered last so it is
+# the outermost middleware and also covers responses the middlewares above
+# return themselves, such as shed 503s, whose Retry-After the client reads
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # might have to change this in production
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
+# The local backend serves its images from this process. Only files an item
+# references are served; IMAGES_ROOT also holds metadata, embeddings and the task database
+if backend.name == "local":
+    @app.get("/images/{file_path:path}")
+    async def get_image(file_path: str):
+        """Serve a locally stored item image."""
+        try:
+            local_path = await run_in_threadpool(backend.image_file, file_path)
+        except ValueError:
+            local_path = None
+        if local_path is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        return FileResponse(local_path)
+
 # Initialize the classifier globally
 classifier = None
 fashion = None
+task_workers = []
+prior_refresh_task = None
+
+# Random weights let the API run without the weight files (benchmarks only)
+MODEL_RANDOM_WEIGHTS = os.environ.get("MODEL_RANDOM_WEIGHTS", "").lower() in ("1", "true", "yes")
+
+# "inprocess" loads the models in every worker; "host" shares one model-host process
+MODEL_SERVING = os.environ.get("MODEL_SERVING", "inprocess").strip().lower()
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize the classifier and fashion tester when the server starts."""
-    global classifier, fashion
-    try:
-        classifier = ClothingClassifier()
-        logger.info("Classifier initialized successfully")
-    except Exception as e:
-        logger.error(f"Failed to initialize classifier: {e}")
-        raise
+    global classifier, fashion, task_workers, prior_refresh_task
+    if MODEL_SERVING == "host":
+        # Models live in the model host; this worker never imports TensorFlow or torch
+        from model_host import connect_models
+        classifier, fashion = connect_models(random_init=MODEL_RANDOM_WEIGHTS)
+        if fashion is None:
+            logger.info("Server will run without fashion compatibility features")
+    elif MODEL_SERVING == "inprocess":
+        from classification import build_classifier
+        from fashion import FashionCompatibility
+        # Models are built through run_model so that, with CPU affinity
+        # partitioning, each framework creates its thread pools on its own cores
+        try:
+            classifier = await run_model(
+                "classifier", functools.partial(build_classifier, random_init=MODEL_RANDOM_WEIGHTS)
+            )
+            logger.info("Classifier initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize classifier: {e}")
+            raise
+        
+        # Make fashion model optional
+        try:
+            fashion = await run_model(
+                "fashion", functools.partial(FashionCompatibility, random_init=MODEL_RANDOM_WEIGHTS)
+            )
+            logger.info("FashionCompatibility initialized successfully")
+        except Exception as e:
+            logger.warning(f"FashionCompatibility not available: {e}")
+            logger.info("Server will run without fashion compatibility features")
+            fashion = None
+    else:
+        raise ValueError(f"Unknown MODEL_SERVING mode: {MODEL_SERVING}")
     
-    # Make fashion model optional
-    try:
-        fashion = FashionCompatibility()
-        logger.info("FashionCompatibility initialized successfully")
-    except Exception as e:
-        logger.warning(f"FashionCompatibility not available: {e}")
-        logger.info("Server will run without fashion compatibility features")
-        fashion = None
+    # Background workers for post-upload and cleanup tasks
+    if task_queue.TASK_WORKERS > 0:
+        task_workers = task_queue.start_workers(task_queue.TASK_WORKERS)
+        logger.info(f"Started {len(task_workers)} task worker(s)")
+    
+    # Keep the category-pair prior in step with saved outfits
+    prior_refresh_task = asyncio.ensure_future(category_prior.refresh_forever(backend))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the background task workers and the prior refresh loop."""
+    if prior_refresh_task is not None:
+        prior_refresh_task.cancel()
+    task_queue.stop_workers(task_workers)
 
 @app.get("/")
 async def root():
     """Root endpoint to check if the server is running."""
     return {
-        "message": "DrippedUp API is running with Supabase!",
-        "supabase_enabled": True,
+        "message": f"DrippedUp API is running with {backend.name} storage!",
+        "storage_backend": backend.name,
+        "supabase_enabled": backend.name == "supabase",
         "fashion_model_available": fashion is not None
     }
 
@@ -83,10 +262,47 @@ async def health_check():
         "status": "healthy",
         "classifier_ready": classifier is not None,
         "fashion_model_ready": fashion is not None,
-        "supabase_enabled": True,
-        "model_info": classifier.get_model_info() if classifier else None
+        "storage_backend": backend.name,
+        "supabase_enabled": backend.name == "supabase",
+        "model_info": classifier.get_model_info() if classifier else None,
+        "threading": threading_config.describe(),
+        "admission": admission.describe(),
+        "scheduler": scheduler.describe()
     }
 
+@metrics.timed_stage("decode")
+def decode_image(image_data: bytes) -> Image.Image:
+    """
+    Decode image bytes into a fully loaded RGB PIL image. Images opened by
+    PIL are decoded lazily and are not thread-safe until loaded, and the
+    decoded image is shared by the classifier, embedding and palette threads.
+    """
+    image = Image.open(io.BytesIO(image_data))
+    image.load()
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+@metrics.timed_stage("resize")
+def classifier_input_from_image(image: Image.Image, image_size: int = 224) -> np.ndarray:
+    """Resize and normalize a decoded RGB image into a classifier batch of one."""
+    img_array = np.array(image.resize((image_size, image_size))) / 255.0
+    return np.expand_dims(img_array, axis=0)
+
+@metrics.timed_stage("palette")
+def image_palette(image: Image.Image) -> List[float]:
+    """Dominant-color palette of a decoded image, as stored in the item details."""
+    return color_palette.extract_palette(image).tolist()
+
+def palette_from_bytes(image_data: bytes):
+    """Palette of an uploaded image, or None if it cannot be decoded."""
+    try:
+        return image_palette(decode_image(image_data))
+    except Exception as e:
+        logger.warning(f"Could not extract color palette: {e}")
+        return None
+
+@metrics.timed_stage("decode_resize")
 def process_image_from_memory(image_data: bytes, image_size: int = 224) -> np.ndarray:
     """
     Process image data directly from memory without saving to disk.
@@ -122,6 +338,51 @@ def process_image_from_memory(image_data: bytes, image_size: int = 224) -> np.nd
         logger.error(f"Error processing image from memory: {e}")
         raise
 
+async def _execute(component: str, fn, *args):
+    executor = threading_config.model_executor(component)
+    if executor is not None:
+        # Executor threads do not inherit context variables (scheduling context for the model host)
+        return await profiling.run_in_executor(executor, contextvars.copy_context().run, fn, *args)
+    return await run_in_threadpool(fn, *args)
+
+def _model_scheduler(component: str):
+    # With a model host, the host schedules the calls of all API workers
+    return None if MODEL_SERVING == "host" else scheduler.scheduler_for(component)
+
+async def run_model(component: str, fn, *args):
+    """
+    Run blocking model work in the threadpool so it does not stall the event loop.
+    
+    Classifier and fashion work first waits for a slot from the component's
+    fair scheduler, in the request's lane and for its user. With
+    CPU_AFFINITY=partition it then runs on that framework's pinned executor
+    instead. The time between submission and the work starting is recorded
+    as the queue_wait stage for the component.
+    """
+    submitted = time.perf_counter()
+    
+    def call():
+        metrics.observe_stage("queue_wait", time.perf_counter() - submitted, component)
+        return fn(*args)
+    
+    model_scheduler = _model_scheduler(component)
+    if model_scheduler is None:
+        return await _execute(component, call)
+    return await model_scheduler.run(functools.partial(_execute, component), call)
+
+async def run_model_batched(component: str, fn, inputs):
+    """
+    Run a model batch method (classifier.predict_batch, fashion.embed_images)
+    on a few rows. Calls of the same method waiting at the same time, from
+    any user, are merged into one forward pass by the scheduler. Returns
+    fn's results for these rows.
+    """
+    model_scheduler = _model_scheduler(component)
+    if model_scheduler is None:
+        return await run_model(component, fn, inputs)
+    return await model_scheduler.run_batched(functools.partial(_execute, component), fn.__name__, inputs,
+                                             scheduler.merged(fn))
+
 @app.post("/predict")
 async def predict_clothing(file: UploadFile = File(...)):
     """
@@ -144,30 +405,32 @@ async def predict_clothing(file: UploadFile = File(...)):
     
     try:
         # Read image data into memory
-        image_data = await file.read()
-        
-        # Process image directly from memory
-        img_array = process_image_from_memory(image_data, classifier.image_size)
+        with metrics.stage("upload_read"):
+            image_data = await file.read()
         
-        # Make prediction using the model directly
-        prediction = classifier.model.predict(img_array, verbose=0)
+        # Identical bytes always get the same prediction, so serve repeats from the cache
+        with metrics.stage("content_hash"):
+            digest = content_hash(image_data)
+        prediction = prediction_cache.get(digest)
         
-        # Get the class with highest probability
-        predicted_class_idx = np.argmax(prediction, axis=1)[0]
-        predicted_class_name = classifier.class_labels[predicted_class_idx]
+        if prediction is None:
+            # Decode off the event loop, then classify batched with other waiting requests
+            img_array = await run_model("decode", process_image_from_memory, image_data, classifier.image_size)
+            prediction = (await run_model_batched("classifier", classifier.predict_batch, img_array))[0]
+            prediction_cache.put(digest, prediction)
         
-        # Get confidence score
-        confidence = float(prediction[0][predicted_class_idx] * 100)
+        predicted_class_name = prediction["predicted_class_name"]
+        confidence = prediction["confidence"]
         
-        # Return only the top prediction
+        # Return only the top prediction; cascade predictions name the stage that answered
         results = {
-            "predicted_class_index": int(predicted_class_idx),
-            "predicted_class_name": predicted_class_name,
-            "confidence": confidence,
+            "stage": "full",
+            **prediction,
             "uploaded_file": {
                 "filename": file.filename,
                 "content_type": file.content_type,
-                "size": len(image_data)
+                "size": len(image_data),
+                "content_hash": digest
             }
         }
         
@@ -188,6 +451,21 @@ async def get_model_info():
     
     return classifier.get_model_info()
 
+@asynccontextmanager
+async def holding_image(digest: str):
+    """
+    Hold an image's content from queued remove_image tasks while an upload
+    of it is on its way to an item row. The stored object may be reused or
+    written before the row referencing it exists. Taking the hold waits for
+    a removal of the same content already in progress, so the upload never
+    decides to reuse an object that is being deleted.
+    """
+    hold_id = await run_in_threadpool(task_queue.task_queue.hold_image, digest)
+    try:
+        yield
+    finally:
+        await run_in_threadpool(task_queue.task_queue.release_image, hold_id)
+
 @app.post("/save-item")
 async def save_item_endpoint(
     file: UploadFile = File(...),
@@ -196,36 +474,161 @@ async def save_item_endpoint(
     user_id: str = Form(...)
 ):
     """
-    Save uploaded image and details to Supabase.
+    Save uploaded image and details to the storage backend.
     """
     try:
         details_dict = json.loads(details) if details else {}
         
-        # Upload image to Supabase
-        image_data = await supabase_service.upload_image(file, clothing_type, user_id)
+        # Upload image to storage; identical content reuses the stored object
+        with metrics.stage("upload_read"):
+            file_data = await file.read()
+        async with holding_image(content_hash(file_data)):
+            image_data = await backend.upload_image_bytes(
+                file_data, file.filename, file.content_type, clothing_type, user_id
+            )
+            
+            # Color palette for color-aware matching
+            if color_palette.PALETTE_DETAILS_KEY not in details_dict:
+                palette = await run_in_threadpool(palette_from_bytes, file_data)
+                if palette is not None:
+                    details_dict[color_palette.PALETTE_DETAILS_KEY] = palette
+            
+            # Save clothing item to database
+            item = await backend.save_clothing_item(image_data, details_dict, user_id)
         
-        # Save clothing item to database
-        item = await supabase_service.save_clothing_item(image_data, details_dict, user_id)
+        # The compatibility embedding is computed in the background
+        task_id = None
+        if fashion is not None:
+            task_id = await run_in_threadpool(
+                task_queue.task_queue.enqueue,
+                "compute_embedding",
+                {"item_id": item["id"], "image_path": item["image_path"], "user_id": user_id}
+            )
         
         return {
-            "message": "Item saved successfully to Supabase",
-            "item": item
+            "message": f"Item saved successfully to {backend.name} storage",
+            "item": item,
+            "embedding_task_id": task_id
         }
         
     except Exception as e:
         logger.error(f"Error saving item: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to save item: {str(e)}")
 
+@app.post("/classify-and-save")
+async def classify_and_save_endpoint(
+    file: UploadFile = File(...),
+    user_id: str = Form(...),
+    clothing_type: str = Form(None),
+    details: str = Form(None)
+):
+    """
+    Classify, embed, upload and save an item in a single request.
+    
+    The image is read and decoded once. Classification, the compatibility
+    embedding and the storage upload run concurrently; the item row is
+    inserted once the upload is done. If clothing_type is not given, the
+    predicted class is used and the upload waits for the classifier.
+    
+    Returns:
+        The saved item, the prediction and whether an embedding was stored
+    """
+    global classifier, fashion
+    
+    if classifier is None:
+        raise HTTPException(status_code=503, detail="Classifier not initialized")
+    
+    if not file.content_type or not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    
+    # user_id arrives as a form field, after the scheduling middleware ran
+    scheduler.current_user.set(user_id)
+    
+    try:
+        details_dict = json.loads(details) if details else {}
+        
+        with metrics.stage("upload_read"):
+            file_data = await file.read()
+        with metrics.stage("content_hash"):
+            digest = content_hash(file_data)
+        
+        # Decode once and share the image between both models
+        image = await run_model("decode", decode_image, file_data)
+        
+        async def classify():
+            prediction = prediction_cache.get(digest)
+            if prediction is None:
+                img_array = await run_model("decode", classifier_input_from_image, image, classifier.image_size)
+                prediction = (await run_model_batched("classifier", classifier.predict_batch, img_array))[0]
+                prediction_cache.put(digest, prediction)
+            return prediction
+        
+        async def embed():
+            if fashion is None:
+                return None
+            return (await run_model_batched("fashion", fashion.embed_images, [image]))[0]
+        
+        async def upload(category: str):
+            return await backend.upload_image_bytes(file_data, file.filename, file.content_type, category, user_id)
+        
+        async with holding_image(digest):
+            classify_task = asyncio.ensure_future(classify())
+            embed_task = asyncio.ensure_future(embed())
+            palette_task = asyncio.ensure_future(run_in_threadpool(image_palette, image))
+            try:
+                if clothing_type:
+                    prediction, embedding, image_data = await asyncio.gather(
+                        classify_task, embed_task, upload(clothing_type)
+                    )
+                else:
+                    prediction = await classify_task
+                    image_data, embedding = await asyncio.gather(
+                        upload(prediction["predicted_class_name"]), embed_task
+                    )
+                palette = await palette_task
+            except BaseException:
+                classify_task.cancel()
+                embed_task.cancel()
+                palette_task.cancel()
+                raise
+            
+            details_dict.setdefault("category", clothing_type or prediction["predicted_class_name"])
+            details_dict.setdefault(color_palette.PALETTE_DETAILS_KEY, palette)
+            item = await backend.save_clothing_item(image_data, details_dict, user_id)
+        
+        pairs_scored = None
+        if embedding is not None:
+            stored = await run_in_threadpool(embedding_store.put, item["id"], embedding)
+            # Score only the new item's row and column of the user's graph
+            pairs_scored = await run_model(
+                "fashion", compatibility_graph.add_item, user_id, item["id"], stored,
+                embedding_store.get_encoded, embedding_store.scorer(fashion)
+            )
+        
+        return {
+            "message": f"Item saved successfully to {backend.name} storage",
+            "item": item,
+            "prediction": prediction,
+            "embedding_stored": embedding is not None,
+            "pairs_scored": pairs_scored
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in classify-and-save: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to classify and save item: {str(e)}")
+
 @app.get("/recent-uploads")
 async def get_recent_uploads_endpoint(user_id: str = None):
     """
-    Get the most recent uploads from Supabase.
+    Get the most recent uploads from the storage backend.
     """
     if not user_id:
         raise HTTPException(status_code=400, detail="user_id is required")
     
     try:
-        items = await supabase_service.get_user_items(user_id, limit=10)
+        items = await backend.get_user_items(user_id, limit=10)
         # Convert to the format your frontend expects
         recent_uploads = []
         for item in items:
@@ -247,7 +650,7 @@ async def get_categories(user_id: str = None):
         raise HTTPException(status_code=400, detail="user_id is required")
     
     try:
-        categories = await supabase_service.get_user_categories(user_id)
+        categories = await backend.get_user_categories(user_id)
         return {"categories": categories}
     except Exception as e:
         logger.error(f"Error getting categories: {e}")
@@ -262,7 +665,7 @@ async def get_items_by_category_endpoint(category: str, user_id: str = None):
         raise HTTPException(status_code=400, detail="user_id is required")
     
     try:
-        items = await supabase_service.get_user_items(user_id, category=category)
+        items = await backend.get_user_items(user_id, category=category)
         return {"category": category, "items": items}
     except Exception as e:
         logger.error(f"Error getting items for category {category}: {e}")
@@ -278,7 +681,7 @@ async def get_items_grouped_by_category_endpoint(user_id: str = None):
     
     try:
         # Get all items and group them
-        items = await supabase_service.get_user_items(user_id)
+        items = await backend.get_user_items(user_id)
         grouped_items = {}
         for item in items:
             category = item.get("category", "Other")
@@ -296,7 +699,7 @@ async def get_item_by_id(item_id: str):
     Get item information by ID.
     """
     try:
-        item_info = await supabase_service.get_item_by_id(item_id)
+        item_info = await backend.get_item_by_id(item_id)
         if item_info is None:
             raise HTTPException(status_code=404, detail="Item not found")
         return {"item": item_info}
@@ -306,6 +709,31 @@ async def get_item_by_id(item_id: str):
         logger.error(f"Error getting item {item_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get item: {str(e)}")
 
+async def _predict_pair(item1: Dict, item2: Dict) -> Dict:
+    """Download both images and run the fashion model on the pair."""
+    # Download images for ML processing
+    image1_data, image2_data = await asyncio.gather(
+        backend.download_image_for_ml(item1["image_path"]),
+        backend.download_image_for_ml(item2["image_path"])
+    )
+    
+    # Save to temporary files for ML model
+    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f1:
+        f1.write(image1_data)
+        temp_path1 = f1.name
+    
+    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f2:
+        f2.write(image2_data)
+        temp_path2 = f2.name
+    
+    try:
+        # Predict compatibility
+        return await run_model("fashion", fashion.predict_from_paths, temp_path1, temp_path2)
+    finally:
+        # Clean up temp files
+        os.unlink(temp_path1)
+        os.unlink(temp_path2)
+
 @app.post("/fashion-predict")
 async def fashion_predict(item_id1: str = Form(...), item_id2: str = Form(...)):
     """
@@ -316,42 +744,58 @@ async def fashion_predict(item_id1: str = Form(...), item_id2: str = Form(...)):
         raise HTTPException(status_code=503, detail="FashionCompatibility not available")
     
     try:
-        # Get items from Supabase
-        item1 = await supabase_service.get_item_by_id(item_id1)
-        item2 = await supabase_service.get_item_by_id(item_id2)
+        # Get items from storage
+        item1, item2 = await asyncio.gather(backend.get_item_by_id(item_id1), backend.get_item_by_id(item_id2))
         
         if not item1 or not item2:
             raise HTTPException(status_code=404, detail="One or both items not found")
         
-        # Download images for ML processing
-        image1_data = await supabase_service.download_image_for_ml(item1["image_path"])
-        image2_data = await supabase_service.download_image_for_ml(item2["image_path"])
+        # Schedule the model call for the items' owner, whatever the request said
+        if item1.get("user_id"):
+            scheduler.current_user.set(item1["user_id"])
         
-        # Save to temporary files for ML model
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f1:
-            f1.write(image1_data)
-            temp_path1 = f1.name
+        # Both items already in the owner's compatibility graph: no model call needed
+        if item1.get("user_id") and item1.get("user_id") == item2.get("user_id"):
+            score = await run_in_threadpool(compatibility_graph.score, item1["user_id"], item_id1, item_id2)
+            embedding1 = embedding_store.get(item_id1) if score is not None else None
+            embedding2 = embedding_store.get(item_id2) if score is not None else None
+            if embedding1 is not None and embedding2 is not None:
+                return {
+                    "compatibility_score": score,
+                    "embedding1": embedding1.tolist(),
+                    "embedding2": embedding2.tolist(),
+                    "source": "compatibility_graph",
+                    "items": [
+                        {"id": item_id1, "info": item1},
+                        {"id": item_id2, "info": item2}
+                    ]
+                }
         
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f2:
-            f2.write(image2_data)
-            temp_path2 = f2.name
+        # Pairs saved outfits never combine are not worth a model call
+        prior = category_prior.category_prior
+        if not prior.allows(item1.get("category"), item2.get("category")):
+            return {
+                "compatibility_score": 0.0,
+                "embedding1": [],
+                "embedding2": [],
+                "source": "category_prior",
+                "category_prior": prior.weight(item1.get("category"), item2.get("category")),
+                "items": [
+                    {"id": item_id1, "info": item1},
+                    {"id": item_id2, "info": item2}
+                ]
+            }
         
-        try:
-            # Predict compatibility
-            result = fashion.predict_from_paths(temp_path1, temp_path2)
-            
-            # Add item info to response
-            result["items"] = [
-                {"id": item_id1, "info": item1},
-                {"id": item_id2, "info": item2}
-            ]
-            
-            return result
-            
-        finally:
-            # Clean up temp files
-            os.unlink(temp_path1)
-            os.unlink(temp_path2)
+        result = await pair_flights.do((item_id1, item_id2), _predict_pair, item1, item2)
+        result["source"] = "model"
+        
+        # Add item info to response
+        result["items"] = [
+            {"id": item_id1, "info": item1},
+            {"id": item_id2, "info": item2}
+        ]
+        
+        return result
             
     except HTTPException:
         raise
@@ -359,6 +803,170 @@ async def fashion_predict(item_id1: str = Form(...), item_id2: str = Form(...)):
         logger.error(f"Error processing fashion prediction: {e}")
         raise HTTPException(status_code=500, detail=f"Fashion prediction failed: {str(e)}")
 
+@app.get("/compatibility/top")
+async def get_top_compatible_items(user_id: str, item_id: str, k: int = 10, category: str = None):
+    """
+    Get the user's items that go best with an item, read from the
+    precomputed compatibility graph. Optionally limited to one category.
+    """
+    if k < 1:
+        raise HTTPException(status_code=400, detail="k must be at least 1")
+    
+    try:
+        if not await run_in_threadpool(compatibility_graph.contains, user_id, item_id):
+            raise HTTPException(status_code=404, detail="Item not in compatibility graph yet")
+        
+        # Every graph item must be a candidate, not just the default first page
+        items = await backend.get_user_items(user_id, category=category, limit=1000)
+        items_by_id = {item["id"]: item for item in items}
+        with metrics.stage("graph_lookup"):
+            matches = compatibility_graph.top_k(user_id, item_id, k, candidates=items_by_id.keys())
+        
+        return {
+            "item_id": item_id,
+            "matches": [
+                {"id": match_id, "compatibility_score": score, "info": items_by_id[match_id]}
+                for match_id, score in matches
+            ]
+        }
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error getting compatible items for {item_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get compatible items: {str(e)}")
+
+async def _ensure_embeddings(items: List[Dict]) -> List[np.ndarray]:
+    """Stored (compact) embeddings of the items, computing and storing any that are missing."""
+    embeddings = [embedding_store.get_encoded(item["id"]) for item in items]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    
+    async def backfill(i: int):
+        image_bytes = await backend.download_image_for_ml(items[i]["image_path"])
+        image = await run_model("decode", decode_image, image_bytes)
+        embedding = (await run_model_batched("fashion", fashion.embed_images, [image]))[0]
+        embeddings[i] = await run_in_threadpool(embedding_store.put, items[i]["id"], embedding)
+    
+    # Backfilling a whole wardrobe is bulk work; the scheduler batches it
+    # and keeps it from crowding out other users' interactive requests
+    with scheduler.lane(scheduler.BULK):
+        await asyncio.gather(*(backfill(i) for i in missing))
+    return embeddings
+
+@app.get("/fashion-rank")
+async def fashion_rank(user_id: str, item_id: str, k: int = 10, category: str = None,
+                       prefilter: int = color_palette.COLOR_PREFILTER_LIMIT):
+    """
+    Rank the user's items by how well they go with an item.
+    
+    Candidates whose category pair the category prior rules out are
+    dropped, then the rest are cut down to the `prefilter` items whose color
+    palettes harmonize best with the item's; only those are scored. Scores
+    come from the compatibility graph when every shortlisted item is in it,
+    otherwise from the compatibility head on stored embeddings, and are
+    down-weighted by the category prior.
+    """
+    global fashion
+    if k < 1 or prefilter < 1:
+        raise HTTPException(status_code=400, detail="k and prefilter must be at least 1")
+    
+    try:
+        item = await backend.get_item_by_id(item_id)
+        if not item or item.get("user_id") != user_id:
+            raise HTTPException(status_code=404, detail="Item not found")
+        
+        items = await backend.get_user_items(user_id, category=category, limit=1000)
+        candidates = [candidate for candidate in items if candidate["id"] != item_id]
+        prior = category_prior.category_prior
+        with metrics.stage("category_prior"):
+            weights = prior.weights_for(item.get("category"), [c.get("category") for c in candidates])
+            kept = [c for c, w in zip(candidates, weights) if w >= category_prior.CATEGORY_PRIOR_MIN_WEIGHT]
+        with metrics.stage("color_prefilter"):
+            shortlist = color_palette.prefilter(item.get("details"), kept, prefilter)
+        shortlist_ids = [candidate["id"] for candidate in shortlist]
+        
+        matches = []
+        source = None
+        if shortlist:
+            scored = []
+            graph_ids = await run_in_threadpool(
+                lambda: [i for i in [item_id] + shortlist_ids if compatibility_graph.contains(user_id, i)]
+            )
+            if len(graph_ids) == len(shortlist) + 1:
+                source = "compatibility_graph"
+                with metrics.stage("graph_lookup"):
+                    scored = compatibility_graph.top_k(user_id, item_id, len(shortlist_ids), candidates=shortlist_ids)
+            else:
+                if fashion is None:
+                    raise HTTPException(status_code=503, detail="FashionCompatibility not available")
+                source = "model"
+                embeddings = await _ensure_embeddings([item] + shortlist)
+                row, column = await run_model(
+                    "fashion", score_both_directions, embeddings[0], np.stack(embeddings[1:]),
+                    embedding_store.scorer(fashion)
+                )
+                scored = list(zip(shortlist_ids, ((row + column) / 2).tolist()))
+            
+            items_by_id = {candidate["id"]: candidate for candidate in shortlist}
+            raw = np.array([score for _, score in scored], dtype=np.float32)
+            pair_weights = prior.weights_for(item.get("category"), [items_by_id[i].get("category") for i, _ in scored])
+            adjusted = prior.adjust(raw, pair_weights)
+            best = np.argsort(-adjusted, kind="stable")[:k]
+            matches = [(scored[i][0], float(adjusted[i])) for i in best]
+        
+        items_by_id = {candidate["id"]: candidate for candidate in shortlist}
+        return {
+            "item_id": item_id,
+            "source": source,
+            "candidates": len(candidates),
+            "pruned_by_category": len(candidates) - len(kept),
+            "scored": len(shortlist),
+            "matches": [
+                {"id": match_id, "compatibility_score": score, "info": items_by_id[match_id]}
+                for match_id, score in matches
+            ]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error ranking items for {item_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Fashion ranking failed: {str(e)}")
+
+@app.get("/category-prior")
+async def get_category_prior():
+    """Get the category-pair prior used to prune and down-weight rankings."""
+    return category_prior.category_prior.describe()
+
+@app.post("/compatibility/rebuild")
+async def rebuild_compatibility_graph(user_id: str = Form(...)):
+    """
+    Rebuild a user's compatibility graph from the stored embeddings of
+    their items. Items without an embedding are left out.
+    """
+    global fashion
+    if fashion is None:
+        raise HTTPException(status_code=503, detail="FashionCompatibility not available")
+    
+    try:
+        items = await backend.get_user_items(user_id)
+        embeddings = {}
+        for item in items:
+            embedding = embedding_store.get_encoded(item["id"])
+            if embedding is not None:
+                embeddings[item["id"]] = embedding
+        
+        with scheduler.lane(scheduler.BULK, user=user_id):
+            count = await run_model(
+                "fashion", compatibility_graph.rebuild, user_id, embeddings, embedding_store.scorer(fashion)
+            )
+        return {"user_id": user_id, "items": count, "missing_embeddings": len(items) - count}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error rebuilding compatibility graph for {user_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild compatibility graph: {str(e)}")
+
 @app.get("/fashion-model-info")
 async def get_fashion_model_info():
     """Get information about the loaded fashion model."""
@@ -367,6 +975,19 @@ async def get_fashion_model_info():
         raise HTTPException(status_code=503, detail="FashionCompatibility not available")
     return fashion.get_model_info()
 
+@app.get("/tasks/{task_id}")
+async def get_task_status(task_id: str):
+    """Get the status of a background task."""
+    task = await run_in_threadpool(task_queue.task_queue.get, task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return {"task": task}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Expose request stage timings and counters in Prometheus text format."""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 # ========== OUTFIT ENDPOINTS ==========
 
 @app.post("/outfit")
@@ -385,8 +1006,8 @@ async def create_outfit(
         item_ids_list = json.loads(item_ids)
         tags_list = json.loads(tags)
         
-        # Create outfit using Supabase
-        result = await supabase_service.save_outfit(name, item_ids_list, user_id, description, tags_list)
+        # Create outfit in storage
+        result = await backend.save_outfit(name, item_ids_list, user_id, description, tags_list)
         return {
             "message": "Outfit saved successfully",
             "outfit": result
@@ -406,7 +1027,7 @@ async def get_outfit_by_id(outfit_id: str):
     Get outfit information by ID, including populated item details.
     """
     try:
-        outfit = await supabase_service.get_outfit_with_items(outfit_id)
+        outfit = await backend.get_outfit_with_items(outfit_id)
         if outfit is None:
             raise HTTPException(status_code=404, detail="Outfit not found")
         return {"outfit": outfit}
@@ -425,7 +1046,7 @@ async def get_all_outfits_endpoint(user_id: str = None):
         raise HTTPException(status_code=400, detail="user_id is required")
     
     try:
-        outfits = await supabase_service.get_user_outfits(user_id)
+        outfits = await backend.get_user_outfits(user_id)
         return {"outfits": outfits, "count": len(outfits)}
     except Exception as e:
         logger.error(f"Error getting all outfits: {e}")
@@ -440,9 +1061,7 @@ async def get_all_outfits_basic(user_id: str = None):
         raise HTTPException(status_code=400, detail="user_id is required")
     
     try:
-        # Get basic outfit info from Supabase
-        outfits_result = supabase_service.supabase.table("outfits").select("*").eq("user_id", user_id).execute()
-        outfits = outfits_result.data or []
+        outfits = await backend.get_user_outfits_basic(user_id)
         return {"outfits": outfits, "count": len(outfits)}
     except Exception as e:
         logger.error(f"Error getting all outfits basic: {e}")
@@ -462,7 +1081,7 @@ async def get_recent_outfits_endpoint(limit: int, user_id: str = None):
         if limit > 100:
             raise HTTPException(status_code=400, detail="Limit cannot exceed 100")
         
-        outfits = await supabase_service.get_recent_outfits(user_id, limit)
+        outfits = await backend.get_recent_outfits(user_id, limit)
         return {"outfits": outfits, "count": len(outfits)}
     except HTTPException:
         raise
@@ -470,13 +1089,44 @@ async def get_recent_outfits_endpoint(limit: int, user_id: str = None):
         logger.error(f"Error getting recent outfits: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get recent outfits: {str(e)}")
 
+@app.get("/dashboard")
+async def get_dashboard(user_id: str = None, uploads: int = 10, outfits: int = 3):
+    """
+    Everything the dashboard shows in one response: recent uploads, the
+    outfit count and the most recent outfits with their items. The wardrobe
+    and outfit reads run concurrently, and outfit items already among the
+    recent uploads are not read again.
+    """
+    if not user_id:
+        raise HTTPException(status_code=400, detail="user_id is required")
+    if uploads <= 0 or outfits <= 0:
+        raise HTTPException(status_code=400, detail="Limits must be positive")
+    if uploads > 100 or outfits > 100:
+        raise HTTPException(status_code=400, detail="Limits cannot exceed 100")
+    
+    try:
+        items, all_outfits = await asyncio.gather(
+            backend.get_user_items(user_id, limit=uploads),
+            backend.get_user_outfits_basic(user_id)
+        )
+        newest = sorted(all_outfits, key=lambda outfit: outfit.get("created_at") or "", reverse=True)[:outfits]
+        recent_outfits = await backend.hydrate_outfits(newest, {item["id"]: item for item in items})
+        return {
+            "recent_uploads": [{"image_path": item.get("image_url", ""), "item_info": item} for item in items],
+            "outfits_count": len(all_outfits),
+            "recent_outfits": recent_outfits
+        }
+    except Exception as e:
+        logger.error(f"Error getting dashboard: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get dashboard: {str(e)}")
+
 @app.delete("/outfit/{outfit_id}")
 async def delete_outfit_endpoint(outfit_id: str):
     """
     Delete an outfit by ID.
     """
     try:
-        success = await supabase_service.delete_outfit(outfit_id)
+        success = await backend.delete_outfit(outfit_id)
         if not success:
             raise HTTPException(status_code=404, detail="Outfit not found")
         
@@ -493,11 +1143,21 @@ async def delete_item_endpoint(item_id: str):
     Delete a clothing item by ID.
     """
     try:
-        success = await supabase_service.delete_item(item_id)
-        if not success:
+        item = await backend.delete_item(item_id, remove_image=False)
+        if not item:
             raise HTTPException(status_code=404, detail="Item not found")
         
-        return {"message": "Item deleted successfully", "id": item_id}
+        # Image and embedding cleanup happens in the background; legacy local items only have "image"
+        image_path = item.get("image_path") or item.get("image")
+        task_id = None
+        if image_path:
+            task_id = await run_in_threadpool(
+                task_queue.task_queue.enqueue,
+                "remove_image",
+                {"item_id": item_id, "user_id": item.get("user_id"), "image_path": image_path}
+            )
+        
+        return {"message": "Item deleted successfully", "id": item_id, "cleanup_task_id": task_id}
     except HTTPException:
         raise
     except Exception as e:
@@ -0,0 +1,122 @@
+# backend/singleflight.py
+"""
+Single-flight coalescing of identical concurrent work.
+
+The frontend fans out: matchFullOutfit fires one /fashion-predict per item
+pair, and the dashboard and outfit pages load /items/grouped and
+/categories for the same user at the same moment. A SingleFlight group
+runs one call per key at a time; callers arriving while it is in flight
+wait for the same result instead of starting their own.
+
+Nothing is cached: once a call finishes its key is free again. Writes that
+go through CoalescingBackend detach every in-flight read, so a read started
+after a write never receives a result fetched before it.
+"""
+import copy
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+from metrics import SINGLEFLIGHT_CALLS
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 1
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key within one event loop."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Hashable, _Flight] = {}
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Await fn(*args, **kwargs), or join the call already running for key.
+
+        The call runs as its own task, so a caller that is cancelled does not
+        cancel it for the others. When several callers share a result each
+        gets its own deep copy (bytes are returned as is), so endpoints may
+        modify what they receive.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn(*args, **kwargs)))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _, key=key, flight=flight: self._finish(key, flight))
+            SINGLEFLIGHT_CALLS.inc(group=self.name, role="leader")
+        else:
+            flight.waiters += 1
+            SINGLEFLIGHT_CALLS.inc(group=self.name, role="shared")
+
+        result = await asyncio.shield(flight.task)
+        if flight.waiters > 1 and not isinstance(result, (bytes, str, int, float, type(None))):
+            return copy.deepcopy(result)
+        return result
+
+    def _finish(self, key: Hashable, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def forget(self):
+        """Let new callers start fresh calls; running ones still finish for their waiters."""
+        self._flights.clear()
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+
+# ========== BACKEND ==========
+
+class CoalescingBackend:
+    """
+    StorageBackend wrapper that coalesces identical concurrent reads:
+    wardrobe reads (items and categories per user), single-item reads and
+    image downloads. Every other method is passed through; writes detach
+    the in-flight reads.
+    """
+
+    WRITE_METHODS = {
+        "save_clothing_item", "update_clothing_item", "delete_item",
+        "save_outfit", "delete_outfit", "upload_image_bytes", "upload_image", "remove_image"
+    }
+
+    def __init__(self, backend):
+        self._backend = backend
+        self.user_items = SingleFlight("user_items")
+        self.user_categories = SingleFlight("user_categories")
+        self.items = SingleFlight("item")
+        self.images = SingleFlight("image_download")
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._backend, name)
+        if name in self.WRITE_METHODS:
+            async def write(*args, **kwargs):
+                try:
+                    return await attribute(*args, **kwargs)
+                finally:
+                    self.forget()
+            return write
+        return attribute
+
+    def forget(self):
+        for group in (self.user_items, self.user_categories, self.items):
+            group.forget()
+
+    async def get_user_items(self, user_id: str, category=None, limit: int = 100):
+        return await self.user_items.do((user_id, category, limit), self._backend.get_user_items,
+                                        user_id, category=category, limit=limit)
+
+    async def get_user_categories(self, user_id: str):
+        return await self.user_categories.do(user_id, self._backend.get_user_categories, user_id)
+
+    async def get_item_by_id(self, item_id: str):
+        return await self.items.do(item_id, self._backend.get_item_by_id, item_id)
+
+    async def download_image_for_ml(self, file_path: str) -> bytes:
+        # Image paths are content-addressed, so a download never goes stale
+        return await self.images.do(file_path, self._backend.download_image_for_ml, file_path)
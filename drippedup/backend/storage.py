@@ -1,11 +1,11 @@
 import os
-import json
 import uuid
 from fastapi import UploadFile
 from typing import Dict, List, Optional
 from datetime import datetime
+from metadata_store import get_store
 
-IMAGES_ROOT = os.path.join(os.path.dirname(__file__), "images")
+IMAGES_ROOT = os.environ.get("LOCAL_STORAGE_ROOT", os.path.join(os.path.dirname(__file__), "images"))
 METADATA_FILE = os.path.join(IMAGES_ROOT, "metadata.json")
 OUTFIT_METADATA_FILE = os.path.join(IMAGES_ROOT, "outfit_metadata.json")
 
@@ -35,19 +35,14 @@ def save_image_file(folder: str, file: UploadFile, id: str) -> str:
     return file_location, image_filename
 
 def update_metadata(id: str, category: str, image_filename: str, details: Dict):
-    # Load existing metadata
-    metadata = load_metadata(METADATA_FILE)
-    # Remove any existing entry with this ID
-    metadata = [item for item in metadata if item.get("id") != id]
-    # Add new entry
-    metadata.append({
+    # Add the entry, replacing any existing entry with this ID
+    get_store(METADATA_FILE).put({
         "id": id,
         "category": category,
         "image": os.path.join(category, image_filename),
         "details": details,
         "timestamp": datetime.utcnow().isoformat() + "Z"
     })
-    save_metadata(metadata, METADATA_FILE)
 
 def save_item(file: UploadFile, clothing_type: str, details: Dict) -> Dict:
     """
@@ -71,10 +66,9 @@ def get_metadata() -> List[Dict]:
 
 def get_picture(id: str) -> Optional[str]:
     """Return the image path for a given ID from metadata.json, or None if not found."""
-    metadata = get_metadata()
-    for item in metadata:
-        if item.get("id") == id:
-            return os.path.join(IMAGES_ROOT, item.get("image"))
+    item = get_by_id(id, METADATA_FILE)
+    if item and item.get("image"):
+        return os.path.join(IMAGES_ROOT, item.get("image"))
     return None
 
 def look_items(n: int) -> List[Dict]:
@@ -109,84 +103,43 @@ def get_items_by_category(category: str) -> List[Dict]:
 
 def get_all_items_grouped_by_category() -> Dict[str, List[Dict]]:
     """Return all items grouped by category."""
-    metadata = load_metadata(METADATA_FILE)
-    grouped = {}
-    for item in metadata:
-        category = item.get("category")
-        if category:
-            if category not in grouped:
-                grouped[category] = []
-            grouped[category].append(item)
-    return grouped
+    return get_store(METADATA_FILE).group_by("category")
 
 # ========== GENERIC METADATA FUNCTIONS ==========
+# Backed by metadata_store.MetadataStore: reads are served from an in-memory
+# index and writes append one record to <metadata_file>.log.
 
 def load_metadata(metadata_file: str) -> List[Dict]:
     """Load and return the metadata list from the specified file."""
-    if os.path.exists(metadata_file):
-        with open(metadata_file, "r", encoding="utf-8") as f:
-            try:
-                return json.load(f)
-            except Exception:
-                return []
-    return []
+    return get_store(metadata_file).all()
 
 def save_metadata(metadata: List[Dict], metadata_file: str):
-    """Save metadata list to the specified file."""
-    with open(metadata_file, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    """Replace the whole metadata list in the specified file."""
+    get_store(metadata_file).replace_all(metadata)
 
 def get_by_id(id: str, metadata_file: str) -> Optional[Dict]:
     """Return the metadata entry for the given ID, or None if not found."""
-    metadata = load_metadata(metadata_file)
-    for item in metadata:
-        if item.get("id") == id:
-            return item
-    return None
+    return get_store(metadata_file).get(id)
 
 def get_recent_entries(n: int, metadata_file: str) -> List[Dict]:
     """Return the n most recent entries from metadata file (sorted by insertion order)."""
-    metadata = load_metadata(metadata_file)
-    return metadata[-n:] if n > 0 else []
+    return get_store(metadata_file).recent(n)
 
 def get_unique_values(field: str, metadata_file: str) -> List[str]:
     """Return a list of all unique values for the given field."""
-    metadata = load_metadata(metadata_file)
-    values = set()
-    for item in metadata:
-        value = item.get(field)
-        if value:
-            if isinstance(value, list):
-                values.update(value)
-            else:
-                values.add(value)
-    return sorted(list(values))
+    return get_store(metadata_file).unique_values(field)
 
 def get_by_field_value(field: str, value: str, metadata_file: str) -> List[Dict]:
     """Return all entries where the field contains the value."""
-    metadata = load_metadata(metadata_file)
-    result = []
-    for item in metadata:
-        field_value = item.get(field)
-        if field_value:
-            if isinstance(field_value, list) and value in field_value:
-                result.append(item)
-            elif field_value == value:
-                result.append(item)
-    return result
+    return get_store(metadata_file).find(field, value)
+
+def save_entry(entry: Dict, metadata_file: str):
+    """Insert or replace a single entry (keyed by its "id") in the specified file."""
+    get_store(metadata_file).put(entry)
 
 def delete_by_id(id: str, metadata_file: str) -> bool:
     """Delete an entry by ID. Returns True if successful, False if not found."""
-    metadata = load_metadata(metadata_file)
-    original_length = len(metadata)
-    
-    # Filter out the entry with the given ID
-    metadata = [item for item in metadata if item.get("id") != id]
-    
-    if len(metadata) < original_length:
-        save_metadata(metadata, metadata_file)
-        return True
-    return False
+    return get_store(metadata_file).delete(id)
 
 # ========== OUTFIT-SPECIFIC FUNCTIONS ==========
 
@@ -196,22 +149,16 @@ def save_outfit(name: str, item_ids: List[str], description: str = "", tags: Lis
         tags = []
     
     outfit_id = generate_random_id()
-    metadata = load_metadata(OUTFIT_METADATA_FILE)
-    
-    # Remove any existing entry with this ID (shouldn't happen with UUID)
-    metadata = [outfit for outfit in metadata if outfit.get("id") != outfit_id]
     
     # Add new entry
-    metadata.append({
+    save_entry({
         "id": outfit_id,
         "name": name,
         "item_ids": item_ids,
         "description": description,
         "tags": tags,
         "created_at": datetime.utcnow().isoformat() + "Z"
-    })
-    
-    save_metadata(metadata, OUTFIT_METADATA_FILE)
+    }, OUTFIT_METADATA_FILE)
     
     return {
         "message": "Outfit saved successfully",
@@ -0,0 +1,467 @@
+# backend/storage_backend.py
+import os
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional
+from fastapi import UploadFile
+import storage
+from metrics import stage
+from content_cache import content_hash, file_extension
+from metadata_store import atomic_write
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+COMPATIBILITY_METADATA_FILE = os.path.join(storage.IMAGES_ROOT, "compatibility_metadata.json")
+
+
+class StorageBackend(ABC):
+    """
+    Interface the API uses for item, outfit and image persistence.
+
+    Rows returned by every backend have the shape of the Supabase tables
+    (clothing_items, outfits, compatibility_results) so endpoints and the
+    frontend do not care which one is configured.
+    """
+
+    name = "abstract"
+
+    @abstractmethod
+    async def upload_image_bytes(self, file_data: bytes, filename: Optional[str], content_type: Optional[str],
+                                 category: str, user_id: str) -> Dict:
+        """
+        Store image bytes under a content-addressed path and return its
+        file_path, public_url, file_name, content_hash and whether an existing
+        object was reused.
+        """
+
+    async def upload_image(self, file: UploadFile, category: str, user_id: str) -> Dict:
+        """Store an uploaded image and return its file_path, public_url and file_name"""
+        file_data = await file.read()
+        return await self.upload_image_bytes(file_data, file.filename, file.content_type, category, user_id)
+
+    @abstractmethod
+    async def save_clothing_item(self, image_data: Dict, details: Dict, user_id: str) -> Dict:
+        """Save clothing item row"""
+
+    @abstractmethod
+    async def get_user_items(self, user_id: str, category: Optional[str] = None, limit: int = 100) -> List[Dict]:
+        """Get clothing items for a user, newest first"""
+
+    @abstractmethod
+    async def get_item_by_id(self, item_id: str) -> Optional[Dict]:
+        """Get single item by ID"""
+
+    @abstractmethod
+    async def get_user_categories(self, user_id: str) -> List[str]:
+        """Get all categories for a user"""
+
+    @abstractmethod
+    async def download_image_for_ml(self, file_path: str) -> bytes:
+        """Return the raw bytes of a stored image"""
+
+    @abstractmethod
+    async def save_outfit(self, name: str, item_ids: List[str], user_id: str,
+                          description: str = "", tags: List[str] = None) -> Dict:
+        """Save outfit and its items"""
+
+    @abstractmethod
+    async def get_outfit_with_items(self, outfit_id: str) -> Optional[Dict]:
+        """Get outfit with populated item details"""
+
+    @abstractmethod
+    async def get_user_outfits(self, user_id: str, limit: int = 100) -> List[Dict]:
+        """Get all outfits for a user with item details"""
+
+    @abstractmethod
+    async def get_user_outfits_basic(self, user_id: str) -> List[Dict]:
+        """Get all outfits for a user without item details"""
+
+    @abstractmethod
+    async def hydrate_outfits(self, outfits: List[Dict], known_items: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+        """
+        Populate the items of several outfits at once, in position order.
+        Item rows already in known_items (by ID) are reused instead of read again.
+        """
+
+    @abstractmethod
+    async def get_outfit_categories(self) -> List[List[str]]:
+        """Categories of the items in every saved outfit, one list per outfit (all users)"""
+
+    async def get_recent_outfits(self, user_id: str, limit: int = 10) -> List[Dict]:
+        """Get recent outfits for a user"""
+        return await self.get_user_outfits(user_id, limit)
+
+    @abstractmethod
+    async def delete_outfit(self, outfit_id: str) -> bool:
+        """Delete an outfit by ID"""
+
+    @abstractmethod
+    async def delete_item(self, item_id: str, remove_image: bool = True) -> Optional[Dict]:
+        """
+        Delete a clothing item and its outfit links, returning the deleted row
+        (None if not found). The image is removed as well unless remove_image
+        is False, in which case the caller is expected to call remove_image.
+        """
+
+    @abstractmethod
+    async def remove_image(self, file_path: str) -> bool:
+        """Remove a stored image unless an item still references it. Returns True if removed"""
+
+    @abstractmethod
+    async def update_clothing_item(self, item_id: str, updates: Dict) -> Optional[Dict]:
+        """Update a clothing item"""
+
+    @abstractmethod
+    async def save_compatibility_result(self, user_id: str, item1_id: str, item2_id: str,
+                                        score: float) -> Dict:
+        """Save compatibility prediction result for caching. Embeddings are kept
+        once per item in the embedding store, not per pair."""
+
+    @abstractmethod
+    async def get_compatibility_result(self, item1_id: str, item2_id: str) -> Optional[Dict]:
+        """Get cached compatibility result"""
+
+
+class LocalStorageBackend(StorageBackend):
+    """
+    Network-free backend built on the storage.py metadata functions.
+
+    Items, outfits and compatibility results live in JSON metadata files
+    under storage.IMAGES_ROOT and images are written to
+    ``IMAGES_ROOT/<user_id>/<category>/``. The server serves the images
+    items reference under /images so public URLs resolve to this process.
+    """
+
+    name = "local"
+
+    def __init__(self, public_base_url: Optional[str] = None):
+        """
+        Initialize the local backend.
+
+        Args:
+            public_base_url: URL prefix under which item images are served.
+        """
+        self.public_base_url = (public_base_url
+                                or os.environ.get("LOCAL_IMAGES_BASE_URL", "http://localhost:8000/images")).rstrip("/")
+        os.makedirs(storage.IMAGES_ROOT, exist_ok=True)
+        logger.info(f"Local storage backend initialized at {storage.IMAGES_ROOT}")
+
+    def _local_path(self, file_path: str) -> str:
+        """Resolve a stored file_path inside IMAGES_ROOT, rejecting anything outside it"""
+        root = os.path.abspath(storage.IMAGES_ROOT)
+        path = os.path.abspath(os.path.join(root, file_path))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(f"Invalid image path: {file_path}")
+        return path
+
+    async def upload_image_bytes(self, file_data: bytes, filename: Optional[str], content_type: Optional[str],
+                                 category: str, user_id: str) -> Dict:
+        """Write image to the local images directory, reusing an identical existing file"""
+        try:
+            digest = content_hash(file_data)
+            file_name = f"{digest}.{file_extension(filename)}"
+            file_path = f"{user_id}/{category}/{file_name}"
+            local_path = self._local_path(file_path)
+
+            reused = os.path.exists(local_path)
+            if not reused:
+                storage.create_subfolder(os.path.join(user_id, category))
+                # Write to a temp file first so a concurrent identical upload never sees a partial file
+                atomic_write(local_path, lambda f: f.write(file_data))
+                logger.info(f"Image stored locally: {file_path}")
+            else:
+                logger.info(f"Reusing stored image: {file_path}")
+
+            return {
+                "file_path": file_path,
+                "public_url": f"{self.public_base_url}/{file_path}",
+                "file_name": file_name,
+                "content_hash": digest,
+                "reused": reused
+            }
+
+        except Exception as e:
+            logger.error(f"Failed to upload image: {str(e)}")
+            raise Exception(f"Failed to upload image: {str(e)}")
+
+    async def save_clothing_item(self, image_data: Dict, details: Dict, user_id: str) -> Dict:
+        """Save clothing item to the local metadata file"""
+        try:
+            item = {
+                "id": storage.generate_random_id(),
+                "user_id": user_id,
+                "name": details.get("name", ""),
+                "category": details.get("category", ""),
+                "color": details.get("color", ""),
+                "brand": details.get("brand", ""),
+                "notes": details.get("notes", ""),
+                "image_url": image_data["public_url"],
+                "image_path": image_data["file_path"],
+                "details": details,
+                "created_at": datetime.utcnow().isoformat() + "Z"
+            }
+            storage.save_entry(item, storage.METADATA_FILE)
+
+            logger.info(f"Clothing item saved: {item['id']}")
+            return item
+
+        except Exception as e:
+            logger.error(f"Failed to save clothing item: {str(e)}")
+            raise Exception(f"Failed to save clothing item: {str(e)}")
+
+    async def get_user_items(self, user_id: str, category: Optional[str] = None, limit: int = 100) -> List[Dict]:
+        """Get clothing items for a user"""
+        try:
+            items = storage.get_by_field_value("user_id", user_id, storage.METADATA_FILE)
+            if category:
+                items = [item for item in items if item.get("category") == category]
+            items.sort(key=lambda item: item.get("created_at", ""), reverse=True)
+            return items[:limit]
+
+        except Exception as e:
+            logger.error(f"Failed to get user items: {str(e)}")
+            raise Exception(f"Failed to get user items: {str(e)}")
+
+    async def get_item_by_id(self, item_id: str) -> Optional[Dict]:
+        """Get single item by ID"""
+        try:
+            return storage.get_item_info(item_id)
+        except Exception as e:
+            logger.error(f"Failed to get item: {str(e)}")
+            raise Exception(f"Failed to get item: {str(e)}")
+
+    async def get_user_categories(self, user_id: str) -> List[str]:
+        """Get all categories for a user"""
+        try:
+            items = storage.get_by_field_value("user_id", user_id, storage.METADATA_FILE)
+            return sorted(set(item["category"] for item in items if item.get("category")))
+        except Exception as e:
+            logger.error(f"Failed to get categories: {str(e)}")
+            raise Exception(f"Failed to get categories: {str(e)}")
+
+    async def download_image_for_ml(self, file_path: str) -> bytes:
+        """Read image bytes from the local images directory"""
+        try:
+            with stage("storage_download", "local"), open(self._local_path(file_path), "rb") as f:
+                return f.read()
+        except Exception as e:
+            logger.error(f"Failed to download image: {str(e)}")
+            raise Exception(f"Failed to download image: {str(e)}")
+
+    def image_file(self, file_path: str) -> Optional[str]:
+        """
+        Local file of an image an item references, or None. Only referenced
+        images are served: IMAGES_ROOT also holds the metadata and state files.
+        """
+        candidates = {file_path, file_path.replace("/", os.sep)}
+        for candidate in candidates:
+            # image_path for content-addressed uploads, image for legacy items
+            if (storage.get_by_field_value("image_path", candidate, storage.METADATA_FILE)
+                    or storage.get_by_field_value("image", candidate, storage.METADATA_FILE)):
+                path = self._local_path(candidate)
+                return path if os.path.isfile(path) else None
+        return None
+
+    async def save_outfit(self, name: str, item_ids: List[str], user_id: str,
+                          description: str = "", tags: List[str] = None) -> Dict:
+        """Save outfit to the local outfit metadata file"""
+        try:
+            if tags is None:
+                tags = []
+
+            # Validate that all items exist and belong to user
+            for item_id in item_ids:
+                item = await self.get_item_by_id(item_id)
+                if not item or item.get("user_id") != user_id:
+                    raise Exception(f"Item {item_id} not found or doesn't belong to user")
+
+            outfit = {
+                "id": storage.generate_random_id(),
+                "user_id": user_id,
+                "name": name,
+                "description": description,
+                "tags": tags,
+                "item_ids": item_ids,
+                "created_at": datetime.utcnow().isoformat() + "Z"
+            }
+            storage.save_entry(outfit, storage.OUTFIT_METADATA_FILE)
+
+            logger.info(f"Outfit saved: {outfit['id']}")
+            return outfit
+
+        except Exception as e:
+            logger.error(f"Failed to save outfit: {str(e)}")
+            raise Exception(f"Failed to save outfit: {str(e)}")
+
+    async def get_outfit_with_items(self, outfit_id: str) -> Optional[Dict]:
+        """Get outfit with populated item details"""
+        try:
+            return storage.get_outfit_with_items(outfit_id)
+        except Exception as e:
+            logger.error(f"Failed to get outfit: {str(e)}")
+            raise Exception(f"Failed to get outfit: {str(e)}")
+
+    async def get_user_outfits(self, user_id: str, limit: int = 100) -> List[Dict]:
+        """Get all outfits for a user with item details"""
+        try:
+            outfits = await self.get_user_outfits_basic(user_id)
+            return await self.hydrate_outfits(outfits[:limit])
+
+        except Exception as e:
+            logger.error(f"Failed to get user outfits: {str(e)}")
+            raise Exception(f"Failed to get user outfits: {str(e)}")
+
+    async def get_user_outfits_basic(self, user_id: str) -> List[Dict]:
+        """Get all outfits for a user without item details"""
+        try:
+            outfits = storage.get_by_field_value("user_id", user_id, storage.OUTFIT_METADATA_FILE)
+            outfits.sort(key=lambda outfit: outfit.get("created_at", ""), reverse=True)
+            return outfits
+        except Exception as e:
+            logger.error(f"Failed to get user outfits: {str(e)}")
+            raise Exception(f"Failed to get user outfits: {str(e)}")
+
+    async def hydrate_outfits(self, outfits: List[Dict], known_items: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+        """Populate the items of several outfits, reading each item at most once"""
+        try:
+            items = dict(known_items or {})
+            for outfit in outfits:
+                for item_id in outfit.get("item_ids", []):
+                    if item_id not in items:
+                        items[item_id] = storage.get_item_info(item_id)
+            return [
+                {**outfit, "items": [items[item_id] for item_id in outfit.get("item_ids", []) if items[item_id]]}
+                for outfit in outfits
+            ]
+        except Exception as e:
+            logger.error(f"Failed to hydrate outfits: {str(e)}")
+            raise Exception(f"Failed to hydrate outfits: {str(e)}")
+
+    async def get_outfit_categories(self) -> List[List[str]]:
+        """Categories of the items in every saved outfit"""
+        try:
+            categories = {item["id"]: item.get("category", "") for item in storage.load_metadata(storage.METADATA_FILE)}
+            return [
+                [categories[item_id] for item_id in outfit.get("item_ids", []) if item_id in categories]
+                for outfit in storage.load_metadata(storage.OUTFIT_METADATA_FILE)
+            ]
+        except Exception as e:
+            logger.error(f"Failed to get outfit categories: {str(e)}")
+            raise Exception(f"Failed to get outfit categories: {str(e)}")
+
+    async def delete_outfit(self, outfit_id: str) -> bool:
+        """Delete an outfit by ID"""
+        try:
+            return storage.delete_outfit(outfit_id)
+        except Exception as e:
+            logger.error(f"Failed to delete outfit: {str(e)}")
+            raise Exception(f"Failed to delete outfit: {str(e)}")
+
+    async def delete_item(self, item_id: str, remove_image: bool = True) -> Optional[Dict]:
+        """Delete a clothing item by ID"""
+        try:
+            item = await self.get_item_by_id(item_id)
+            if not item:
+                return None
+
+            # Remove the item from any outfit that references it
+            for outfit in storage.get_by_field_value("item_ids", item_id, storage.OUTFIT_METADATA_FILE):
+                outfit["item_ids"] = [i for i in outfit["item_ids"] if i != item_id]
+                storage.save_entry(outfit, storage.OUTFIT_METADATA_FILE)
+
+            if not storage.delete_by_id(item_id, storage.METADATA_FILE):
+                return None
+
+            # Delete image from disk unless another item shares the same content
+            image_path = item.get("image_path") or item.get("image")
+            if remove_image and image_path:
+                try:
+                    await self.remove_image(image_path)
+                except Exception as e:
+                    logger.warning(f"Failed to delete image from storage: {e}")
+
+            return item
+
+        except Exception as e:
+            logger.error(f"Failed to delete item: {str(e)}")
+            raise Exception(f"Failed to delete item: {str(e)}")
+
+    async def remove_image(self, file_path: str) -> bool:
+        """Remove an image from disk unless another item shares the same content"""
+        if (storage.get_by_field_value("image_path", file_path, storage.METADATA_FILE)
+                or storage.get_by_field_value("image", file_path, storage.METADATA_FILE)):
+            return False
+        try:
+            with stage("storage_remove", "local"):
+                os.remove(self._local_path(file_path))
+        except FileNotFoundError:
+            return False
+        logger.info(f"Image removed: {file_path}")
+        return True
+
+    async def update_clothing_item(self, item_id: str, updates: Dict) -> Optional[Dict]:
+        """Update a clothing item"""
+        try:
+            item = await self.get_item_by_id(item_id)
+            if not item:
+                return None
+            item.update(updates)
+            storage.save_entry(item, storage.METADATA_FILE)
+            return item
+
+        except Exception as e:
+            logger.error(f"Failed to update item: {str(e)}")
+            raise Exception(f"Failed to update item: {str(e)}")
+
+    async def save_compatibility_result(self, user_id: str, item1_id: str, item2_id: str,
+                                        score: float) -> Dict:
+        """Save compatibility prediction result for caching"""
+        try:
+            compatibility_data = {
+                "id": f"{item1_id}:{item2_id}",
+                "user_id": user_id,
+                "item1_id": item1_id,
+                "item2_id": item2_id,
+                "compatibility_score": score,
+                "model_version": "v1.0"
+            }
+            storage.save_entry(compatibility_data, COMPATIBILITY_METADATA_FILE)
+            return compatibility_data
+
+        except Exception as e:
+            logger.error(f"Failed to save compatibility result: {str(e)}")
+            raise Exception(f"Failed to save compatibility result: {str(e)}")
+
+    async def get_compatibility_result(self, item1_id: str, item2_id: str) -> Optional[Dict]:
+        """Get cached compatibility result"""
+        try:
+            # Try both directions (item1,item2) and (item2,item1)
+            return (storage.get_by_id(f"{item1_id}:{item2_id}", COMPATIBILITY_METADATA_FILE)
+                    or storage.get_by_id(f"{item2_id}:{item1_id}", COMPATIBILITY_METADATA_FILE))
+        except Exception as e:
+            logger.error(f"Failed to get compatibility result: {str(e)}")
+            return None
+
+
+def get_storage_backend(name: Optional[str] = None) -> StorageBackend:
+    """
+    Return the configured storage backend.
+
+    Args:
+        name: "supabase" or "local". Defaults to the STORAGE_BACKEND
+            environment variable, then "supabase".
+
+    Returns:
+        StorageBackend: The backend instance.
+    """
+    name = (name or os.environ.get("STORAGE_BACKEND", "supabase")).strip().lower()
+    if name == "local":
+        return LocalStorageBackend()
+    if name == "supabase":
+        # Imported lazily so local deployments never need Supabase credentials
+        from supabase_service import supabase_service
+        return supabase_service
+    raise ValueError(f"Unknown storage backend: {name}")
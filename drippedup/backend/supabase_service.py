@@ -3,11 +3,13 @@ import os
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from typing import Dict, List, Optional, Tuple
-from fastapi import UploadFile
-import uuid
 import json
 import logging
 from datetime import datetime
+from profiling import run_in_threadpool
+from storage_backend import StorageBackend
+from metrics import stage
+from content_cache import content_hash, file_extension
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -15,7 +17,9 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-class SupabaseService:
+class SupabaseService(StorageBackend):
+    name = "supabase"
+
     def __init__(self):
         url = os.environ.get("SUPABASE_URL")
         # Use service role key for backend operations
@@ -27,36 +31,53 @@ class SupabaseService:
         self.supabase: Client = create_client(url, key)
         logger.info("Supabase service initialized successfully")
     
-    async def upload_image(self, file: UploadFile, category: str, user_id: str) -> Dict:
-        """Upload image to Supabase Storage"""
+    async def _execute(self, query):
+        """Run a PostgREST query in the threadpool so it does not block the event loop"""
+        with stage("supabase_query", "supabase"):
+            return await run_in_threadpool(query.execute)
+    
+    async def _image_referenced(self, file_path: str) -> bool:
+        """Check whether any clothing item still points at a storage object"""
+        result = await self._execute(
+            self.supabase.table("clothing_items").select("id").eq("image_path", file_path).limit(1)
+        )
+        return bool(result.data)
+    
+    async def upload_image_bytes(self, file_data: bytes, filename: Optional[str], content_type: Optional[str],
+                                 category: str, user_id: str) -> Dict:
+        """Upload image to Supabase Storage, reusing an identical object if one is already stored"""
         try:
-            # Generate unique filename
-            file_ext = file.filename.split('.')[-1] if file.filename else 'jpg'
-            file_name = f"{uuid.uuid4()}.{file_ext}"
+            # Name the object after its content so identical uploads share it
+            digest = content_hash(file_data)
+            file_name = f"{digest}.{file_extension(filename)}"
             file_path = f"{user_id}/{category}/{file_name}"
             
-            # Read file data
-            file_data = await file.read()
-            
-            # Upload to Supabase Storage
-            result = self.supabase.storage.from_("clothing-images").upload(
-                path=file_path,
-                file=file_data,
-                file_options={"content-type": file.content_type}
-            )
-            
-            if hasattr(result, 'error') and result.error:
-                raise Exception(f"Upload failed: {result.error}")
+            reused = await self._image_referenced(file_path)
+            if not reused:
+                # Upsert so an orphaned object with the same content is simply overwritten
+                with stage("storage_upload", "supabase"):
+                    result = await run_in_threadpool(
+                        self.supabase.storage.from_("clothing-images").upload,
+                        path=file_path,
+                        file=file_data,
+                        file_options={"content-type": content_type or "image/jpeg", "upsert": "true"}
+                    )
+                
+                if hasattr(result, 'error') and result.error:
+                    raise Exception(f"Upload failed: {result.error}")
+                logger.info(f"Image uploaded successfully: {file_path}")
+            else:
+                logger.info(f"Reusing stored image: {file_path}")
             
             # Get public URL
             public_url = self.supabase.storage.from_("clothing-images").get_public_url(file_path)
             
-            logger.info(f"Image uploaded successfully: {file_path}")
-            
             return {
                 "file_path": file_path,
                 "public_url": public_url,
-                "file_name": file_name
+                "file_name": file_name,
+                "content_hash": digest,
+                "reused": reused
             }
             
         except Exception as e:
@@ -78,7 +99,7 @@ class SupabaseService:
                 "details": details  # Store full details as JSONB
             }
             
-            result = self.supabase.table("clothing_items").insert(item_data).execute()
+            result = await self._execute(self.supabase.table("clothing_items").insert(item_data))
             
             if not result.data:
                 raise Exception("Failed to insert clothing item")
@@ -98,7 +119,7 @@ class SupabaseService:
             if category:
                 query = query.eq("category", category)
             
-            result = query.order("created_at", desc=True).limit(limit).execute()
+            result = await self._execute(query.order("created_at", desc=True).limit(limit))
             return result.data
             
         except Exception as e:
@@ -108,7 +129,7 @@ class SupabaseService:
     async def get_item_by_id(self, item_id: str) -> Optional[Dict]:
         """Get single item by ID"""
         try:
-            result = self.supabase.table("clothing_items").select("*").eq("id", item_id).execute()
+            result = await self._execute(self.supabase.table("clothing_items").select("*").eq("id", item_id))
             return result.data[0] if result.data else None
         except Exception as e:
             logger.error(f"Failed to get item: {str(e)}")
@@ -117,7 +138,7 @@ class SupabaseService:
     async def get_user_categories(self, user_id: str) -> List[str]:
         """Get all categories for a user"""
         try:
-            result = self.supabase.table("clothing_items").select("category").eq("user_id", user_id).execute()
+            result = await self._execute(self.supabase.table("clothing_items").select("category").eq("user_id", user_id))
             categories = list(set([item["category"] for item in result.data if item["category"]]))
             return sorted(categories)
         except Exception as e:
@@ -127,8 +148,8 @@ class SupabaseService:
     async def download_image_for_ml(self, file_path: str) -> bytes:
         """Download image from storage for ML processing"""
         try:
-            result = self.supabase.storage.from_("clothing-images").download(file_path)
-            return result
+            with stage("storage_download", "supabase"):
+                return await run_in_threadpool(self.supabase.storage.from_("clothing-images").download, file_path)
         except Exception as e:
             logger.error(f"Failed to download image: {str(e)}")
             raise Exception(f"Failed to download image: {str(e)}")
@@ -154,7 +175,7 @@ class SupabaseService:
                 "tags": tags
             }
             
-            outfit_result = self.supabase.table("outfits").insert(outfit_data).execute()
+            outfit_result = await self._execute(self.supabase.table("outfits").insert(outfit_data))
             
             if not outfit_result.data:
                 raise Exception("Failed to create outfit")
@@ -172,7 +193,7 @@ class SupabaseService:
                 for idx, item_id in enumerate(item_ids)
             ]
             
-            items_result = self.supabase.table("outfit_items").insert(outfit_items).execute()
+            items_result = await self._execute(self.supabase.table("outfit_items").insert(outfit_items))
             
             logger.info(f"Outfit saved: {outfit_id}")
             return outfit
@@ -185,7 +206,7 @@ class SupabaseService:
         """Get outfit with populated item details"""
         try:
             # Get outfit
-            outfit_result = self.supabase.table("outfits").select("*").eq("id", outfit_id).execute()
+            outfit_result = await self._execute(self.supabase.table("outfits").select("*").eq("id", outfit_id))
             
             if not outfit_result.data:
                 return None
@@ -193,10 +214,10 @@ class SupabaseService:
             outfit = outfit_result.data[0]
             
             # Get outfit items with clothing details
-            items_result = self.supabase.table("outfit_items").select("""
+            items_result = await self._execute(self.supabase.table("outfit_items").select("""
                 *,
                 clothing_item:clothing_items(*)
-            """).eq("outfit_id", outfit_id).order("position").execute()
+            """).eq("outfit_id", outfit_id).order("position"))
             
             # Add items to outfit
             outfit["items"] = [item["clothing_item"] for item in items_result.data]
@@ -210,20 +231,74 @@ class SupabaseService:
     async def get_user_outfits(self, user_id: str, limit: int = 100) -> List[Dict]:
         """Get all outfits for a user with item details"""
         try:
-            outfits_result = self.supabase.table("outfits").select("*").eq("user_id", user_id).order("created_at", desc=True).limit(limit).execute()
-            
-            outfits_with_items = []
-            for outfit in outfits_result.data:
-                outfit_with_items = await self.get_outfit_with_items(outfit["id"])
-                if outfit_with_items:
-                    outfits_with_items.append(outfit_with_items)
+            outfits_result = await self._execute(self.supabase.table("outfits").select("*").eq("user_id", user_id).order("created_at", desc=True).limit(limit))
             
-            return outfits_with_items
+            # One outfit_items query for all outfits instead of one per outfit
+            return await self.hydrate_outfits(outfits_result.data or [])
             
         except Exception as e:
             logger.error(f"Failed to get user outfits: {str(e)}")
             raise Exception(f"Failed to get user outfits: {str(e)}")
     
+    async def get_user_outfits_basic(self, user_id: str) -> List[Dict]:
+        """Get all outfits for a user without item details"""
+        try:
+            outfits_result = await self._execute(self.supabase.table("outfits").select("*").eq("user_id", user_id))
+            return outfits_result.data or []
+        except Exception as e:
+            logger.error(f"Failed to get user outfits: {str(e)}")
+            raise Exception(f"Failed to get user outfits: {str(e)}")
+    
+    async def hydrate_outfits(self, outfits: List[Dict], known_items: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+        """Populate the items of several outfits with at most two queries"""
+        try:
+            if not outfits:
+                return []
+            links_result = await self._execute(self.supabase.table("outfit_items").select(
+                "outfit_id, clothing_item_id, position"
+            ).in_("outfit_id", [outfit["id"] for outfit in outfits]).order("position"))
+            links = links_result.data or []
+            
+            items = dict(known_items or {})
+            missing = list({link["clothing_item_id"] for link in links} - set(items))
+            if missing:
+                items_result = await self._execute(self.supabase.table("clothing_items").select("*").in_("id", missing))
+                items.update({item["id"]: item for item in items_result.data or []})
+            
+            items_by_outfit: Dict[str, List[Dict]] = {}
+            for link in links:
+                item = items.get(link["clothing_item_id"])
+                if item is not None:
+                    items_by_outfit.setdefault(link["outfit_id"], []).append(item)
+            return [{**outfit, "items": items_by_outfit.get(outfit["id"], [])} for outfit in outfits]
+            
+        except Exception as e:
+            logger.error(f"Failed to hydrate outfits: {str(e)}")
+            raise Exception(f"Failed to hydrate outfits: {str(e)}")
+    
+    async def get_outfit_categories(self) -> List[List[str]]:
+        """Categories of the items in every saved outfit, read in pages"""
+        try:
+            outfits: Dict[str, List[str]] = {}
+            page_size = 1000
+            start = 0
+            while True:
+                # Paging needs a total order: rows tied on the sort key may move across page boundaries
+                result = await self._execute(self.supabase.table("outfit_items").select(
+                    "outfit_id, clothing_item:clothing_items(category)"
+                ).order("outfit_id").order("clothing_item_id").order("position").range(start, start + page_size - 1))
+                rows = result.data or []
+                for row in rows:
+                    if row.get("clothing_item"):
+                        outfits.setdefault(row["outfit_id"], []).append(row["clothing_item"].get("category", ""))
+                if len(rows) < page_size:
+                    break
+                start += page_size
+            return list(outfits.values())
+        except Exception as e:
+            logger.error(f"Failed to get outfit categories: {str(e)}")
+            raise Exception(f"Failed to get outfit categories: {str(e)}")
+    
     async def get_recent_outfits(self, user_id: str, limit: int = 10) -> List[Dict]:
         """Get recent outfits for a user"""
         try:
@@ -236,10 +311,10 @@ class SupabaseService:
         """Delete an outfit by ID"""
         try:
             # Delete outfit items first (due to foreign key constraint)
-            self.supabase.table("outfit_items").delete().eq("outfit_id", outfit_id).execute()
+            await self._execute(self.supabase.table("outfit_items").delete().eq("outfit_id", outfit_id))
             
             # Delete outfit
-            result = self.supabase.table("outfits").delete().eq("id", outfit_id).execute()
+            result = await self._execute(self.supabase.table("outfits").delete().eq("id", outfit_id))
             
             return len(result.data) > 0
             
@@ -247,36 +322,49 @@ class SupabaseService:
             logger.error(f"Failed to delete outfit: {str(e)}")
             raise Exception(f"Failed to delete outfit: {str(e)}")
     
-    async def delete_item(self, item_id: str) -> bool:
-        """Delete a clothing item by ID"""
+    async def delete_item(self, item_id: str, remove_image: bool = True) -> Optional[Dict]:
+        """Delete a clothing item by ID, returning the deleted row"""
         try:
             # Get item to check if it exists and get image path
             item = await self.get_item_by_id(item_id)
             if not item:
-                return False
+                return None
             
             # Delete from outfit_items first (foreign key constraint)
-            self.supabase.table("outfit_items").delete().eq("clothing_item_id", item_id).execute()
+            await self._execute(self.supabase.table("outfit_items").delete().eq("clothing_item_id", item_id))
             
             # Delete from database
-            result = self.supabase.table("clothing_items").delete().eq("id", item_id).execute()
+            result = await self._execute(self.supabase.table("clothing_items").delete().eq("id", item_id))
+            
+            if not result.data:
+                return None
             
-            # Delete image from storage
-            try:
-                self.supabase.storage.from_("clothing-images").remove([item["image_path"]])
-            except Exception as e:
-                logger.warning(f"Failed to delete image from storage: {e}")
+            # Delete image from storage unless another item shares the same content
+            if remove_image:
+                try:
+                    await self.remove_image(item["image_path"])
+                except Exception as e:
+                    logger.warning(f"Failed to delete image from storage: {e}")
             
-            return len(result.data) > 0
+            return item
             
         except Exception as e:
             logger.error(f"Failed to delete item: {str(e)}")
             raise Exception(f"Failed to delete item: {str(e)}")
     
+    async def remove_image(self, file_path: str) -> bool:
+        """Remove an image from storage unless another item shares the same content"""
+        if await self._image_referenced(file_path):
+            return False
+        with stage("storage_remove", "supabase"):
+            await run_in_threadpool(self.supabase.storage.from_("clothing-images").remove, [file_path])
+        logger.info(f"Image removed: {file_path}")
+        return True
+    
     async def update_clothing_item(self, item_id: str, updates: Dict) -> Optional[Dict]:
         """Update a clothing item"""
         try:
-            result = self.supabase.table("clothing_items").update(updates).eq("id", item_id).execute()
+            result = await self._execute(self.supabase.table("clothing_items").update(updates).eq("id", item_id))
             
             if not result.data:
                 return None
@@ -288,7 +376,7 @@ class SupabaseService:
             raise Exception(f"Failed to update item: {str(e)}")
     
     async def save_compatibility_result(self, user_id: str, item1_id: str, item2_id: str, 
-                                       score: float, embedding1: List[float], embedding2: List[float]) -> Dict:
+                                       score: float) -> Dict:
         """Save compatibility prediction result for caching"""
         try:
             compatibility_data = {
@@ -296,16 +384,14 @@ class SupabaseService:
                 "item1_id": item1_id,
                 "item2_id": item2_id,
                 "compatibility_score": score,
-                "embedding1": embedding1,
-                "embedding2": embedding2,
                 "model_version": "v1.0"
             }
             
             # Use upsert to handle duplicates
-            result = self.supabase.table("compatibility_results").upsert(
+            result = await self._execute(self.supabase.table("compatibility_results").upsert(
                 compatibility_data,
                 on_conflict="item1_id,item2_id"
-            ).execute()
+            ))
             
             return result.data[0] if result.data else None
             
@@ -317,12 +403,12 @@ class SupabaseService:
         """Get cached compatibility result"""
         try:
             # Try both directions (item1,item2) and (item2,item1)
-            result1 = self.supabase.table("compatibility_results").select("*").eq("item1_id", item1_id).eq("item2_id", item2_id).execute()
+            result1 = await self._execute(self.supabase.table("compatibility_results").select("*").eq("item1_id", item1_id).eq("item2_id", item2_id))
             
             if result1.data:
                 return result1.data[0]
             
-            result2 = self.supabase.table("compatibility_results").select("*").eq("item1_id", item2_id).eq("item2_id", item1_id).execute()
+            result2 = await self._execute(self.supabase.table("compatibility_results").select("*").eq("item1_id", item2_id).eq("item2_id", item1_id))
             
             if result2.data:
                 return result2.data[0]
@@ -0,0 +1,439 @@
+# backend/task_queue.py
+"""
+Durable background task queue backed by SQLite.
+
+Endpoints enqueue follow-up work (image removal, embeddings) and return as
+soon as the database write is done. Worker processes claim tasks, run the
+registered handler and retry failures with exponential backoff:
+
+    task_id = task_queue.enqueue("remove_image", {"image_path": ...})
+    task_queue.get(task_id)["status"]   # queued | running | succeeded | failed
+
+The server starts TASK_WORKERS worker processes (default 1) on startup.
+Workers can also be run separately, e.g. on another machine sharing the
+same storage:
+
+    python task_queue.py --workers 2
+"""
+import os
+import json
+import time
+import uuid
+import signal
+import socket
+import sqlite3
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import storage
+import scheduler
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TASK_QUEUE_PATH = os.environ.get("TASK_QUEUE_PATH", os.path.join(storage.IMAGES_ROOT, "tasks.sqlite3"))
+TASK_WORKERS = int(os.environ.get("TASK_WORKERS", "1"))
+TASK_MAX_ATTEMPTS = int(os.environ.get("TASK_MAX_ATTEMPTS", "5"))
+TASK_POLL_INTERVAL = float(os.environ.get("TASK_POLL_INTERVAL", "0.5"))
+# A running task whose worker died is handed out again after this long
+TASK_LEASE_SECONDS = float(os.environ.get("TASK_LEASE_SECONDS", "300"))
+# An upload's hold on its image content expires after this long if never released
+IMAGE_HOLD_SECONDS = float(os.environ.get("IMAGE_HOLD_SECONDS", "120"))
+# A removal's claim expires after this long if its worker dies mid-delete
+IMAGE_REMOVAL_SECONDS = 60.0
+# How often an upload checks whether a removal of its content has finished
+IMAGE_CLAIM_POLL_INTERVAL = 0.1
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 300.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    locked_by TEXT,
+    locked_until REAL,
+    last_error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (status, run_after);
+DROP TABLE IF EXISTS image_holds;
+CREATE TABLE IF NOT EXISTS image_claims (
+    id TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS image_claims_content ON image_claims (content_hash, kind);
+"""
+
+# Kinds of image claims
+UPLOAD = "upload"
+REMOVAL = "removal"
+
+
+class RetryLater(Exception):
+    """
+    Raised by a handler whose task cannot run yet. The task is queued again
+    after delay seconds without using up one of its attempts.
+    """
+
+    def __init__(self, reason: str, delay: float = RETRY_BASE_DELAY):
+        super().__init__(reason)
+        self.delay = delay
+
+
+class TaskQueue:
+    """SQLite task table shared by the API process and the workers."""
+
+    def __init__(self, path: str = TASK_QUEUE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call keeps this safe across threads and processes
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, kind: str, payload: Dict, max_attempts: int = TASK_MAX_ATTEMPTS, delay: float = 0.0) -> str:
+        """Add a task and return its ID."""
+        task_id = str(uuid.uuid4())
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO tasks (id, kind, payload, status, max_attempts, run_after, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (task_id, kind, json.dumps(payload), max_attempts, now + delay, now, now)
+            )
+        return task_id
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        """Return a task's status, or None if it does not exist."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """Atomically take the next runnable task, including ones whose lease expired."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM tasks WHERE (status = 'queued' AND run_after <= ?) "
+                    "OR (status = 'running' AND locked_until < ?) "
+                    "ORDER BY run_after LIMIT 1",
+                    (now, now)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE tasks SET status = 'running', attempts = attempts + 1, locked_by = ?, "
+                    "locked_until = ?, updated_at = ? WHERE id = ?",
+                    (worker_id, now + TASK_LEASE_SECONDS, now, row["id"])
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        task = self._row_to_dict(row)
+        task["attempts"] += 1
+        return task
+
+    def complete(self, task_id: str, result=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = 'succeeded', result = ?, locked_by = NULL, locked_until = NULL, "
+                "updated_at = ? WHERE id = ?",
+                (json.dumps(result), time.time(), task_id)
+            )
+
+    def fail(self, task: Dict, error: str):
+        """Record a failed attempt; retry with backoff until max_attempts is reached."""
+        now = time.time()
+        if task["attempts"] >= task["max_attempts"]:
+            status, run_after = "failed", now
+        else:
+            status = "queued"
+            run_after = now + min(RETRY_MAX_DELAY, RETRY_BASE_DELAY ** task["attempts"])
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = ?, run_after = ?, last_error = ?, locked_by = NULL, "
+                "locked_until = NULL, updated_at = ? WHERE id = ?",
+                (status, run_after, error, now, task["id"])
+            )
+
+    def _claim_image(self, content_hash: str, kind: str, blocked_by: str, ttl: float) -> Optional[str]:
+        """
+        Take a claim on image content unless a claim of kind blocked_by exists.
+        The check and the insert are one write transaction, so an upload and a
+        removal of the same content can never both hold a claim.
+        """
+        claim_id = str(uuid.uuid4())
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM image_claims WHERE expires_at < ?", (now,))
+                blocked = conn.execute(
+                    "SELECT 1 FROM image_claims WHERE content_hash = ? AND kind = ? LIMIT 1",
+                    (content_hash, blocked_by)
+                ).fetchone()
+                if blocked is None:
+                    conn.execute("INSERT INTO image_claims (id, content_hash, kind, expires_at) VALUES (?, ?, ?, ?)",
+                                 (claim_id, content_hash, kind, now + ttl))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return None if blocked is not None else claim_id
+
+    def hold_image(self, content_hash: str, ttl: float = IMAGE_HOLD_SECONDS) -> str:
+        """
+        Record that an upload of this image content is about to insert an item
+        row referencing it, waiting for any removal of the content in progress
+        to finish first. remove_image tasks do not start while a hold exists,
+        since the reference does not count until the row is in. Returns the
+        hold ID for release_image.
+        """
+        while True:
+            hold_id = self._claim_image(content_hash, UPLOAD, REMOVAL, ttl)
+            if hold_id is not None:
+                return hold_id
+            time.sleep(IMAGE_CLAIM_POLL_INTERVAL)
+
+    def begin_image_removal(self, content_hash: str) -> Optional[str]:
+        """
+        Claim image content for removal, or return None while an upload holds
+        it. Uploads wait until the claim is released with release_image.
+        """
+        return self._claim_image(content_hash, REMOVAL, UPLOAD, IMAGE_REMOVAL_SECONDS)
+
+    def release_image(self, claim_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM image_claims WHERE id = ?", (claim_id,))
+
+    def retry_later(self, task: Dict, reason: str, delay: float):
+        """Queue a task again after delay seconds without counting the attempt."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = 'queued', attempts = attempts - 1, run_after = ?, last_error = ?, "
+                "locked_by = NULL, locked_until = NULL, updated_at = ? WHERE id = ?",
+                (now + delay, reason, now, task["id"])
+            )
+
+    def counts(self) -> Dict[str, int]:
+        """Number of tasks per status."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM tasks GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict:
+        task = dict(row)
+        task["payload"] = json.loads(task["payload"])
+        task["result"] = json.loads(task["result"]) if task["result"] else None
+        return task
+
+
+task_queue = TaskQueue()
+
+# ========== HANDLERS ==========
+
+HANDLERS: Dict[str, Callable] = {}
+
+
+def handler(kind: str):
+    """Register an async function as the handler for a task kind."""
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+class WorkerContext:
+    """Resources a worker builds once and shares between tasks."""
+
+    def __init__(self, queue: "TaskQueue"):
+        self.queue = queue
+        self._backend = None
+        self._fashion = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            from storage_backend import get_storage_backend
+            self._backend = get_storage_backend()
+        return self._backend
+
+    @property
+    def fashion(self):
+        if self._fashion is None:
+            random_init = os.environ.get("MODEL_RANDOM_WEIGHTS", "").lower() in ("1", "true", "yes")
+            if os.environ.get("MODEL_SERVING", "inprocess").strip().lower() == "host":
+                # Share the model host's weights instead of loading another copy
+                from model_host import connect_models
+                self._fashion = connect_models(random_init=random_init)[1]
+                if self._fashion is None:
+                    raise RuntimeError("Model host has no fashion model")
+            else:
+                from fashion import FashionCompatibility
+                self._fashion = FashionCompatibility(random_init=random_init)
+        return self._fashion
+
+
+@handler("remove_image")
+async def remove_image_task(ctx: WorkerContext, payload: Dict) -> Dict:
+    """Remove a deleted item's image, stored embedding and compatibility graph entries."""
+    from embedding_store import embedding_store
+    from compatibility_graph import compatibility_graph
+    if payload.get("item_id"):
+        embedding_store.delete(payload["item_id"])
+        if payload.get("user_id"):
+            compatibility_graph.remove_item(payload["user_id"], payload["item_id"])
+    # Image paths are named after their content hash
+    digest = os.path.splitext(os.path.basename(payload["image_path"]))[0]
+    claim_id = ctx.queue.begin_image_removal(digest)
+    if claim_id is None:
+        # The same image is being uploaded again and its new item row is not in yet
+        raise RetryLater(f"Image {payload['image_path']} is being uploaded again")
+    try:
+        # Uploads of this content wait for the claim, so none can reuse the object mid-delete
+        removed = await ctx.backend.remove_image(payload["image_path"])
+    finally:
+        ctx.queue.release_image(claim_id)
+    return {"removed": removed}
+
+
+@handler("compute_embedding")
+async def compute_embedding_task(ctx: WorkerContext, payload: Dict) -> Dict:
+    """Compute and store the compatibility embedding of a saved item, then add it to the user's graph."""
+    from io import BytesIO
+    from PIL import Image
+    from embedding_store import embedding_store
+    from compatibility_graph import compatibility_graph
+    item_id = payload["item_id"]
+    stored = embedding_store.get_encoded(item_id)
+    embedding = None
+    if stored is None:
+        image_data = await ctx.backend.download_image_for_ml(payload["image_path"])
+        embedding = ctx.fashion.embed_image(Image.open(BytesIO(image_data)))
+    # The item may have been deleted while the embedding was computed
+    item = await ctx.backend.get_item_by_id(item_id)
+    if item is None:
+        return {"skipped": "item deleted"}
+    if embedding is not None:
+        stored = embedding_store.put(item_id, embedding)
+    scored = compatibility_graph.add_item(item["user_id"], item_id, stored,
+                                          embedding_store.get_encoded, embedding_store.scorer(ctx.fashion))
+    return {"format": str(stored.dtype), "stored_bytes": int(stored.nbytes), "pairs_scored": scored}
+
+# ========== WORKERS ==========
+
+
+def run_worker(queue_path: str = TASK_QUEUE_PATH, stop_when_idle: bool = False):
+    """Claim and run tasks until terminated (or until the queue is empty)."""
+    queue = TaskQueue(queue_path)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    ctx = WorkerContext(queue)
+    loop = asyncio.new_event_loop()
+    logger.info(f"Task worker {worker_id} started")
+
+    running = True
+
+    def stop(*_):
+        nonlocal running
+        running = False
+    signal.signal(signal.SIGTERM, stop)
+
+    while running:
+        task = queue.claim(worker_id)
+        if task is None:
+            if stop_when_idle:
+                break
+            time.sleep(TASK_POLL_INTERVAL)
+            continue
+
+        fn = HANDLERS.get(task["kind"])
+        try:
+            if fn is None:
+                raise ValueError(f"No handler for task kind: {task['kind']}")
+            # Task work is bulk: model calls it makes yield to interactive requests
+            with scheduler.lane(scheduler.BULK, user=task["payload"].get("user_id")):
+                result = loop.run_until_complete(fn(ctx, task["payload"]))
+            queue.complete(task["id"], result)
+            logger.info(f"Task {task['id']} ({task['kind']}) succeeded")
+        except RetryLater as e:
+            queue.retry_later(task, str(e), e.delay)
+            logger.info(f"Task {task['id']} ({task['kind']}) postponed: {e}")
+        except Exception as e:
+            queue.fail(task, str(e))
+            logger.warning(f"Task {task['id']} ({task['kind']}) attempt {task['attempts']} failed: {e}")
+
+    loop.close()
+
+
+def start_workers(count: int = TASK_WORKERS, queue_path: str = TASK_QUEUE_PATH) -> List[multiprocessing.Process]:
+    """Start worker processes. Spawned, so they never inherit the server's models or event loop."""
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for _ in range(count):
+        process = context.Process(target=run_worker, args=(queue_path,), daemon=True)
+        process.start()
+        workers.append(process)
+    return workers
+
+
+def stop_workers(workers: List[multiprocessing.Process], timeout: float = 10.0):
+    """Ask workers to finish their current task and exit."""
+    for process in workers:
+        process.terminate()
+    for process in workers:
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run DrippedUp background task workers")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--queue", default=TASK_QUEUE_PATH, help="Path of the SQLite task database")
+    parser.add_argument("--drain", action="store_true", help="Exit once no runnable task is left")
+    args = parser.parse_args()
+
+    if args.workers == 1 or args.drain:
+        run_worker(args.queue, stop_when_idle=args.drain)
+        return
+    workers = start_workers(args.workers, args.queue)
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        stop_workers(workers)
+
+
+if __name__ == "__main__":
+    main()
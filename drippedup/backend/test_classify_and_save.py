@@ -0,0 +1,98 @@
+# backend/test_classify_and_save.py
+import io
+import os
+import pytest
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("fastapi")
+
+# The endpoint is exercised with stand-in models and storage; no credentials needed
+os.environ.setdefault("STORAGE_BACKEND", "local")
+server = pytest.importorskip("server")
+from fastapi.testclient import TestClient
+
+IMAGE_SIZE = 224
+UPLOADS = 20
+
+
+def _rgb_jpeg(seed: int) -> bytes:
+    """A noisy RGB JPEG, so a wrongly decoded image cannot match by chance"""
+    pixels = np.random.default_rng(seed).integers(0, 256, (480, 360, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, "RGB").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class RecordingClassifier:
+    image_size = IMAGE_SIZE
+
+    def __init__(self):
+        self.inputs = []
+
+    def predict_batch(self, img_array):
+        self.inputs.extend(img_array)
+        return [{"predicted_class_name": "shirt", "confidence": 1.0} for _ in img_array]
+
+
+class RecordingFashion:
+    def __init__(self):
+        self.inputs = []
+
+    def embed_images(self, images):
+        arrays = [np.asarray(image.convert("RGB"), dtype=np.float32) for image in images]
+        self.inputs.extend(arrays)
+        return np.stack([np.resize(array.mean(axis=(0, 1)), 128) for array in arrays]).astype(np.float32)
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self):
+        self.items = []
+
+    async def upload_image_bytes(self, file_data, filename, content_type, category, user_id):
+        return {"image": filename, "image_url": f"memory://{filename}"}
+
+    async def save_clothing_item(self, image_data, details, user_id):
+        item = {"id": f"item-{len(self.items)}", "user_id": user_id, **image_data, **details}
+        self.items.append(item)
+        return item
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, "classifier", RecordingClassifier())
+    monkeypatch.setattr(server, "fashion", RecordingFashion())
+    monkeypatch.setattr(server, "backend", MemoryBackend())
+    monkeypatch.setattr(server.prediction_cache, "get", lambda digest: None)
+    monkeypatch.setattr(server.prediction_cache, "put", lambda digest, prediction: None)
+    monkeypatch.setattr(server.embedding_store, "put", lambda item_id, embedding: embedding)
+    monkeypatch.setattr(server.compatibility_graph, "add_item", lambda *args: 0)
+    # Not entered as a context manager, so the startup event does not load the real models
+    return TestClient(server.app)
+
+
+def test_classify_and_save_rgb_jpeg(client):
+    """Every consumer of the shared decoded image sees the same, correct pixels"""
+    for seed in range(UPLOADS):
+        data = _rgb_jpeg(seed)
+        response = client.post(
+            "/classify-and-save",
+            files={"file": (f"upload-{seed}.jpg", data, "image/jpeg")},
+            data={"user_id": "test-user"}
+        )
+        assert response.status_code == 200, response.text
+        body = response.json()
+        assert body["item"]["category"] == "shirt"
+        assert body["embedding_stored"] is True
+
+        with Image.open(io.BytesIO(data)) as reference:
+            reference = reference.convert("RGB")
+            expected_pixels = np.asarray(reference, dtype=np.float32)
+            expected_input = np.array(reference.resize((IMAGE_SIZE, IMAGE_SIZE))) / 255.0
+            expected_palette = server.color_palette.extract_palette(reference).tolist()
+
+        np.testing.assert_array_equal(server.classifier.inputs[-1], expected_input)
+        np.testing.assert_array_equal(server.fashion.inputs[-1], expected_pixels)
+        assert body["item"][server.color_palette.PALETTE_DETAILS_KEY] == pytest.approx(expected_palette)
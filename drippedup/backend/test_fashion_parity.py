@@ -0,0 +1,82 @@
+# backend/test_fashion_parity.py
+import os
+import time
+import pytest
+
+torch = pytest.importorskip("torch")
+import torch.nn as nn
+
+# Scores and embeddings may differ by float rounding only
+TOLERANCE = 1e-4
+COMPILE_MODES = os.environ.get("PARITY_COMPILE_MODES", "none,trace,script").split(",")
+
+def _randomize_batchnorm(model):
+    """Give every BatchNorm non-trivial statistics so fusion is actually exercised"""
+    generator = torch.Generator().manual_seed(0)
+    for module in model.modules():
+        if isinstance(module, (nn.BatchNorm1d, nn.BatchNorm2d)):
+            size = module.num_features
+            module.running_mean.copy_(torch.randn(size, generator=generator) * 0.1)
+            module.running_var.copy_(torch.rand(size, generator=generator) + 0.5)
+            module.weight.data.copy_(torch.rand(size, generator=generator) + 0.5)
+            module.bias.data.copy_(torch.randn(size, generator=generator) * 0.1)
+
+def _time(fn, iterations=5):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+@pytest.fixture(scope="module")
+def eager():
+    """The eager SiameseNetwork and its outputs on two fixed batches"""
+    from fashion import FashionCompatibility
+    # Weights come from FASHION_WEIGHTS_PATH when set, otherwise random weights are used
+    weights_path = os.environ.get("FASHION_WEIGHTS_PATH")
+    if weights_path and not os.path.exists(weights_path):
+        pytest.skip(f"Fashion weights not found at {weights_path}")
+    try:
+        model = FashionCompatibility(random_init=not weights_path, inference_mode="eager")
+    except Exception as e:
+        pytest.skip(f"Eager fashion model unavailable: {e}")
+    if not weights_path:
+        with torch.no_grad():
+            _randomize_batchnorm(model.model)
+
+    generator = torch.Generator().manual_seed(1)
+    images1 = torch.randn(8, 3, 224, 224, generator=generator).to(model.device)
+    images2 = torch.randn(8, 3, 224, 224, generator=generator).to(model.device)
+    with torch.no_grad():
+        expected = model.model(images1, images2)
+    return model, images1, images2, expected
+
+@pytest.mark.parametrize("channels_last", [False, True])
+@pytest.mark.parametrize("compile_mode", COMPILE_MODES)
+def test_fashion_parity(eager, compile_mode, channels_last):
+    """The optimized fashion inference path matches the eager SiameseNetwork"""
+    from fashion import optimize_for_inference
+    model, images1, images2, (expected_scores, expected_emb1, expected_emb2) = eager
+
+    optimized = optimize_for_inference(model.model, compile_mode, channels_last)
+    with torch.inference_mode():
+        scores, emb1, emb2 = optimized(images1, images2)
+        head_scores = optimized.classifier(torch.cat([emb1, emb2], dim=1))
+
+    differences = {
+        "scores": (scores - expected_scores).abs().max().item(),
+        "embedding1": (emb1 - expected_emb1).abs().max().item(),
+        "embedding2": (emb2 - expected_emb2).abs().max().item(),
+        "head_only": (head_scores - expected_scores).abs().max().item(),
+    }
+    for name, difference in differences.items():
+        assert difference <= TOLERANCE, f"{name}: max abs difference {difference:.2e} exceeds {TOLERANCE:.0e}"
+
+    with torch.no_grad():
+        eager_ms = _time(lambda: model.model.forward_once(images1))
+    with torch.inference_mode():
+        optimized_ms = _time(lambda: optimized.forward_once(images1))
+    print(f"forward_once on 8 images: eager {eager_ms:.1f} ms, optimized {optimized_ms:.1f} ms")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-q", "-s"]))
@@ -0,0 +1,153 @@
+# backend/threading_config.py
+"""
+CPU thread budgets for TensorFlow and torch running in the same process.
+
+Left alone, both frameworks size their thread pools to every core and
+oversubscribe the machine under mixed /predict and /fashion-predict load.
+By default each framework gets half of the CPUs this process may use; the
+budgets can be set explicitly (0 keeps the framework's own default):
+
+    TF_INTRA_OP_THREADS     TensorFlow intra-op pool
+    TF_INTER_OP_THREADS     TensorFlow inter-op pool (default 2)
+    TORCH_THREADS           torch intra-op (OpenMP) pool
+    TORCH_INTEROP_THREADS   torch inter-op pool (default 1)
+
+The split favors mixed load: while only one model is busy it still gets
+only its half, so single-model throughput drops (roughly by half for
+CPU-bound batches). Deployments that run one model at a time, such as a
+worker that only classifies, should raise that framework's budget or set it
+to 0.
+
+CPU_AFFINITY=partition (off by default) additionally pins each framework to its own set of
+cores (Linux only). Model calls then run on a per-framework executor whose
+threads are pinned before the framework creates its pools, so the pools
+inherit the same CPU mask. The CPUs are split in proportion to the two
+intra-op budgets.
+"""
+import os
+import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+COMPONENT_FRAMEWORKS = {"classifier": "tensorflow", "fashion": "torch"}
+
+
+def _available_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+AVAILABLE_CPUS = _available_cpus()
+_half = max(1, len(AVAILABLE_CPUS) // 2)
+
+TF_INTRA_OP_THREADS = _env_int("TF_INTRA_OP_THREADS", _half)
+TF_INTER_OP_THREADS = _env_int("TF_INTER_OP_THREADS", 2)
+TORCH_THREADS = _env_int("TORCH_THREADS", max(1, len(AVAILABLE_CPUS) - _half))
+TORCH_INTEROP_THREADS = _env_int("TORCH_INTEROP_THREADS", 1)
+CPU_AFFINITY = os.environ.get("CPU_AFFINITY", "off").strip().lower()
+# Concurrent model calls per framework in partition mode
+MODEL_EXECUTOR_THREADS = _env_int("MODEL_EXECUTOR_THREADS", 2)
+
+_configured = set()
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_lock = threading.Lock()
+
+
+def configure_tensorflow():
+    """Apply the TensorFlow thread budget. Must run before TensorFlow executes any op."""
+    if "tensorflow" in _configured:
+        return
+    _configured.add("tensorflow")
+    import tensorflow as tf
+    try:
+        if TF_INTRA_OP_THREADS:
+            tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+        if TF_INTER_OP_THREADS:
+            tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+        logger.info(f"TensorFlow threads: intra-op {TF_INTRA_OP_THREADS or 'default'}, "
+                    f"inter-op {TF_INTER_OP_THREADS or 'default'}")
+    except RuntimeError as e:
+        logger.warning(f"TensorFlow already initialized, thread budget not applied: {e}")
+
+
+def configure_torch():
+    """Apply the torch thread budget. The inter-op size can only be set before torch runs any op."""
+    if "torch" in _configured:
+        return
+    _configured.add("torch")
+    import torch
+    if TORCH_THREADS:
+        torch.set_num_threads(TORCH_THREADS)
+    if TORCH_INTEROP_THREADS:
+        try:
+            torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+        except RuntimeError as e:
+            logger.warning(f"torch inter-op threads not applied: {e}")
+    logger.info(f"torch threads: intra-op {torch.get_num_threads()}, inter-op {torch.get_num_interop_threads()}")
+
+
+@functools.lru_cache(maxsize=None)
+def cpu_partition() -> Optional[Dict[str, List[int]]]:
+    """CPUs assigned to each framework, or None when affinity partitioning is off."""
+    if CPU_AFFINITY != "partition":
+        return None
+    if not hasattr(os, "sched_setaffinity") or len(AVAILABLE_CPUS) < 2:
+        logger.warning("CPU_AFFINITY=partition needs Linux and at least 2 CPUs; ignoring")
+        return None
+    tf_share = TF_INTRA_OP_THREADS or _half
+    torch_share = TORCH_THREADS or (len(AVAILABLE_CPUS) - _half)
+    split = round(len(AVAILABLE_CPUS) * tf_share / (tf_share + torch_share))
+    split = min(max(split, 1), len(AVAILABLE_CPUS) - 1)
+    return {"tensorflow": AVAILABLE_CPUS[:split], "torch": AVAILABLE_CPUS[split:]}
+
+
+def _pin_current_thread(cpus: List[int]):
+    # On Linux, pid 0 means the calling thread, not the whole process
+    os.sched_setaffinity(0, cpus)
+
+
+def model_executor(component: str) -> Optional[ThreadPoolExecutor]:
+    """
+    Pinned executor for a model component ("classifier" or "fashion"), or
+    None when partitioning is off and the shared threadpool should be used.
+    """
+    framework = COMPONENT_FRAMEWORKS.get(component)
+    partition = cpu_partition() if framework else None
+    if partition is None:
+        return None
+    with _lock:
+        executor = _executors.get(framework)
+        if executor is None:
+            cpus = partition[framework]
+            executor = ThreadPoolExecutor(
+                max_workers=MODEL_EXECUTOR_THREADS,
+                thread_name_prefix=f"{framework}-cpu",
+                initializer=_pin_current_thread,
+                initargs=(cpus,)
+            )
+            _executors[framework] = executor
+            logger.info(f"{framework} pinned to CPUs {cpus}")
+        return executor
+
+
+def describe() -> Dict:
+    """Current thread configuration, for health checks and benchmark reports."""
+    return {
+        "available_cpus": len(AVAILABLE_CPUS),
+        "tf_intra_op_threads": TF_INTRA_OP_THREADS,
+        "tf_inter_op_threads": TF_INTER_OP_THREADS,
+        "torch_threads": TORCH_THREADS,
+        "torch_interop_threads": TORCH_INTEROP_THREADS,
+        "cpu_affinity": CPU_AFFINITY,
+        "partition": cpu_partition()
+    }
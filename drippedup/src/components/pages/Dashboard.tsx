@@ -82,68 +82,24 @@ const Dashboard: React.FC<DashboardProps> = ({ onUploadClick, onOutfitClick, onW
     return () => window.removeEventListener('resize', handleResize);
   }, []);
 
-  const fetchRecentUploads = async () => {
+  // Recent uploads, outfit count and recent outfits in one request
+  const fetchDashboard = async () => {
     if (!user?.id) {
-      console.log('No user ID available for fetching recent uploads');
+      console.log('No user ID available for fetching dashboard data');
       setRecentUploads([]);
-      return;
-    }
-
-    try {
-      const response = await fetch(`${config.API_BASE_URL}/recent-uploads?user_id=${user.id}`);
-      if (response.ok) {
-        const data = await response.json();
-        setRecentUploads(data.recent_uploads || []);
-      } else {
-        throw new Error(`Failed to fetch recent uploads: ${response.status}`);
-      }
-    } catch (error) {
-      console.error('Error fetching recent uploads:', error);
-      setError('Failed to load recent uploads');
-    }
-  };
-
-  const fetchOutfitsCount = async () => {
-    if (!user?.id) {
-      console.log('No user ID available for fetching outfits count');
       setOutfitsCount(0);
-      return;
-    }
-
-    try {
-      const response = await fetch(`${config.API_BASE_URL}/outfits/basic?user_id=${user.id}`);
-      if (response.ok) {
-        const data = await response.json();
-        setOutfitsCount(data.count || 0);
-      } else {
-        throw new Error(`Failed to fetch outfits count: ${response.status}`);
-      }
-    } catch (error) {
-      console.error('Error fetching outfits count:', error);
-      setError('Failed to load outfits count');
-    }
-  };
-
-  const fetchRecentOutfits = async () => {
-    if (!user?.id) {
-      console.log('No user ID available for fetching recent outfits');
       setRecentOutfits([]);
       return;
     }
 
-    try {
-      const response = await fetch(`${config.API_BASE_URL}/outfits/recent/3?user_id=${user.id}`);
-      if (response.ok) {
-        const data = await response.json();
-        setRecentOutfits(data.outfits || []);
-      } else {
-        console.error('Failed to fetch recent outfits');
-      }
-    } catch (error) {
-      console.error('Error fetching recent outfits:', error);
-    } finally {
-      setOutfitsLoading(false);
+    const response = await fetch(`${config.API_BASE_URL}/dashboard?user_id=${user.id}&uploads=10&outfits=3`);
+    if (!response.ok) {
+      throw new Error(`Failed to fetch dashboard data: ${response.status}`);
     }
+    const data = await response.json();
+    setRecentUploads(data.recent_uploads || []);
+    setOutfitsCount(data.outfits_count || 0);
+    setRecentOutfits(data.recent_outfits || []);
   };
 
   // Initial data fetch
@@ -155,11 +111,7 @@ const Dashboard: React.FC<DashboardProps> = ({ onUploadClick, onOutfitClick, onW
         setError(null);
         
         try {
-          await Promise.all([
-            fetchRecentUploads(),
-            fetchOutfitsCount(),
-            fetchRecentOutfits()
-          ]);
+          await fetchDashboard();
         } catch (err) {
           console.error('Error fetching dashboard data:', err);
           setError('Failed to load dashboard data');
@@ -229,11 +181,7 @@ const Dashboard: React.FC<DashboardProps> = ({ onUploadClick, onOutfitClick, onW
     setError(null);
     
     try {
-      await Promise.all([
-        fetchRecentUploads(),
-        fetchOutfitsCount(),
-        fetchRecentOutfits()
-      ]);
+      await fetchDashboard();
     } catch (error) {
       console.error('Error refreshing data:', error);
       setError('Failed to refresh data');
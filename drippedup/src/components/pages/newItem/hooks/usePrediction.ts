@@ -1,5 +1,6 @@
 import { useState } from 'react';
 import config from '../../../../config';
+import { useAuth } from '../../../../contexts/AuthContext';
 
 interface PredictionResult {
   predicted_class_name: string;
@@ -20,6 +21,7 @@ interface UsePredictionReturn {
 }
 
 export const usePrediction = (onCategoryPredicted?: (category: string) => void): UsePredictionReturn => {
+  const { user } = useAuth();
   const [isPredicting, setIsPredicting] = useState(false);
   const [predictionResult, setPredictionResult] = useState<PredictionResult | null>(null);
   const [predictionError, setPredictionError] = useState<string | null>(null);
@@ -37,9 +39,11 @@ export const usePrediction = (onCategoryPredicted?: (category: string) => void):
       const formData = new FormData();
       formData.append('file', file);
 
+      // The server schedules model work fairly per user
       const response = await fetch(`${config.API_BASE_URL}/predict`, {
         method: 'POST',
         body: formData,
+        headers: user?.id ? { 'X-User-Id': user.id } : undefined,
       });
 
       if (!response.ok) {
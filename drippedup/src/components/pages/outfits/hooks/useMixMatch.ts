@@ -1,5 +1,6 @@
 import { useState } from 'react';
 import config from '../../../../config';
+import { useAuth } from '../../../../contexts/AuthContext';
 
 interface ClothingItem {
   id: string;
@@ -25,7 +26,14 @@ interface FashionPredictResponse {
   }>;
 }
 
+// The server sheds /fashion-predict calls it cannot answer within this budget
+const PREDICT_DEADLINE_MS = 10000;
+const MAX_OVERLOAD_RETRIES = 2;
+
+const sleep = (ms: number) => new Promise(resolve => setTimeout(resolve, ms));
+
 const useMixMatch = () => {
+  const { user } = useAuth();
   const [matchResults, setMatchResults] = useState<MatchResult[]>([]);
   const [isMatching, setIsMatching] = useState(false);
   const [matchType, setMatchType] = useState<'category' | 'outfit' | null>(null);
@@ -40,12 +48,29 @@ const useMixMatch = () => {
       const formData = new FormData();
       formData.append('item_id1', selectedItem.id);
       formData.append('item_id2', compareItem.id);
+      // The server schedules model work fairly per user
+      const predictHeaders: Record<string, string> = { 'X-Request-Deadline-Ms': String(PREDICT_DEADLINE_MS) };
+      if (user?.id) {
+        predictHeaders['X-User-Id'] = user.id;
+      }
 
-      const response = await fetch(`${config.API_BASE_URL}/fashion-predict`, {
+      let response = await fetch(`${config.API_BASE_URL}/fashion-predict`, {
         method: 'POST',
         body: formData,
+        headers: predictHeaders,
       });
 
+      // Overloaded: wait as long as the server asks, then try again
+      for (let attempt = 0; response.status === 503 && attempt < MAX_OVERLOAD_RETRIES; attempt++) {
+        const retryAfter = Number(response.headers.get('Retry-After')) || 1;
+        await sleep(retryAfter * 1000);
+        response = await fetch(`${config.API_BASE_URL}/fashion-predict`, {
+          method: 'POST',
+          body: formData,
+          headers: predictHeaders,
+        });
+      }
+
       if (!response.ok) {
         const errorData = await response.json().catch(() => ({}));
         throw new Error(errorData.error || `HTTP error! status: ${response.status}`);